@@ -6,6 +6,9 @@ notes:
 - designed to load upto 3 user supplied soil dbf's; cmp/snf/slf. the corresponding spatialite db will contain these tables with generic names of cmp/snf/slf if
 corresponding dbf's passed in
 - the cmp table is required at a minimum. cmp table is converted via qgis api to spatialite db. other dbf's exported as csv and loaded into new db.
+- with option_load_processes > 1, snf/slf dbf's are loaded by worker processes into staging files while cmp is converted, then copied into new db
+- with option_incremental_rebuild, an existing db of same name is kept and only tables whose source dbf changed are reloaded, indexed and analyzed.
+join tables built from reloaded tables are dropped. a changed cmp dbf always rebuilds the whole db. source dbf's are recorded in "sourceManifest" table
 
 requirements:
 - designed to use QGIS 2.2 Valmeria
@@ -42,6 +45,8 @@ richardburcher@gmail.com
 ##option_soil_cmp_table_cmp_column=string cmp
 ##option_soil_cmp_table_percent_column=string percent
 ##option_soil_slf_table_layer_number_column=string layer_no
+##option_load_processes=number 1
+##option_incremental_rebuild=boolean True
 #===========
 
 from PyQt4.QtCore import *
@@ -64,9 +69,8 @@ scriptDirectory = os.path.join(QFileInfo(QgsApplication.qgisUserDbFilePath()).pa
 sys.path.append(scriptDirectory)
 
 # import aafc_modules
-import aafc_io as inout
 import aafc_utilities as utilities
-import aafc_database as database
+import aafc_headless as headless
 
 # create utility class instance. pass qgis supplied iface
 utils = utilities.Utils(iface)
@@ -79,9 +83,6 @@ inSoilDbPath = os.path.join(soil_database_folder, soil_database_name + ".sqlite"
 # ========== create class instances
 # get path to temp directory
 tempSystemDirectoryPath = utils.determineSystemTempDirectory()
-  
-# class instance of io
-io = inout.Io(inSoilDbPath=inSoilDbPath, tempSystemDirectoryPath=tempSystemDirectoryPath)
  
 #========== create new db 
 # validate user input. returns (message, boolean)
@@ -97,41 +98,21 @@ tableNamesToDbfPaths = utils.getTableNamesToPathFromDbfPaths(cmp_dbf_path, snf_d
 # inform user that db creation is about to start
 utils.communicateWithUserInQgis("Creating new db...",level="INFO", messageExistanceDuration=4)    
    
-# remove existing db if user provides same name
-utils.deleteFile(os.path.join(soil_database_folder, soil_database_name))
- 
 #========== create db and load with passed dbf paths
-# create new db
-loadStatus = io.createNewDb(tableNamesToDbfPaths)
-if not loadStatus:
+# existing db of same name kept with incremental rebuild; only tables of changed dbf's reloaded, indexed and analyzed
+try:
+    db, loadedTables, loadMessages = headless.createSoilDb(inSoilDbPath, tableNamesToDbfPaths, tempSystemDirectoryPath, dbSoilKey=option_soil_tables_soil_key_column, dbSlcKey=option_soil_cmp_table_slc_id_column, dbCmpKey=option_soil_cmp_table_cmp_column, dbPercentKey=option_soil_cmp_table_percent_column, dbLayerNumberKey=option_soil_slf_table_layer_number_column, processes=int(option_load_processes), incremental=option_incremental_rebuild, spatialite=True)
+except Exception:
     # issue loading layers qith qgis api
     utils.communicateWithUserInQgis("Problem loading/processing user dbf files into db. Are dbf's okay? Stopping.", level="CRITICAL", messageExistanceDuration=10)
-    raise Exception("Problem loading dbf's into db")
-   
-# create database class instance
-# db must exist before sqlite connection can exit
-db = database.Db(inSoilDbPath, tempSystemDirectoryPath)
-
-#========== db maintaince 
-# change initial loaded cmp table name from db name to "cmp"
-db.updateDbTableName("cmp")
-
-# list of soil tables present in db
-soilTablesPresent = db.getSoilTablesListing()
-  
-# user determines what tables they want to work with
-tableOptionsForProcessing = utils.getTableProcessingOptions(soilTablesPresent)
-
-# create new table table to hold user options for processing. user can only work with cmp or cmp-snf or cmp-snf-slf
-# table is used when user is determining how to set up joins if requested for processing
-db.createUserTableProcessingOptions(tableOptionsForProcessing)
+    raise
 
-#========== index loaded soil data tables
-# for speed up on joins and queries
-db.createDbIndexesOnLoadedData(soilTablesPresent, option_soil_tables_soil_key_column, option_soil_cmp_table_slc_id_column, option_soil_cmp_table_cmp_column, option_soil_cmp_table_percent_column, option_soil_slf_table_layer_number_column)
+# rows loaded and load speed per table
+for loadMsg in loadMessages:
+    print loadMsg
 
 # report db creation success
-msg = "Db successfully created. Find in directory %s" %(soil_database_folder)
+msg = "Db successfully created. Tables loaded: %s. Find in directory %s" %(", ".join(loadedTables) or "none", soil_database_folder)
 utils.communicateWithUserInQgis(msg, messageExistanceDuration=10)
 
 #========== clean up
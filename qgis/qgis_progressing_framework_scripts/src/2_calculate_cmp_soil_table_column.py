@@ -32,6 +32,10 @@ richardburcher@gmail.com
 ##option_soil_cmp_table_slc_id_column=string sl
 ##option_soil_cmp_table_percent_column=string percent
 ##option_csv_load_file_into_qgis=boolean True
+##option_numpy_calculation=boolean False
+##option_calculation_cache=boolean True
+##option_slc_id_chunk_size=number 0
+##option_statistics=string
 ##option_csv_output_directory=folder
 ##option_csv_file_prefix=string calculation
 #===========
@@ -58,6 +62,7 @@ sys.path.append(scriptDirectory)
 import aafc_io as inout
 import aafc_utilities as utilities
 import aafc_database as database
+import aafc_cache as cache
 
 # ========== create class instances
 # create utility class instance. pass qgis supplied iface
@@ -74,19 +79,35 @@ inSoilDbPath = utils.getQgisTableLayerFilePathInfo(cmp_soil_table)
 # db instance
 db = database.Db(inSoilDbPath, tempSystemDirectoryPath)
 
-# db performance tuning
-db.sqliteLoadingPerformanceTuning(enable=True)
+# db performance tuning. no vacuum; db file left unchanged so cached results are reused
+db.sqliteLoadingPerformanceTuning(enable=True, vacuum=False)
+
+# calculation backend. numpy used if installed
+if option_numpy_calculation:
+    db.calculationBackend = "numpy"
+
+# reuse results calculated in previous runs for unchanged soil db and slc ids
+if option_calculation_cache:
+    db.resultCache = cache.ResultCache(cache.getCacheDirectory(tempSystemDirectoryPath))
 
 
 #========== get spatial selection of polygon slc units to process
 # if no sub-selection, assume all polygons to be processed
-msg,slcIds,status = utils.getVectorLayerFieldValues(slc_shapefile, slc_shapefile_polygon_id_column)
-if not status:
-    # problem with getting values from vector layer for slc ids
-    utils.communicateWithUserInQgis("No values for field in given vector layer for slc ids. Stopping.",level="CRITICAL", messageExistanceDuration=15)
-    raise Exception(msg)
+chunkSize = int(option_slc_id_chunk_size)
+if chunkSize > 0:
+    # slc ids read from layer chunk by chunk as they are calculated. memory use does not grow with selection
+    slcIds = utils.iterateVectorLayerFieldValues(slc_shapefile, slc_shapefile_polygon_id_column)
+else:
+    msg,slcIds,status = utils.getVectorLayerFieldValues(slc_shapefile, slc_shapefile_polygon_id_column)
+    if not status:
+        # problem with getting values from vector layer for slc ids
+        utils.communicateWithUserInQgis("No values for field in given vector layer for slc ids. Stopping.",level="CRITICAL", messageExistanceDuration=15)
+        raise Exception(msg)
   
 #===== process soil field
+# statistics to calculate. comma separated ie weighted_average,weighted_median. empty for default calculation
+statistics = [x.strip() for x in option_statistics.split(",") if x.strip()]
+
 # column field must be qouted as '"field_to_calculate"'
 calculationColumnName = '"%s"' %(cmp_soil_column_to_calculate)
  
@@ -97,7 +118,11 @@ tableName = utils.getQgisTableLayerFilePathInfo(cmp_soil_table, pathKey="table")
 message = "Calculating column %s may take several minutes" % (calculationColumnName)
 utils.communicateWithUserInQgis(message,messageExistanceDuration=10)
     
-headers, results = db.calculateField(slcIds, dbSlcKey=option_soil_cmp_table_slc_id_column, tableName=tableName, columnName=calculationColumnName, dbPercentKey=option_soil_cmp_table_percent_column)
+if chunkSize > 0:
+    # results of slc id chunks streamed to csv
+    headers, results = db.calculateFieldInChunks(slcIds, dbSlcKey=option_soil_cmp_table_slc_id_column, tableName=tableName, columnName=calculationColumnName, dbPercentKey=option_soil_cmp_table_percent_column, chunkSize=chunkSize, statistics=statistics)
+else:
+    headers, results = db.calculateField(slcIds, dbSlcKey=option_soil_cmp_table_slc_id_column, tableName=tableName, columnName=calculationColumnName, dbPercentKey=option_soil_cmp_table_percent_column, statistics=statistics)
 outCsvFilePath = io.writeCsvFile(calculationColumnName, headers, results, option_csv_output_directory, csvFilePrefixName=option_csv_file_prefix)
  
 # inform user processing finished
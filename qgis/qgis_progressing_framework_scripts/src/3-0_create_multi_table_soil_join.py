@@ -6,11 +6,14 @@ notes:
 -join is dynamic. based on user tables + join criteria
 -join based on linking cmp table slc id + each cmp id row for that slc (this makes unique cmp row) by soilkey to snf and then slf if requested. the
 result is a single row per slc id + cmp in the new join table
--for each run of this script, the "joinedResults" join table is dropped and recreated
+-for each run of this script, the "joinedResults" join table is dropped and recreated. with incremental join update only rows of
+slc ids added to or removed from the selection are processed, provided the join tables, land use and layer number are unchanged
+-with join cache, previous join tables are kept in the soil db per join tables/land use/layer number/slc id selection. rerunning an
+earlier selection restores its join table without recalculating
 -user must select shapefile column that defines the slc ids. thses are used for processing
 if no polygons selected than all polygons processed
 -join driven by user selected "permittedOperations" gui selection. depending on soil tables in db, user
-can either select cmp, cmp-snf or cmp-snf-slf
+can either select cmp, cmp-snf, cmp-snf-slf or cmp-slf
 -tables joined by soilkey or soilmap column
 -for snf table join, the user land user preference of A/N can be selected. default selection is N if user choice can not be accomidated
 -for slf table, layer number used to select row. if user selected layer number not found, then that join row will be dropped
@@ -47,6 +50,10 @@ richardburcher@gmail.com
 ##option_soil_cmp_table_cmp_column=string cmp
 ##option_soil_cmp_table_percent_column=string percent
 ##option_soil_slf_table_layer_number_column=string layer_no
+##option_incremental_join_update=boolean True
+##option_join_cache=boolean True
+##option_join_cache_budget_mb=number 1024
+##option_join_processes=number 1
 #===========
 
 from PyQt4.QtCore import *
@@ -71,6 +78,7 @@ sys.path.append(scriptDirectory)
 import aafc_io as inout
 import aafc_utilities as utilities
 import aafc_database as database
+import aafc_join as join
 
 # ========== create class instances
 # create utility class instance. pass qgis supplied iface
@@ -101,22 +109,16 @@ if not status:
 #TODO: check if vector layer slc ids found in cmp table
 
 #========== join soil tables together
-#TODO: should extract column number inplace of using text
-if soil_tables_to_join == "cmp-snf":
-    # join requested
-    # 2 table join -- cmp - snf tables
-    db.resultsTableJoiningCmpSnfBySoilkey(slcIds, dbSlcKey=option_soil_cmp_table_slc_id_column, dbCmpKey=option_soil_cmp_table_cmp_column, dbSoilKey=option_soil_tables_soil_key_column, cmpTableName="cmp", snfTableName="snf", landuse=user_preference_snf_table_land_use, writeTestCsv=False, writeTestCsvDirectory=None)
-    calculationTableName = db.joinTableName
-      
-elif soil_tables_to_join == "cmp-snf-slf":
-    # 3 table join -- cmp - snf - slf
-    db.resultsTableJoiningCmpSnfSlfBySoilkey(slcIds, dbSlcKey=option_soil_cmp_table_slc_id_column, dbCmpKey=option_soil_cmp_table_cmp_column, dbSoilKey=option_soil_tables_soil_key_column, dbLayerNumberKey=option_soil_slf_table_layer_number_column, cmpTableName="cmp", snfTableName="snf", slfTableName="slf", landuse=user_preference_snf_table_land_use, layerNumber=user_preference_slf_table_layer_number, writeTestCsv=False, writeTestCsvDirectory=False)
-    calculationTableName = db.joinTableName  
-
-
-#========== create indexes on all columns in join table
-# speed up field calculations
-db.createDbIndexesOnJoinedTable()
+# join shape from user selected option ie cmp-snf, cmp-snf-slf or cmp-slf
+joinSpec = join.createSoilJoinSpec(soil_tables_to_join.split("-"), dbSlcKey=option_soil_cmp_table_slc_id_column, dbSoilKey=option_soil_tables_soil_key_column, landuse=user_preference_snf_table_land_use, dbLayerNumberKey=option_soil_slf_table_layer_number_column, layerNumber=user_preference_slf_table_layer_number)
+db.joinCacheBudgetBytes = int(option_join_cache_budget_mb * 1024 * 1024)
+db.createJoinTable(joinSpec, slcIds, incremental=option_incremental_join_update, useCache=option_join_cache, processes=int(option_join_processes))
+calculationTableName = db.joinTableName
+
+
+#========== create indexes on join table
+# speed up field calculations. covering slc id + percent index; column indexes created on demand by calculations
+db.createDbIndexesOnJoinedTable(option_soil_cmp_table_slc_id_column, option_soil_cmp_table_percent_column)
 
 #========== add new join table to qgis
 # remove existing join table if present
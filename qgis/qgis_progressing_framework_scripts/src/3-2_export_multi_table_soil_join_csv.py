@@ -0,0 +1,105 @@
+"""
+purpose:
+write join rows linking cmp + snf, cmp + snf + slf or cmp + slf straight to csv
+
+notes:
+-same join as script 3-0 but no join table is created. soil db is left untouched
+-join rows are streamed from the db to the csv file; memory use does not grow with the selection
+-user must select shapefile column that defines the slc ids. thses are used for processing
+if no polygons selected than all polygons processed
+-for snf table join, the user land user preference of A/N can be selected. default selection is N if user choice can not be accomidated
+-for slf table, layer number used to select row. if user selected layer number not found, then that join row will be dropped
+
+input:
+-slc shapefile field defining the slc ids
+-join option provided by "availableSoilTableJoins"
+
+output:
+-csv of joined rows named after prefix and "joinedSoilTables"
+-does not load into qgis
+
+license:
+- gpl3
+
+by:
+richard burcher
+richardburcher@gmail.com
+2014
+"""
+
+#==========
+# sets up gui in qgis processing framework
+##[AAFC Soil Tools]=group
+##available_soil_table_joins=table
+##soil_tables_to_join=field available_soil_table_joins
+##slc_shapefile=vector
+##slc_shapefile_polygon_id_column=field slc_shapefile
+##user_preference_snf_table_land_use=string A
+##user_preference_slf_table_layer_number=number 4
+##option_soil_tables_soil_key_column=string soilkey
+##option_soil_cmp_table_slc_id_column=string sl
+##option_soil_slf_table_layer_number_column=string layer_no
+##option_csv_output_directory=folder
+##option_csv_file_prefix=string join
+#===========
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+from qgis.core import *
+from qgis.gui import *
+from qgis.utils import *
+import os
+import sys
+import sqlite3
+
+# aafc module name containing submodules for soil db work
+aafcModuleName = "aafc_modules"
+
+# add aafc module name directory to python path. found as .qgis2/processing/scripts/name_of_aafc_module
+scriptDirectory = os.path.join(QFileInfo(QgsApplication.qgisUserDbFilePath()).path(), "processing/scripts",aafcModuleName)
+
+# add to aafc module directory to python path
+sys.path.append(scriptDirectory)
+
+# import aafc_modules
+import aafc_io as inout
+import aafc_utilities as utilities
+import aafc_database as database
+import aafc_join as join
+
+# ========== create class instances
+# create utility class instance. pass qgis supplied iface
+utils = utilities.Utils(iface)
+
+# get path to temp directory
+tempSystemDirectoryPath = utils.determineSystemTempDirectory()
+
+# io instance
+io = inout.Io(tempSystemDirectoryPath=tempSystemDirectoryPath)
+
+# get db path from available soil table joins layer in qgis
+inSoilDbPath = utils.getQgisTableLayerFilePathInfo(available_soil_table_joins)
+# db instance. no performance tuning; db must not be modified
+db = database.Db(inSoilDbPath, tempSystemDirectoryPath)
+
+#========== get spatial selection of polygon slc units to process
+# if no sub-selection, assume all polygons to be processed
+msg,slcIds,status = utils.getVectorLayerFieldValues(slc_shapefile, slc_shapefile_polygon_id_column)
+if not status:
+    # problem with getting values from vector layer for slc ids
+    utils.communicateWithUserInQgis("No values for field in given vector layer for slc ids. Stopping.",level="CRITICAL", messageExistanceDuration=15)
+    raise Exception(msg)
+
+#========== stream joined rows to csv
+# join shape from user selected option ie cmp-snf, cmp-snf-slf or cmp-slf
+joinSpec = join.createSoilJoinSpec(soil_tables_to_join.split("-"), dbSlcKey=option_soil_cmp_table_slc_id_column, dbSoilKey=option_soil_tables_soil_key_column, landuse=user_preference_snf_table_land_use, dbLayerNumberKey=option_soil_slf_table_layer_number_column, layerNumber=user_preference_slf_table_layer_number)
+headers, rows = db.streamJoinRows(joinSpec, slcIds)
+outCsvFilePath = io.writeCsvFile(db.joinTableName, headers, rows, option_csv_output_directory, csvFilePrefixName=option_csv_file_prefix)
+
+# inform user processing finished
+msg = "Finished writing soil table joins for tables %s. Find output CSV in directory %s" %(soil_tables_to_join, option_csv_output_directory)
+utils.communicateWithUserInQgis(msg, messageExistanceDuration=10)
+
+#========== clean up
+# remove added aafc soil module from python path
+sys.path.pop()
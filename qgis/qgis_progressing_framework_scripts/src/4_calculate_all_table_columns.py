@@ -12,6 +12,7 @@ table for processing
 
 output:
 -csv for each column
+-wide output; single csv or soil db table named after prefix and table holding all columns per slc id
 -does not load into qgis
 
 license:
@@ -31,6 +32,12 @@ richardburcher@gmail.com
 ##slc_shapefile_polygon_id_column=field slc_shapefile
 ##option_soil_cmp_table_slc_id_column=string sl
 ##option_soil_cmp_table_percent_column=string percent
+##option_numpy_calculation=boolean False
+##option_calculation_cache=boolean True
+##option_slc_id_chunk_size=number 0
+##option_calculation_processes=number 1
+##option_wide_output=boolean False
+##option_wide_output_to_soil_db=boolean False
 ##option_csv_output_directory=folder
 ##option_csv_file_prefix=string calculation
 #===========
@@ -57,6 +64,7 @@ sys.path.append(scriptDirectory)
 import aafc_io as inout
 import aafc_utilities as utilities
 import aafc_database as database
+import aafc_cache as cache
 
 # ========== create class instances
 # create utility class instance. pass qgis supplied iface
@@ -73,16 +81,29 @@ inSoilDbPath = utils.getQgisTableLayerFilePathInfo(soil_table)
 # db instance
 db = database.Db(inSoilDbPath, tempSystemDirectoryPath)
 
-# db performance tuning
-db.sqliteLoadingPerformanceTuning(enable=True)
+# db performance tuning. no vacuum; db file left unchanged so cached results are reused
+db.sqliteLoadingPerformanceTuning(enable=True, vacuum=False)
+
+# calculation backend. numpy used if installed
+if option_numpy_calculation:
+    db.calculationBackend = "numpy"
+
+# reuse results calculated in previous runs for unchanged soil db and slc ids
+if option_calculation_cache:
+    db.resultCache = cache.ResultCache(cache.getCacheDirectory(tempSystemDirectoryPath))
 
 #========== get spatial selection of polygon slc units to process
 # if no sub-selection, assume all polygons to be processed
-msg,slcIds,status = utils.getVectorLayerFieldValues(slc_shapefile, slc_shapefile_polygon_id_column)
-if not status:
-    # problem with getting values from vector layer for slc ids
-    utils.communicateWithUserInQgis("No values for field in given vector layer for slc ids. Stopping.",level="CRITICAL", messageExistanceDuration=15)
-    raise Exception(msg)
+chunkSize = int(option_slc_id_chunk_size)
+if chunkSize > 0:
+    # slc ids read from layer chunk by chunk as they are calculated. memory use does not grow with selection
+    slcIds = utils.iterateVectorLayerFieldValues(slc_shapefile, slc_shapefile_polygon_id_column)
+else:
+    msg,slcIds,status = utils.getVectorLayerFieldValues(slc_shapefile, slc_shapefile_polygon_id_column)
+    if not status:
+        # problem with getting values from vector layer for slc ids
+        utils.communicateWithUserInQgis("No values for field in given vector layer for slc ids. Stopping.",level="CRITICAL", messageExistanceDuration=15)
+        raise Exception(msg)
  
 #===== process each column
 #TODO: should be able to exclude certain columns ie slc, percent, soilkey
@@ -90,24 +111,48 @@ if not status:
 # convert full connection path of user selected table in qgis toc to actual table name
 tableName = utils.getQgisTableLayerFilePathInfo(soil_table, pathKey="table")
 
-# get listing of fields in table
-columnsToProcess = db.getTableFieldNames(tableName)
+# get listing of fields in table. derived soilkey columns are not calculated
+columnsToProcess = [x for x in db.getTableFieldNames(tableName) if x.lower() not in db.normalizedSoilKeyColumns]
 
 # warn user process may take several minutes
 message = "Calculating all columns for table %s may take several minutes" % (soil_table)
 utils.communicateWithUserInQgis(message,messageExistanceDuration=10)
 
-for column in columnsToProcess:
-    # process each column
-    # column field must be qouted as '"field_to_calculate"'
-    calculationColumnName = '"%s"' %(column)
+# column field must be qouted as '"field_to_calculate"'
+calculationColumnNames = ['"%s"' %(column) for column in columnsToProcess]
+
+if option_wide_output and option_wide_output_to_soil_db:
+    # all columns into single results table in soil db
+    wideTableName = "%s_%s" %(option_csv_file_prefix, tableName)
+    db.createWideCalculationTable(slcIds, dbSlcKey=option_soil_cmp_table_slc_id_column, tableName=tableName, columnNames=calculationColumnNames, dbPercentKey=option_soil_cmp_table_percent_column, resultsTableName=wideTableName, chunkSize=chunkSize)
+elif option_wide_output:
+    # all columns into single csv. rows streamed to disk
+    headers, rows = db.calculateFieldsWide(slcIds, dbSlcKey=option_soil_cmp_table_slc_id_column, tableName=tableName, columnNames=calculationColumnNames, dbPercentKey=option_soil_cmp_table_percent_column, chunkSize=chunkSize)
+    outCsvFilePath = io.writeCsvFile(tableName, headers, rows, option_csv_output_directory, csvFilePrefixName=option_csv_file_prefix)
+elif chunkSize > 0:
+    # results of slc id chunks appended to csv per column
+    calculatedChunks = db.iterateCalculatedFieldsChunks(slcIds, dbSlcKey=option_soil_cmp_table_slc_id_column, tableName=tableName, columnNames=calculationColumnNames, dbPercentKey=option_soil_cmp_table_percent_column, chunkSize=chunkSize)
+    
+    for chunkNumber, calculatedColumns in enumerate(calculatedChunks):
+        for calculationColumnName, headers, results in calculatedColumns:
+            # csv per column created by first chunk
+            outCsvFilePath = io.writeCsvFile(calculationColumnName, headers, results, option_csv_output_directory, csvFilePrefixName=option_csv_file_prefix, append=chunkNumber > 0)
+elif int(option_calculation_processes) > 1:
+    # columns split over worker processes. each worker writes its csv files
+    calculatedCsvFiles = db.calculateFieldsInParallel(slcIds, dbSlcKey=option_soil_cmp_table_slc_id_column, tableName=tableName, columnNames=calculationColumnNames, dbPercentKey=option_soil_cmp_table_percent_column, processes=int(option_calculation_processes), csvOutputDirectory=option_csv_output_directory, csvFilePrefixName=option_csv_file_prefix)
+else:
+    # calculate all columns with single read of table
+    calculatedColumns = db.calculateFields(slcIds, dbSlcKey=option_soil_cmp_table_slc_id_column, tableName=tableName, columnNames=calculationColumnNames, dbPercentKey=option_soil_cmp_table_percent_column)
     
-    # calculate column
-    headers, results = db.calculateField(slcIds, dbSlcKey=option_soil_cmp_table_slc_id_column, tableName=tableName, columnName=calculationColumnName, dbPercentKey=option_soil_cmp_table_percent_column)
-    outCsvFilePath = io.writeCsvFile(calculationColumnName, headers, results, option_csv_output_directory, csvFilePrefixName=option_csv_file_prefix)
+    for calculationColumnName, headers, results in calculatedColumns:
+        # write csv per column
+        outCsvFilePath = io.writeCsvFile(calculationColumnName, headers, results, option_csv_output_directory, csvFilePrefixName=option_csv_file_prefix)
 
 # inform user processing finished
-msg = "Finished processing all columns for table %s. Find output CSV in directory %s" %(tableName, option_csv_output_directory)
+if option_wide_output and option_wide_output_to_soil_db:
+    msg = "Finished processing all columns for table %s. Find results in soil db table %s" %(tableName, wideTableName)
+else:
+    msg = "Finished processing all columns for table %s. Find output CSV in directory %s" %(tableName, option_csv_output_directory)
 utils.communicateWithUserInQgis(msg, messageExistanceDuration=10)
 
 #========== clean up
@@ -0,0 +1,76 @@
+"""
+purpose:
+remove all previously calculated column results from the calculation cache
+
+notes:
+-scripts 2, 3-1 and 4 reuse cached results when soil db and slc ids are unchanged. cache is trimmed automatically
+when it outgrows its size budget; purging frees all of its disk space at once
+-soil db is not touched
+-if no cache directory given, default cache directory in system temp directory is purged
+
+input:
+-optional cache directory
+
+output:
+-none
+
+license:
+- gpl3
+
+by:
+richard burcher
+richardburcher@gmail.com
+2014
+"""
+
+#==========
+# sets up gui in qgis processing framework
+##[AAFC Soil Tools]=group
+##option_calculation_cache_directory=folder
+#===========
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+from qgis.core import *
+from qgis.gui import *
+from qgis.utils import *
+import os
+import sys
+
+# aafc module name containing submodules for soil db work
+aafcModuleName = "aafc_modules"
+
+# add aafc module name directory to python path. found as .qgis2/processing/scripts/name_of_aafc_module
+scriptDirectory = os.path.join(QFileInfo(QgsApplication.qgisUserDbFilePath()).path(), "processing/scripts",aafcModuleName)
+
+# add to aafc module directory to python path
+sys.path.append(scriptDirectory)
+
+# import aafc_modules
+import aafc_utilities as utilities
+import aafc_cache as cache
+
+# ========== create class instances
+# create utility class instance. pass qgis supplied iface
+utils = utilities.Utils(iface)
+
+# get path to temp directory
+tempSystemDirectoryPath = utils.determineSystemTempDirectory()
+
+# default cache directory used by calculation scripts
+if option_calculation_cache_directory:
+    cacheDirectory = option_calculation_cache_directory
+else:
+    cacheDirectory = cache.getCacheDirectory(tempSystemDirectoryPath)
+
+#========== purge cache
+resultCache = cache.ResultCache(cacheDirectory)
+removedCount, removedBytes = resultCache.purge()
+
+# inform user processing finished
+msg = "Finished purging calculation cache %s. Removed %s cached results, freeing %0.1f MB" %(cacheDirectory, removedCount, removedBytes / (1024.0 * 1024.0))
+utils.communicateWithUserInQgis(msg, messageExistanceDuration=10)
+
+#========== clean up
+# remove added aafc soil module from python path
+sys.path.pop()
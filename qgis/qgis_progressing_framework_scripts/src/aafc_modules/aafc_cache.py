@@ -0,0 +1,298 @@
+"""
+purpose:
+persistent on disk cache of calculated column results. results are reused across qgis sessions
+
+how:
+python. json file per cache entry in cache directory. file name is the entry key
+
+notes:
+-keys are content addressed. built from soil db fingerprint, table, column, slc id set and calculation type; see makeKey().
+any change to the soil db results in new keys, old entries are never read again and age out
+-least recently used entries evicted when cache grows over its size budget. reading an entry marks it used
+-cache directory can be purged by user. see script "5_purge_calculation_cache"
+-entries are plain json, never code. cache directory is per user and only accessible by its owner; see ResultCache()
+-no qgis dependency
+
+license:
+gpl3
+
+developer:
+richard burcher
+richardburcher@gmail.com
+2014
+"""
+
+import os
+import stat
+import json
+import getpass
+import hashlib
+
+
+# cache directory name within system temp directory. user name appended
+cacheDirectoryName = "aafc_calculation_cache"
+
+# cache entry file extension
+cacheFileExtension = ".json"
+
+
+class ResultCache:
+    """
+    purpose:
+    size bounded lru cache of calculation results on disk
+
+    notes:
+    -cache directory created readable by owner only. raises OSError if existing directory is not a directory owned by
+    current user ie planted by another user of shared temp directory; permissions of own directory are tightened
+    -ownership not checked on windows; temp directory is per user
+    """
+
+    def __init__(self, cacheDirectory, budgetBytes=256 * 1024 * 1024):
+        # directory holding cache entry files
+        self.cacheDirectory = cacheDirectory
+
+        # disk budget. least recently used entries are removed when exceeded
+        self.budgetBytes = budgetBytes
+
+        if not os.path.lexists(self.cacheDirectory):
+            os.makedirs(self.cacheDirectory, 0700)
+
+        self.checkCacheDirectory()
+
+
+    def checkCacheDirectory(self):
+        """
+        purpose:
+        make sure cache directory is private to current user
+
+        returns:
+        nothing
+        """
+
+        # symlinks not followed; could point anywhere
+        directoryStat = os.lstat(self.cacheDirectory)
+        if not stat.S_ISDIR(directoryStat.st_mode):
+            raise OSError("calculation cache %s is not a directory" %(self.cacheDirectory))
+
+        if not hasattr(os, "getuid"):
+            return
+
+        if directoryStat.st_uid != os.getuid():
+            raise OSError("calculation cache directory %s is not owned by current user. remove it or use other cache directory" %(self.cacheDirectory))
+
+        if stat.S_IMODE(directoryStat.st_mode) & 0077:
+            os.chmod(self.cacheDirectory, 0700)
+
+
+    def getEntryFilePath(self, key):
+        """
+        purpose:
+        file path of cache entry
+
+        returns:
+        path string
+        """
+
+        return os.path.join(self.cacheDirectory, key + cacheFileExtension)
+
+
+    def get(self, key):
+        """
+        purpose:
+        cached value of key
+
+        notes:
+        -entry file modified time set to now. used as last used time for lru eviction
+        -unreadable entries ie partly written or corrupt are removed and count as not cached
+        -json; tuples are returned as lists, strings as unicode
+
+        returns:
+        cached value or None if not cached
+        """
+
+        entryFilePath = self.getEntryFilePath(key)
+
+        if not os.path.exists(entryFilePath):
+            return None
+
+        try:
+            with open(entryFilePath, "rb") as f:
+                value = json.load(f)
+            os.utime(entryFilePath, None)
+        except Exception:
+            self.removeEntryFile(entryFilePath)
+            return None
+
+        return value
+
+
+    def put(self, key, value, evict=True):
+        """
+        purpose:
+        cache value under key
+
+        how:
+        json written to temp file then renamed so readers never see partly written entry
+
+        notes:
+        -evict is False for worker processes writing to the same cache; main process evicts once workers finish
+
+        returns:
+        nothing
+        """
+
+        entryFilePath = self.getEntryFilePath(key)
+        tmpFilePath = "%s.%s.tmp" %(entryFilePath, os.getpid())
+
+        with open(tmpFilePath, "wb") as f:
+            json.dump(value, f)
+
+        # windows can not rename over existing file
+        self.removeEntryFile(entryFilePath)
+        os.rename(tmpFilePath, entryFilePath)
+
+        if evict:
+            self.evict()
+
+
+    def listEntries(self):
+        """
+        purpose:
+        cache entry files
+
+        returns:
+        list of (last used time, size bytes, file path) tuples, least recently used first
+        """
+
+        entries = []
+        for fileName in os.listdir(self.cacheDirectory):
+            if not fileName.endswith(cacheFileExtension):
+                continue
+
+            entryFilePath = os.path.join(self.cacheDirectory, fileName)
+            try:
+                fileStat = os.stat(entryFilePath)
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((fileStat.st_mtime, fileStat.st_size, entryFilePath))
+
+        entries.sort()
+
+        return entries
+
+
+    def evict(self):
+        """
+        purpose:
+        remove least recently used entries until cache size within budget
+
+        returns:
+        number of entries removed
+        """
+
+        entries = self.listEntries()
+        cacheBytes = sum([x[1] for x in entries])
+
+        removedCount = 0
+        for lastUsed, sizeBytes, entryFilePath in entries:
+            if cacheBytes <= self.budgetBytes:
+                break
+
+            self.removeEntryFile(entryFilePath)
+            cacheBytes -= sizeBytes
+            removedCount += 1
+
+        return removedCount
+
+
+    def purge(self):
+        """
+        purpose:
+        remove every cache entry
+
+        notes:
+        left over temp files of interrupted writes removed as well
+
+        returns:
+        tuple of (number of entries removed, bytes freed)
+        """
+
+        removedCount = 0
+        removedBytes = 0
+        for lastUsed, sizeBytes, entryFilePath in self.listEntries():
+            self.removeEntryFile(entryFilePath)
+            removedCount += 1
+            removedBytes += sizeBytes
+
+        for fileName in os.listdir(self.cacheDirectory):
+            if fileName.endswith(".tmp"):
+                self.removeEntryFile(os.path.join(self.cacheDirectory, fileName))
+
+        return removedCount, removedBytes
+
+
+    def removeEntryFile(self, entryFilePath):
+        """
+        purpose:
+        remove cache file if present
+
+        returns:
+        nothing
+        """
+
+        try:
+            os.remove(entryFilePath)
+        except OSError:
+            # not present or in use by another process
+            pass
+
+
+def getCacheDirectory(tmpSystemDirectory):
+    """
+    purpose:
+    default cache directory. shared by all scripts so results are reused between them
+
+    notes:
+    one directory per user. system temp directory may be shared by all users
+
+    returns:
+    path string
+    """
+
+    try:
+        userName = getpass.getuser()
+    except Exception:
+        # no user name in environment
+        userName = str(os.getuid()) if hasattr(os, "getuid") else "user"
+
+    return os.path.join(tmpSystemDirectory, "%s_%s" %(cacheDirectoryName, userName))
+
+
+def makeKey(*keyParts):
+    """
+    purpose:
+    cache key from parts such as db fingerprint, table name, column name, slc id hash and calculation type
+
+    returns:
+    hex digest string
+    """
+
+    return hashlib.sha1("\n".join([unicode(x) for x in keyParts]).encode("utf-8")).hexdigest()
+
+
+def hashValues(values):
+    """
+    purpose:
+    hash of ordered values ie slc ids. same values in same order give same hash
+
+    returns:
+    hex digest string
+    """
+
+    valuesHash = hashlib.sha1()
+    for value in values:
+        valuesHash.update(unicode(value).encode("utf-8"))
+        valuesHash.update("\n")
+
+    return valuesHash.hexdigest()
@@ -18,6 +18,8 @@ if snf, must choose either landuse of A or N; if A absent then assume N. 1:2 rel
 if slf, user can only select 1 layer number. 1:many between soilkey.
 slf layer_no appears to be layer number.
 
+-no qgis dependency
+
 license:
 gpl3
 
@@ -27,15 +29,27 @@ richardburcher@gmail.com
 2014
 """
 
-from qgis.core import *
-from qgis.gui import *
-from qgis.utils import *
-
 import os
+import re
+import struct
 import sqlite3
 import time
+import hashlib
+import math
+import uuid
+import itertools
 from multiprocessing import Pool
 
+import aafc_join as join
+import aafc_io as inout
+import aafc_cache as cache
+
+# optional numpy calculation backend
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class Db:
     """
@@ -54,15 +68,59 @@ class Db:
         self.conn = sqlite3.connect(sqliteDbPath)
         self.curs = self.conn.cursor()
 
+        # window functions available from sqlite 3.25. used to rank categories in db
+        self.hasWindowFunctions = sqlite3.sqlite_version_info >= (3, 25, 0)
+
+        # column calculation backend; "sql" or "numpy". numpy used only if installed
+        self.calculationBackend = "sql"
+
+        # connection set to read only. see self.setQueryOnly()
+        self.queryOnly = False
+        
+        # schema cache. table name to column names, declared types, calculation data types and row count; table listing
+        self.schemaCache = {}
+        self.tableNamesCache = None
+        
+        # persistent calculated column result cache. see aafc_cache.ResultCache. not used if None
+        self.resultCache = None
+        
+        # calculation type of column calculations. part of result cache key
+        self.columnCalculationType = "dominate/weighted average"
+        
+        # statistics calculated in single read of table. see self.calculateFieldStatistics()
+        self.numericStatistics = ["weighted_average", "min", "max", "weighted_stddev", "weighted_median"]
+        self.categoricalStatistics = ["dominate", "category_percent"]
+
         # temp system directory
         self.tmpDirectory = tmpSystemDirectory
         
-        # join table name. generic as you can only have 1 join table at a time
+        # join table name. generic as only 1 join table is active at a time
         self.joinTableName = "joinedSoilTables"
         
+        # previously built join tables are parked under this prefix when join cache is used
+        self.joinCacheTablePrefix = "joinCache"
+        
+        # disk budget for parked join tables. least recently used are dropped when exceeded
+        self.joinCacheBudgetBytes = 1024 * 1024 * 1024
+        
         # user options table name for possible joins allowed
         self.userJoinOptionsTable = "possibleJoinsToCreate"
         
+        # tables recording join signature and slc ids that produced each join table. used for incremental join updates and join cache
+        self.joinStateTable = "joinTableState"
+        self.joinStateSlcIdsTable = "joinTableSlcIds"
+        
+        # table recording source dbf of each loaded soil table. used for incremental db rebuilds
+        self.sourceManifestTable = "sourceManifest"
+        
+        # temp table holding user selected slc ids for set based sql. lives in sqlite temp schema
+        self.slcIdsTempTable = "selectedSlcIds"
+        
+        # soilkey derived columns added to soil tables at db creation. soilkey minus landuse character & landuse character
+        self.baseSoilKeyColumn = "base_soilkey"
+        self.landuseColumn = "landuse"
+        self.normalizedSoilKeyColumns = [self.baseSoilKeyColumn, self.landuseColumn]
+        
         # has join table been created
         self.resultsTableCreated = False
         
@@ -70,23 +128,74 @@ class Db:
         self.messagesTestCsv = []
         
     
-    def executeSql(self,sqlString, fieldNames=False, multipleSqlString=False):
+    def executeSql(self,sqlString, fieldNames=False, multipleSqlString=False, parameters=None, parameterRows=None, stream=False, transactionSize=None):
         """
         purpose:
         main point of sql interaction with db
         
+        notes:
+        -parameters is tuple of values bound to ? placeholders of single sql string. statement text stays identical between calls so
+        sqlite3 statement cache reuses the prepared statement instead of parsing sql again
+        -parameterRows is any iterable of parameter tuples. single sql string executed once per tuple:
+          * default; via executemany for bulk inserts/updates
+          * with stream; select executed once per tuple, results returned lazily in multipleSqlString format
+        -transactionSize is number of parameterRows per transaction. commits after every batch so journal stays small; default single batch
+        -stream returns rows as they are fetched from own cursor instead of list so other sql can run while rows are consumed. constant memory.
+        with multipleSqlString each sql string executed only when its results are consumed
+        -stream cursor closed once rows are consumed or returned generator is closed. callers stopping early ie on error should close
+        generator; open cursor keeps table locked for writes
+        
         returns:
         either data only list of tuples; default or a list of fieldnames and list of tuple results
+        if stream; row iterator in place of list of tuples
+        if multipleSqlString or stream of parameterRows; list (stream; iterator) of above per sql statement executed
         """
 
+        # results consumed lazily
+        if stream:
+            if multipleSqlString:
+                # each sql string executed as consumed
+                return self.iterateSqlResults(((sql, None) for sql in sqlString), fieldNames)
+            elif parameterRows is not None:
+                # same sql string executed as consumed for each parameter tuple
+                return self.iterateSqlResults(((sqlString, x) for x in parameterRows), fieldNames)
+            
+            # single sql statement. rows fetched lazily from own cursor so other sql can run while rows are consumed.
+            # statement executed and field names read here; remaining items are rows
+            rows = self.iterateCursorRows(sqlString, parameters)
+            names = next(rows)
+            
+            if fieldNames:
+                return names, rows
+            else:
+                return rows
+
+        # single parameterized sql statement executed for many rows ie bulk inserts
+        if parameterRows is not None:
+            if not transactionSize:
+                self.curs.executemany(sqlString, parameterRows)
+                return self.curs.fetchall()
+            
+            # fixed size batches. each committed as own transaction
+            batch = []
+            for row in parameterRows:
+                batch.append(row)
+                if len(batch) == transactionSize:
+                    self.curs.executemany(sqlString, batch)
+                    self.conn.commit()
+                    batch = []
+            if batch:
+                self.curs.executemany(sqlString, batch)
+                self.conn.commit()
+            
+            return []
+
         # multiple sql statements to process
         if multipleSqlString:
-            #TODO: split list into 2 maybe n lists and process separately to speed up inserts. would need additional db connections            
             returnData = []
             for e in sqlString: 
                 # execute sql
                 self.curs.execute(e)
-                #TODO: implement cleaned up return values
                 # clean up data to be simple list
                 cleanedData = list(self.curs.fetchall())
                 if fieldNames:
@@ -103,7 +212,7 @@ class Db:
         else:
             #===== single sql string to process
             # execute sql
-            self.curs.execute(sqlString)
+            self.curs.execute(sqlString, parameters or ())
             
             if fieldNames:
                 # extract first item from tuple
@@ -113,36 +222,164 @@ class Db:
             else:
                 # only return data
                 return self.curs.fetchall()
+    
+    
+    def iterateSqlResults(self, sqlParameters, fieldNames=False):
+        """
+        purpose:
+        lazily execute sql statements yielding results of one statement at a time
+        
+        notes:
+        -sqlParameters is iterable of (sql string, parameter tuple or None)
+        -own cursor used so other sql can run between statements. only results of single statement held in memory
+        -used by self.executeSql() stream mode
+        
+        returns:
+        generator of data only list of tuples or list of fieldnames and list of tuple results per statement
+        """
+        
+        streamCursor = self.conn.cursor()
+        
+        try:
+            for sql, parameters in sqlParameters:
+                streamCursor.execute(sql, parameters or ())
+                cleanedData = streamCursor.fetchall()
+                
+                if fieldNames:
+                    # extract first item from tuple
+                    names = list(map(lambda x: x[0], streamCursor.description))
+                    
+                    yield [names, cleanedData]
+                else:
+                    yield cleanedData
+        finally:
+            streamCursor.close()
+    
+    
+    def iterateCursorRows(self, sqlString, parameters=None):
+        """
+        purpose:
+        lazily fetch rows of single sql statement from own cursor
+        
+        notes:
+        -first item is list of field names; statement executed when it is requested. see self.executeSql() stream mode
+        -cursor closed when rows are exhausted, on error or when generator is closed
+        
+        returns:
+        generator of field names then row tuples
+        """
+        
+        streamCursor = self.conn.cursor()
+        
+        try:
+            streamCursor.execute(sqlString, parameters or ())
+            # extract first item from tuple. statements without results have no description
+            yield list(map(lambda x: x[0], streamCursor.description or ()))
+            
+            for row in streamCursor:
+                yield row
+        finally:
+            streamCursor.close()
 
 
-    def createDbIndexesOnJoinedTable(self):
+    def createDbIndexesOnJoinedTable(self, dbSlcKey, dbPercentKey):
         """
         purpose:
-        create sqlite indexes on all columns in the joined table
+        create sqlite indexes on the joined table needed by field calculations
         
         how:
         sql
         
         notes:
-        -tableNames must be iterable
-        -used to speed up joins
+        -single covering index on (slc id, percent); every calculation looks rows up by slc id and weights by percent
+        -further column indexes only created on demand by self.createIndexIfQueryPlanScans() when a calculation query would scan the table
         
         returns:
         nothing
         """
         
-        # get table listing for joined table
-        tableNames = self.getTableFieldNames(self.joinTableName)
+        self.createIndex(self.joinTableName, [dbSlcKey, dbPercentKey])
         
-        for tableName in tableNames:
-            # clean up table names that had :1 or :2 in them. results from duplicate tables
-            cleanedTableName = tableName.replace(":","_")
-            # create sql for index
-            sql = "create index index_%s_%s on %s('%s')" % (self.joinTableName, cleanedTableName, self.joinTableName, tableName)
-            self.executeSql(sql)
+        # analyze join table to generate stats for query planner
+        self.executeSql("ANALYZE %s" %(self.joinTableName))
+    
+    
+    def createIndex(self, tableName, columnNames):
+        """
+        purpose:
+        create index on table columns if not present
         
-        # analyze db to generate stats for query planner
-        self.executeSql("ANALYZE")
+        notes:
+        -index names carry join table token so indexes stay unique when join tables are parked in join cache
+        -indexes on join table count towards join table size in join cache
+        
+        returns:
+        index name string
+        """
+        
+        # index name prefix
+        state = self.getJoinTableState(tableName)
+        if state:
+            indexPrefix = state["tableToken"]
+        else:
+            indexPrefix = tableName
+        
+        # remove columnName quoting of '"name"'
+        columnNames = [x.strip('"') for x in columnNames]
+        # clean up column names that had :1 or :2 in them. results from duplicate tables
+        indexName = "index_%s_%s" %(indexPrefix, "_".join([x.replace(":","_") for x in columnNames]))
+        
+        # db size before indexing for join table size estimate
+        usedBytes = self.getDbUsedBytes()
+        
+        sql = "create index if not exists %s on %s(%s)" %(indexName, tableName, ", ".join(['"%s"' %(x) for x in columnNames]))
+        self.executeSql(sql)
+        
+        if state:
+            sql = "update %s set sizeBytes = sizeBytes + ? where tableName = ?" %(self.joinStateTable)
+            self.executeSql(sql, parameters=(self.getDbUsedBytes() - usedBytes, tableName))
+            self.conn.commit()
+        
+        return indexName
+    
+    
+    def createIndexIfQueryPlanScans(self, sql, parameters, tableName, columnNames, tableAlias=None):
+        """
+        purpose:
+        index advisor. create index on table columns only when query plan shows a full scan of table
+        
+        how:
+        explain query plan of query about to run. plan detail ie 'SCAN TABLE cmp' or 'SCAN cmp' (newer sqlite) means no index is used.
+        'SEARCH TABLE cmp USING AUTOMATIC ...' means sqlite builds a throwaway index each time query runs
+        
+        notes:
+        -parameters only need right number of values; plan does not depend on them
+        -nothing done on query only connection
+        -tableAlias is alias of table in sql if any. newer sqlite names table by its alias in plan ie 'SCAN t'
+        -scans via an index ie 'SCAN TABLE cmp USING INDEX ...' are left alone
+        
+        returns:
+        index name string if index created else None
+        """
+        
+        # query only connection can not create indexes
+        if self.queryOnly:
+            return None
+        
+        plan = self.executeSql("explain query plan %s" %(sql), parameters=parameters)
+        
+        # last column of plan row holds detail
+        # automatic index is built by sqlite for every query run; persistent index needed as well
+        names = "|".join([re.escape(x.strip('"')) for x in [tableName, tableAlias] if x])
+        fullScan = re.compile(r'^(SCAN (TABLE )?"?(%s)"?( AS \w+)?$|SEARCH (TABLE )?"?(%s)"?( AS \w+)? USING AUTOMATIC)' %(names, names), re.IGNORECASE)
+        if not [row for row in plan if fullScan.match(row[-1])]:
+            return None
+        
+        indexName = self.createIndex(tableName, columnNames)
+        # stats for new index
+        self.executeSql("ANALYZE %s" %(indexName))
+        
+        return indexName
 
 
     def createDbIndexesOnLoadedData(self, tableNames, dbSoilKey, dbSlcId, dbCmpKey, dbPercentKey, dbLayerNumberKey):
@@ -156,6 +393,7 @@ class Db:
         notes:
         -tableNames must be iterable
         -used to speed up joins
+        -only passed tables analyzed; tables not reloaded in incremental rebuild keep their stats
         
         returns:
         nothing
@@ -190,11 +428,70 @@ class Db:
                 sql = "create index index_slf_layernumber on slf(%s)" % (dbLayerNumberKey)
                 self.executeSql(sql)
         
-        # analyze db to generate stats for query planner
-        self.executeSql("ANALYZE")
+        # analyze tables to generate stats for query planner
+        for tableName in tableNames:
+            self.executeSql("ANALYZE %s" %(tableName))
+    
+    
+    def createNormalizedSoilKeyColumns(self, tableNames, dbSoilKey):
+        """
+        purpose:
+        derive base soilkey and landuse columns on the loaded soil tables
+        
+        how:
+        sql. base soilkey is soilkey with last (landuse) character stripped, landuse is last character of soilkey.
+        composite index on both columns
+        
+        notes:
+        -tableNames must be iterable
+        -makes landuse preference resolution an indexed equality join in sqlite
+        -columns only added if not already present
+        
+        returns:
+        nothing
+        """
+        
+        for tableName in tableNames:
+            fieldNames = [x.lower() for x in self.getTableFieldNames(tableName)]
+            
+            # add derived columns
+            for columnName in self.normalizedSoilKeyColumns:
+                if columnName not in fieldNames:
+                    sql = "alter table %s add column %s TEXT" %(tableName, columnName)
+                    self.executeSql(sql)
+            
+            # populate from soilkey
+            sql = "update %s set %s = substr(%s, 1, length(%s) - 1), %s = substr(%s, -1)" %(tableName, self.baseSoilKeyColumn, dbSoilKey, dbSoilKey, self.landuseColumn, dbSoilKey)
+            self.executeSql(sql)
+            
+            self.invalidateSchemaCache(tableName)
+            
+            # composite index
+            sql = "create index if not exists index_%s_basesoilkey_landuse on %s(%s, %s)" %(tableName, tableName, self.baseSoilKeyColumn, self.landuseColumn)
+            self.executeSql(sql)
+        
+        self.conn.commit()
+    
+    
+    def hasNormalizedSoilKeyColumns(self, tableName):
+        """
+        purpose:
+        check if base soilkey and landuse columns were derived for table
+        
+        returns:
+        boolean
+        """
+        
+        fieldNames = [x.lower() for x in self.getTableFieldNames(tableName)]
+        
+        for columnName in self.normalizedSoilKeyColumns:
+            if columnName not in fieldNames:
+                return False
+        
+        return True
     
     
-    def sqliteLoadingPerformanceTuning(self, enable=True, closeDbConnection=False):
+    def sqliteLoadingPerformanceTuning(self, enable=True, closeDbConnection=False, vacuum=True):
         """
         purpose:
         increase db performance when loading data
@@ -202,6 +499,8 @@ class Db:
         notes:
         turns off journal mode and synchronous modes
         see http://www.sqlite.org/pragma.html
+        -vacuum False; page size left as is. db file is not rewritten so its modified time and result cache
+        fingerprints are kept. see self.getTableFingerprint()
         
         returns:
         nothing
@@ -214,14 +513,15 @@ class Db:
             # turn off synchronous mode
             sql="pragma synchronous=OFF"
             self.executeSql(sql)
-            # increase page size
-            sql="pragma page_size=8192"
-            self.executeSql(sql)
             # increase cache_size
             sql = "pragma cache_size=100000"
             self.executeSql(sql)
-            # must vacuum for page_size to be used
-            self.executeSql("VACUUM")
+            if vacuum:
+                # increase page size
+                sql="pragma page_size=8192"
+                self.executeSql(sql)
+                # must vacuum for page_size to be used
+                self.executeSql("VACUUM")
         else:
             # turn back on
             # turn on journal mode
@@ -230,11 +530,12 @@ class Db:
             # turn on synchronous mode
             sql="pragma synchronous=NORMAL"
             self.executeSql(sql)
-            # set page size default
-            sql="pragma page_size=1024"
-            self.executeSql(sql)
-            # must vacuum for page_size to be used
-            self.executeSql("VACUUM")
+            if vacuum:
+                # set page size default
+                sql="pragma page_size=1024"
+                self.executeSql(sql)
+                # must vacuum for page_size to be used
+                self.executeSql("VACUUM")
         
         # close db connection
         if closeDbConnection:
@@ -242,6 +543,94 @@ class Db:
         
         
 
+    def setQueryOnly(self, enable=True):
+        """
+        purpose:
+        prevent connection from changing db. used by worker processes sharing soil db
+        
+        notes:
+        -sqlite pragma query_only. temp schema is read only as well; stage temp tables before
+        
+        returns:
+        nothing
+        """
+        
+        sql = "pragma query_only = %s" %(int(enable))
+        self.executeSql(sql)
+        self.queryOnly = enable
+    
+    
+    def loadSlcIdsIntoTempTable(self, slcIds):
+        """
+        purpose:
+        stage user selected slc ids in an indexed temp table for set based sql
+        
+        notes:
+        -slcIds is any iterable object
+        -table is created in the sqlite temp schema; soil db is not modified
+        -seq column keeps the order slc ids were supplied in. duplicate slc ids are kept
+        
+        returns:
+        nothing
+        """
+        
+        # recreate table for every selection
+        sql = "drop table if exists temp.%s" %(self.slcIdsTempTable)
+        self.executeSql(sql)
+        # no declared type for slc id. sqlite applies affinity of soil table slc id column when compared
+        sql = "create temp table %s(seq integer primary key, slcid)" %(self.slcIdsTempTable)
+        self.executeSql(sql)
+        
+        # bulk insert slc ids
+        sql = "insert into temp.%s(slcid) values(?)" %(self.slcIdsTempTable)
+        self.executeSql(sql, parameterRows=((slcId,) for slcId in slcIds))
+        
+        # index slc id for joins against soil tables
+        sql = "create index temp.index_%s_slcid on %s(slcid)" %(self.slcIdsTempTable, self.slcIdsTempTable)
+        self.executeSql(sql)
+    
+    
+    def stageSlcIdChunks(self, slcIds, chunkSize=None):
+        """
+        purpose:
+        stage slc ids one chunk at a time so calculations of very large selections use bounded memory
+        
+        how:
+        slc ids read from iterable chunkSize at a time and staged with self.loadSlcIdsIntoTempTable(), replacing previous
+        chunk. yields once chunk is staged; caller calculates staged chunk before next chunk is read
+        
+        notes:
+        -slcIds is any iterable object ie generator reading qgis layer. only one chunk held in memory
+        -chunkSize None or 0 stages all slc ids as single chunk
+        -empty slcIds stages single empty chunk so callers always calculate once
+        -calculations of separate slc ids are independent; chunked results are same as results of whole selection
+        
+        returns:
+        generator of number of slc ids staged per chunk; None if staged as single chunk
+        """
+        
+        if not chunkSize:
+            # whole selection. iterable consumed by bulk insert
+            self.loadSlcIdsIntoTempTable(slcIds)
+            yield None
+            return
+        
+        slcIds = iter(slcIds)
+        chunkCount = 0
+        while True:
+            chunk = list(itertools.islice(slcIds, chunkSize))
+            if len(chunk) == 0 and chunkCount > 0:
+                return
+            
+            self.loadSlcIdsIntoTempTable(chunk)
+            chunkCount += 1
+            
+            yield len(chunk)
+            
+            if len(chunk) < chunkSize:
+                return
+    
+    
     def convertDbResults2SimpleList(self,data, columnIndex=0):
         """
         purpose:
@@ -279,6 +668,7 @@ class Db:
         # update table name via sql
         sql = "alter table %s rename to %s" % (baseDbName,tableName)
         results = self.executeSql(sql)
+        self.invalidateSchemaCache(baseDbName)
     
     
     def dropTable(self,tableName):
@@ -295,6 +685,7 @@ class Db:
         
         sql = "drop table if exists %s" %(tableName)
         self.executeSql(sql)
+        self.invalidateSchemaCache(tableName)
     
     
     def getSoilTablesListing(self):
@@ -310,11 +701,7 @@ class Db:
         """
         
         # list of tables in db
-        sql = "select name from sqlite_master where type='table'"
-        results = self.executeSql(sql)
-        
-        # clean data into simple list
-        cleanedResults = self.convertDbResults2SimpleList(results)
+        cleanedResults = self.getTableNames()
         
         # search for soil names
         soilTableNames = ["cmp","snf","slf"]
@@ -331,26 +718,119 @@ class Db:
         return soilTablesPresent 
 
 
+    def getTableSchema(self, tableName):
+        """
+        purpose:
+        schema of table from schema cache. loaded once per connection
+        
+        how:
+        sqlite pragma table_info on first request for table
+        
+        notes:
+        -cache invalidated by db methods that create, drop, rename or alter tables. see self.invalidateSchemaCache()
+        -row count loaded on first request. see self.getTableRowCount()
+        
+        returns:
+        dict with keys fieldNames; list, declaredTypes; list, dataTypes; dict of lower case column name to "string", "numeric"
+        or None if type not matched, rowCount
+        """
+        
+        cacheKey = tableName.strip('"').lower()
+        
+        if cacheKey not in self.schemaCache:
+            # query sqlite pragma table_info
+            sql = "pragma table_info(%s)" % (tableName)
+            data = self.executeSql(sql)
+            
+            # process tuples of this format (0, u'OGC_FID', u'INTEGER', 0, None, 1)
+            fieldNames = [row[1] for row in data]
+            declaredTypes = [row[2] for row in data]
+            
+            dataTypes = {}
+            for fieldName, declaredType in zip(fieldNames, declaredTypes):
+                # convert fieldtype to lower to check
+                fieldDataType = declaredType.lower()
+                if fieldDataType.startswith("var") or fieldDataType.startswith("tex"):
+                    # text
+                    dataTypes[fieldName.lower()] = "string"
+                elif fieldDataType.startswith("int") or fieldDataType.startswith("rea") or fieldDataType.startswith("flo"):
+                    dataTypes[fieldName.lower()] = "numeric"
+                else:
+                    dataTypes[fieldName.lower()] = None
+            
+            self.schemaCache[cacheKey] = {"fieldNames": fieldNames, "declaredTypes": declaredTypes, "dataTypes": dataTypes, "rowCount": None}
+        
+        return self.schemaCache[cacheKey]
+    
+    
+    def getTableRowCount(self, tableName):
+        """
+        purpose:
+        number of rows in table from schema cache
+        
+        returns:
+        integer
+        """
+        
+        schema = self.getTableSchema(tableName)
+        
+        if schema["rowCount"] is None:
+            sql = "select count(*) from %s" %(tableName)
+            schema["rowCount"] = self.executeSql(sql)[0][0]
+        
+        return schema["rowCount"]
+    
+    
+    def getTableNames(self):
+        """
+        purpose:
+        names of tables in db from schema cache
+        
+        returns:
+        list of table name strings
+        """
+        
+        if self.tableNamesCache is None:
+            # list of tables in db
+            sql = "select name from sqlite_master where type='table'"
+            self.tableNamesCache = self.convertDbResults2SimpleList(self.executeSql(sql))
+        
+        return self.tableNamesCache
+    
+    
+    def invalidateSchemaCache(self, tableName=None):
+        """
+        purpose:
+        drop cached schema after table created, dropped, renamed, altered or its rows changed
+        
+        notes:
+        table listing always dropped. all tables dropped if no table name given
+        
+        returns:
+        nothing
+        """
+        
+        self.tableNamesCache = None
+        
+        if tableName is None:
+            self.schemaCache = {}
+        else:
+            self.schemaCache.pop(tableName.strip('"').lower(), None)
+    
+    
     def getTableFieldNames(self, tableName):
         """
         purpose:
         return listing of field names present in user supplied table
         
         how:
-        sqlite pragma table_info
+        sqlite pragma table_info from schema cache. see self.getTableSchema()
         
         returns:
         list of all field names
         """
         
-        # list db fields
-        sql = "pragma table_info(%s)" %(tableName)
-        results = self.executeSql(sql)
-        
-        # clean results. field name is second index position
-        cleanedResults = self.convertDbResults2SimpleList(results, columnIndex=1)
-        
-        return cleanedResults
+        return list(self.getTableSchema(tableName)["fieldNames"])
         
     
     def createUserTableProcessingOptions(self, tableOptions):
@@ -368,13 +848,14 @@ class Db:
         # drop table if present
         sql = "drop table if exists %s" %(self.userJoinOptionsTable)
         self.executeSql(sql)
+        self.invalidateSchemaCache(self.userJoinOptionsTable)
         
         # check for highest key order to create table and insert statement
         if tableOptions.get(2,None):
             print "processing"
-            sql = "create table %s('cmp-snf' INTEGER, 'cmp-snf-slf' INTEGER)" %(self.userJoinOptionsTable)
+            sql = "create table %s('cmp-snf' INTEGER, 'cmp-snf-slf' INTEGER, 'cmp-slf' INTEGER)" %(self.userJoinOptionsTable)
             self.executeSql(sql)
-            sql = "insert into %s('cmp-snf', 'cmp-snf-slf') values(1, 2)" %(self.userJoinOptionsTable)
+            sql = "insert into %s('cmp-snf', 'cmp-snf-slf', 'cmp-slf') values(1, 2, 3)" %(self.userJoinOptionsTable)
             self.executeSql(sql)
             self.conn.commit()
         elif tableOptions.get(1,None):
@@ -386,571 +867,2159 @@ class Db:
             self.conn.commit()
     
     
-    #//////////////////// table joins    
+    #//////////////////// source manifest
     
-    def resultsTableJoiningCmpSnfBySoilkey(self,slcIds, dbSlcKey, dbCmpKey, dbSoilKey, cmpTableName, snfTableName, landuse, writeTestCsv=False, writeTestCsvDirectory=None):
+    def createSourceManifestTable(self):
         """
         purpose:
-        create join between cmp and snf soil tables
-        
-        notes:
-        -join is based on slc ids supplied and soilkey
-        -strip soilkey of last character. search snf table for all matches. if landuse character present in table soilkey; return soilkey; else return avaibale soilkey
-        -* all inserts done when slc ids processed. create sequence of slq insert strings that are processed at end
+        create table recording source dbf file of each loaded soil table
         
         returns:
         nothing
         """
         
-        #TODO: nice to do -- refactor 2 table & 3 table join methods into single method
+        sql = "create table if not exists %s(tableName TEXT PRIMARY KEY, sourcePath TEXT, sizeBytes INTEGER, mtime REAL, contentHash TEXT, loaded REAL)" %(self.sourceManifestTable)
+        self.executeSql(sql)
+        self.invalidateSchemaCache(self.sourceManifestTable)
+    
+    
+    def getSourceManifest(self):
+        """
+        purpose:
+        source dbf file recorded per loaded soil table
         
-        resultsTableName = self.joinTableName
-            
-        def processSlcRows(slcIds, dbSlcKey, dbCmpKey, dbSoilKey, cmpTableName, snfTableName, landuse, resultsTableName):
-            """
-            process slc ids and insert data into flat results table
-            
-            returns list of messages used for testing
-            """
-            
-            resultsTableCreated = False
-            
-            # captures key results that will be added and written to csv only if writeTextCsv = True
-            self.messagesTestCsv = []
-            self.messagesTestCsv.append(("///// land use preference is %s\n\n\n"%(landuse)))
-            self.messagesTestCsv.append(("start time is %s" %(time.ctime(time.time()))))
-            
-            
-            # get all soil keys from snf table
-            sql = "select distinct(%s) from %s" %(dbSoilKey, snfTableName)
-            results = self.executeSql(sql)
-            snfSoilKeys = []
-            # clean up into simple list of strings
-            for e in results:
-                snfSoilKeys.append(e[0])
-             
-            # sql insert string. string holds all inserts per slc id & at end inserts into db
-            sqlInserts = []
-            
-            # process slc ids
-            for slcId in slcIds:
-                # process each row within given sl
-                
-                # create data structure from sql query once for each sl processed. list of tuples containing (sl, cmp, soilkey). access via index
-                # query db cmp table for sl, cmp, soilkey
-                sql = "select %s, %s, %s from %s where %s = %s" %(dbSlcKey, dbCmpKey, dbSoilKey, cmpTableName, dbSlcKey, slcId)
-                results = self.executeSql(sql) 
-                
-                # process
-                for item in results:
-                    slcId = item[0]
-                    cmpId = item[1]
-                    soilKeyToUse = item[2]
-                    
-                    # is user landuse preference availabe
-                    # check end character of string; if matches user then select key else use default of N
-                    snfSoilKeyToUse = ""
-                    
-                    #////// only for output diagnostic csv
-                    # get list of snf soil keys present that match cmp soil key
-                    snfDistinctKeysMsg = []
-                    if soilKeyToUse[:-1] + landuse in snfSoilKeys:
-                        # user landuse preference can be accomidated
-                        snfDistinctKeysMsg.append((soilKeyToUse[:-1] + landuse))
-                        
-                    if soilKeyToUse[:-1] + "N" in snfSoilKeys:
-                        # default landuse of N
-                        snfDistinctKeysMsg.append((soilKeyToUse[:-1] + "N"))
-                    
-                    self.messagesTestCsv.append("snf soil keys: %s" %(snfDistinctKeysMsg))
-                    # //////////
-                    
-                    # match cmp soil key to snf soil and respect user land use preference if possible 
-                    # strip off last character of cmp soil key. add user landuse and check if in snf soilkey list
-                    if soilKeyToUse[:-1] + landuse in snfSoilKeys:
-                        # user landuse preference can be accomidated
-                        snfSoilKeyToUse = soilKeyToUse[:-1] + landuse
-                        self.messagesTestCsv.append(("Can accomindate land use preference"))
-                    elif soilKeyToUse[:-1] + "N" in snfSoilKeys:
-                        # default landuse of N
-                        snfSoilKeyToUse = soilKeyToUse[:-1] + "N"
-                        self.messagesTestCsv.append(("* Can't accomindate land use preference"))
-                    
-                    
-                    if not resultsTableCreated:
-                        # table does not exist
-                        # create table                        
-                        ## example
-                        #select * from cmp, snf where cmp.sl = 242021 and cmp.cmp = 1 and snf.soilkey = 'ABBUFgl###N'
-                        sql = "create table %s as select * from %s, %s where %s.%s = %s and %s.%s = %s and %s.%s = '%s'" %(resultsTableName, cmpTableName, snfTableName, cmpTableName, dbSlcKey, slcId, cmpTableName, dbCmpKey, cmpId, snfTableName, dbSoilKey, snfSoilKeyToUse)
+        returns:
+        dict of table name to dict with keys sourcePath, sizeBytes, mtime, contentHash. empty if db has no manifest
+        """
+        
+        if not self.tableExists(self.sourceManifestTable):
+            return {}
+        
+        sql = "select tableName, sourcePath, sizeBytes, mtime, contentHash from %s" %(self.sourceManifestTable)
+        
+        manifest = {}
+        for tableName, sourcePath, sizeBytes, mtime, contentHash in self.executeSql(sql):
+            manifest[tableName] = {"sourcePath": sourcePath, "sizeBytes": sizeBytes, "mtime": mtime, "contentHash": contentHash}
+        
+        return manifest
+    
+    
+    def saveSourceManifestEntry(self, tableName, sourceInfo):
+        """
+        purpose:
+        record source dbf file of loaded soil table
+        
+        notes:
+        sourceInfo as returned by Io.getSourceFileInfo()
+        
+        returns:
+        nothing
+        """
+        
+        self.createSourceManifestTable()
+        
+        sql = "insert or replace into %s(tableName, sourcePath, sizeBytes, mtime, contentHash, loaded) values(?, ?, ?, ?, ?, ?)" %(self.sourceManifestTable)
+        self.executeSql(sql, parameters=(tableName, sourceInfo["sourcePath"], sourceInfo["sizeBytes"], sourceInfo["mtime"], sourceInfo["contentHash"], time.time()))
+        self.conn.commit()
+    
+    
+    def getChangedSourceTables(self, tableNamesToPaths):
+        """
+        purpose:
+        soil tables whose source dbf changed since loaded
+        
+        how:
+        -source file size, modified time and path compared to manifest. equal means unchanged; file not read
+        -otherwise content hash of file compared to manifest. equal content under new path or time is unchanged
+        
+        notes:
+        -tables without manifest entry or missing from db are changed
+        -removed tables are recorded in manifest but not passed in
+        
+        returns:
+        tuple of (list of changed table names, list of removed table names, dict of table name to current source info)
+        """
+        
+        manifest = self.getSourceManifest()
+        io = inout.Io(tempSystemDirectoryPath=self.tmpDirectory)
+        
+        changedTables = []
+        sourceInfos = {}
+        for tableName, path in sorted(tableNamesToPaths.items()):
+            entry = manifest.get(tableName)
+            
+            if entry is None or not self.tableExists(tableName):
+                sourceInfos[tableName] = io.getSourceFileInfo(path)
+                changedTables.append(tableName)
+                continue
+            
+            # quick check. no read of file
+            fileStat = os.stat(path)
+            if entry["sourcePath"] == path and entry["sizeBytes"] == fileStat.st_size and entry["mtime"] == fileStat.st_mtime:
+                sourceInfos[tableName] = entry
+                continue
+            
+            sourceInfos[tableName] = io.getSourceFileInfo(path)
+            if sourceInfos[tableName]["contentHash"] != entry["contentHash"]:
+                changedTables.append(tableName)
+        
+        removedTables = sorted([x for x in manifest if x not in tableNamesToPaths])
+        
+        return changedTables, removedTables, sourceInfos
+    
+    
+    def dropSourceTables(self, tableNames):
+        """
+        purpose:
+        drop loaded soil tables, their manifest entries and join tables built from them
+        
+        notes:
+        -active join table and parked join cache tables joining any of the tables are dropped. join table without recorded state
+        is dropped as its tables are unknown
+        -committed so tables can be reloaded through another db connection
+        
+        returns:
+        list of messages used for testing
+        """
+        
+        messages = []
+        
+        tableNames = [x.lower() for x in tableNames]
+        
+        # join tables built from dropped tables
+        if self.tableExists(self.joinStateTable):
+            sql = "select tableName, joinSignature from %s" %(self.joinStateTable)
+            for joinTableName, joinSignature in self.executeSql(sql):
+                if set(tableNames) & set([x.lower() for x in join.getSignatureTableNames(joinSignature)]):
+                    self.dropJoinTable(joinTableName)
+                    messages.append("join table %s dropped. built from reloaded table" %(joinTableName))
+        
+        if self.tableExists(self.joinTableName) and not self.getJoinTableState(self.joinTableName):
+            self.dropJoinTable(self.joinTableName)
+            messages.append("join table %s dropped. tables it was built from unknown" %(self.joinTableName))
+        
+        for tableName in tableNames:
+            self.dropTable(tableName)
+            if self.tableExists(self.sourceManifestTable):
+                sql = "delete from %s where tableName = ?" %(self.sourceManifestTable)
+                self.executeSql(sql, parameters=(tableName,))
+            messages.append("table %s dropped" %(tableName))
+        
+        self.conn.commit()
+        
+        return messages
+    
+    
+    #//////////////////// table joins    
+    
+    def createJoinTable(self, joinSpec, slcIds, resultsTableName=None, incremental=False, useCache=False, processes=1):
+        """
+        purpose:
+        create flat join table described by join spec for user supplied slc ids
+        
+        how:
+        slc ids staged in temp table. join spec compiled to sql that resolves soilkeys for all base rows in one pass, then
+        join table filled with single statement
+        
+        notes:
+        -join table dropped and recreated
+        -default join table is self.joinTableName
+        -if incremental and existing join table was produced by same join signature, only rows of slc ids removed from or
+        added to the selection are deleted/inserted. otherwise full rebuild. see self.isJoinTableUpdatable()
+        -if useCache, join tables are kept per scenario of join signature + slc ids. existing join table is parked instead of dropped
+        and a parked table matching the requested scenario is renamed back to the join table without recalculating.
+        parked tables over self.joinCacheBudgetBytes are dropped least recently used first
+        -if processes > 1, full rebuilds are split into slc id shards built by separate worker processes. see self.createJoinTableInParallel()
+        -slc ids and join signature recorded after every run
+        -schema cache of join table invalidated
+        
+        returns:
+        list of messages used for testing
+        """
+        
+        if resultsTableName == None:
+            resultsTableName = self.joinTableName
+        
+        # captures key results that will be written to csv only if requested by caller
+        messagesTestCsv = []
+        messagesTestCsv.append(("///// join is %s\n\n\n"%(joinSpec.describe())))
+        messagesTestCsv.append(("start time is %s" %(time.ctime(time.time()))))
+        
+        # column listings and normalized soilkey columns for compiling
+        self.prepareJoinSpec(joinSpec)
+        
+        # stage slc ids
+        self.loadSlcIdsIntoTempTable(slcIds)
+        
+        self.createJoinTableStateTables()
+        
+        # scenario of requested join
+        cacheKey = self.getJoinCacheKey(joinSpec)
+        
+        # what produced existing join table. None if unknown
+        if self.tableExists(resultsTableName):
+            state = self.getJoinTableState(resultsTableName)
+        else:
+            state = None
+        
+        # parked join table for requested scenario
+        cachedTableName = self.getCachedJoinTableName(cacheKey)
+        
+        if useCache and state and state["cacheKey"] == cacheKey:
+            # join table already holds requested scenario
+            messagesTestCsv.append("join table matches requested join. nothing to do")
+            self.touchJoinTableState(resultsTableName)
+        
+        elif useCache and cachedTableName:
+            # swap parked table in
+            self.parkJoinTable(resultsTableName)
+            self.renameJoinTable(cachedTableName, resultsTableName)
+            self.touchJoinTableState(resultsTableName)
+            messagesTestCsv.append("join table restored from join cache table %s" %(cachedTableName))
+        
+        else:
+            # db size before join for join table size estimate
+            usedBytes = self.getDbUsedBytes()
+            
+            if incremental and state and state["joinSignature"] == joinSpec.getSignature() and self.isJoinTableUpdatable(resultsTableName):
+                # only process selection changes. join table keeps its token
+                messagesTestCsv.extend(self.updateJoinTable(joinSpec, resultsTableName))
+                tableToken = state["tableToken"]
+                sizeBytes = state["sizeBytes"] + self.getDbUsedBytes() - usedBytes
+            else:
+                if useCache:
+                    # keep existing join table for later reuse
+                    self.parkJoinTable(resultsTableName)
+                else:
+                    self.dropJoinTable(resultsTableName)
+                
+                usedBytes = self.getDbUsedBytes()
+                
+                if processes > 1:
+                    # shards built in worker processes then merged
+                    messagesTestCsv.extend(self.createJoinTableInParallel(joinSpec, resultsTableName, processes))
+                else:
+                    # resolve soilkeys for all base rows
+                    for sql in joinSpec.compileStagingSql(self.slcIdsTempTable):
                         self.executeSql(sql)
-                        
-                        # commit transaction to create table
-                        self.conn.commit()
-                        
-                        # flag that table has been created
-                        resultsTableCreated = True
-                    else:
-                        # create sql insert strings
-                        sql = "insert into %s select * from %s, %s where %s.%s = %s and %s.%s = %s and %s.%s = '%s'" %(resultsTableName, cmpTableName, snfTableName, cmpTableName, dbSlcKey, slcId, cmpTableName, dbCmpKey, cmpId, snfTableName, dbSoilKey, snfSoilKeyToUse)
-                        sqlInserts.append(sql)
                     
-            self.messagesTestCsv.append(("start sql inserts: time is %s" %(time.ctime(time.time()))))
-            # process all sql insert statements for slc ids
-            self.executeSql(sqlInserts, multipleSqlString=True)
-            self.messagesTestCsv.append(("finished sql inserts: time is %s" %(time.ctime(time.time()))))
-                     
-            # commit transaction
-            self.conn.commit()
+                    sql = "select count(*) from temp.%s" %(joinSpec.joinKeysTableName)
+                    messagesTestCsv.append("base rows to join: %s" %(self.executeSql(sql)[0][0]))
+                    
+                    messagesTestCsv.append(("start sql inserts: time is %s" %(time.ctime(time.time()))))
+                    # single statement join
+                    self.executeSql(joinSpec.compileCreateTableSql(resultsTableName))
+                    messagesTestCsv.append(("finished sql inserts: time is %s" %(time.ctime(time.time()))))
                 
-            self.messagesTestCsv.append(("all finished -- db commit finished: time is %s" %(time.ctime(time.time()))))
+                # new physical join table
+                tableToken = uuid.uuid4().hex[:12]
+                sizeBytes = self.getDbUsedBytes() - usedBytes
+            
+            # record what produced join table
+            self.saveJoinTableState(joinSpec, resultsTableName, tableToken, cacheKey, sizeBytes)
         
-            # return list of messages
-            return self.messagesTestCsv
-
-        # drop join table
-        sql = "drop table if exists %s" %(resultsTableName)
+        # join table recreated, swapped or its rows changed
+        self.invalidateSchemaCache(resultsTableName)
+        messagesTestCsv.append("join table rows: %s" %(self.getTableRowCount(resultsTableName)))
+        
+        if useCache:
+            messagesTestCsv.extend(self.evictJoinCache(resultsTableName))
+        
+        # commit transaction
+        self.conn.commit()
+        
+        messagesTestCsv.append(("all finished -- db commit finished: time is %s" %(time.ctime(time.time()))))
+        
+        return messagesTestCsv
+    
+    
+    def streamJoinRows(self, joinSpec, slcIds):
+        """
+        purpose:
+        join rows described by join spec without creating join table
+        
+        how:
+        slc ids staged and soilkeys resolved in temp tables. compiled join select streamed from cursor
+        
+        notes:
+        -only the sqlite temp schema is written. soil db is untouched
+        -duplicate column names are suffixed :1, :2 as sqlite does for created join tables
+        
+        returns:
+        tuple of (list of column names, row iterator)
+        """
+        
+        # column listings and normalized soilkey columns for compiling
+        self.prepareJoinSpec(joinSpec)
+        
+        # stage slc ids
+        self.loadSlcIdsIntoTempTable(slcIds)
+        
+        # resolve soilkeys for all base rows
+        for sql in joinSpec.compileStagingSql(self.slcIdsTempTable):
+            self.executeSql(sql)
+        
+        names, rows = self.executeSql(joinSpec.compileSelectSql(), fieldNames=True, stream=True)
+        
+        return self.makeUniqueFieldNames(names), rows
+    
+    
+    def makeUniqueFieldNames(self, fieldNames):
+        """
+        purpose:
+        suffix duplicate field names with :1, :2 etc
+        
+        notes:
+        matches sqlite naming of duplicate columns in create table as select
+        
+        returns:
+        list of field names
+        """
+        
+        uniqueNames = []
+        usedNames = set()
+        
+        for name in fieldNames:
+            uniqueName = name
+            count = 0
+            while uniqueName.lower() in usedNames:
+                count += 1
+                uniqueName = "%s:%s" %(name, count)
+            usedNames.add(uniqueName.lower())
+            uniqueNames.append(uniqueName)
+        
+        return uniqueNames
+    
+    
+    def createJoinTableInParallel(self, joinSpec, resultsTableName, processes):
+        """
+        purpose:
+        build join table from slc id shards processed by a pool of worker processes
+        
+        how:
+        -staged slc ids split into contiguous shards, one per worker
+        -each worker opens own db connection and builds its shard join into own attached shard sqlite file. see buildJoinShard()
+        -shard files attached in order and merged into join table with one bulk insert each
+        
+        notes:
+        -slc ids must be staged first with self.loadSlcIdsIntoTempTable()
+        -join table must not exist
+        -rows keep same order as single process build
+        
+        returns:
+        list of messages used for testing
+        """
+        
+        messages = []
+        
+        # staged slc ids in supplied order
+        sql = "select slcid from temp.%s order by seq" %(self.slcIdsTempTable)
+        slcIds = self.convertDbResults2SimpleList(self.executeSql(sql))
+        
+        # contiguous shards. keeps row order when merged in shard order
+        shardSize = max(1, int(math.ceil(len(slcIds) / float(processes))))
+        shards = [slcIds[i:i + shardSize] for i in range(0, len(slcIds), shardSize)]
+        
+        # too few slc ids to split. shard of all slc ids
+        if len(shards) == 0:
+            shards = [[]]
+        
+        # worker tasks. shard files in temp directory
+        shardPrefix = uuid.uuid4().hex[:12]
+        tasks = []
+        for i, shard in enumerate(shards):
+            shardDbPath = os.path.join(self.tmpDirectory, "joinShard_%s_%s.sqlite" %(shardPrefix, i))
+            tasks.append((self.sqliteDbPath, self.tmpDirectory, joinSpec, shard, shardDbPath))
+        
+        messages.append(("start sharded join with %s processes: time is %s" %(len(tasks), time.ctime(time.time()))))
+        
+        # worker processes must run python, not the qgis executable
+        inout.setWorkerPythonExecutable()
+        
+        pool = Pool(processes=len(tasks))
+        try:
+            results = pool.map(buildJoinShard, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        
+        messages.append(("finished shards: time is %s" %(time.ctime(time.time()))))
+        
+        # merge shards in order
+        for i, (shardDbPath, shardTableName, shardRowCount) in enumerate(results):
+            sql = "attach database '%s' as joinShard" %(shardDbPath)
+            self.executeSql(sql)
+            
+            if i == 0:
+                sql = "create table %s as select * from joinShard.%s" %(resultsTableName, shardTableName)
+            else:
+                sql = "insert into %s select * from joinShard.%s" %(resultsTableName, shardTableName)
+            self.executeSql(sql)
+            self.conn.commit()
+            
+            self.executeSql("detach database joinShard")
+            os.remove(shardDbPath)
+            
+            messages.append("shard %s merged. join rows: %s" %(i, shardRowCount))
+        
+        messages.append(("finished merging shards: time is %s" %(time.ctime(time.time()))))
+        
+        return messages
+    
+    
+    def updateJoinTable(self, joinSpec, resultsTableName):
+        """
+        purpose:
+        bring existing join table in line with staged slc ids
+        
+        how:
+        -delete join rows of slc ids recorded for join table but no longer selected
+        -stage newly selected slc ids in own temp table and insert their join rows with single statement
+        
+        notes:
+        -join table must have been produced by same join signature
+        -slc ids must be staged first with self.loadSlcIdsIntoTempTable()
+        
+        returns:
+        list of messages used for testing
+        """
+        
+        messages = []
+        addedSlcIdsTempTable = "addedSlcIds"
+        
+        # remove rows of deselected slc ids
+        sql = "delete from %s where %s in (select slcid from %s where tableName = ? and slcid not in (select slcid from temp.%s))" %(resultsTableName, joinSpec.dbSlcKey, self.joinStateSlcIdsTable, self.slcIdsTempTable)
+        self.executeSql(sql, parameters=(resultsTableName,))
+        messages.append("join rows removed for deselected slc ids: %s" %(self.curs.rowcount))
+        
+        # stage newly selected slc ids
+        sql = "drop table if exists temp.%s" %(addedSlcIdsTempTable)
+        self.executeSql(sql)
+        sql = "create temp table %s as select seq, slcid from temp.%s where slcid not in (select slcid from %s where tableName = '%s')" %(addedSlcIdsTempTable, self.slcIdsTempTable, self.joinStateSlcIdsTable, resultsTableName)
+        self.executeSql(sql)
+        sql = "create index temp.index_%s_slcid on %s(slcid)" %(addedSlcIdsTempTable, addedSlcIdsTempTable)
         self.executeSql(sql)
         
-        # create new results table with join results inserted for each slc id row
-        messages = processSlcRows(slcIds, dbSlcKey, dbCmpKey, dbSoilKey, cmpTableName, snfTableName, landuse, resultsTableName)
+        # resolve soilkeys for added slc ids only
+        for sql in joinSpec.compileStagingSql(addedSlcIdsTempTable):
+            self.executeSql(sql)
         
-        # write test csv output if writeTestCsv requested
-        if writeTestCsv:
-            with open(os.path.join(writeTestCsvDirectory, "test_2_tableJoin.txt"),"w") as file_open:
-                for msg in messages:
-                    file_open.writelines(msg)
-                    file_open.write("\n")
+        sql = "select count(*) from temp.%s" %(joinSpec.joinKeysTableName)
+        messages.append("base rows to join for newly selected slc ids: %s" %(self.executeSql(sql)[0][0]))
         
+        # append join rows
+        self.executeSql(joinSpec.compileInsertSql(resultsTableName))
         
+        return messages
     
-    def resultsTableJoiningCmpSnfSlfBySoilkey(self,slcIds, dbSlcKey, dbCmpKey, dbSoilKey, dbLayerNumberKey, cmpTableName, snfTableName, slfTableName, landuse, layerNumber, writeTestCsv=False, writeTestCsvDirectory=None):
+    
+    def isJoinTableUpdatable(self, resultsTableName):
         """
         purpose:
-        create 3 table join between cmp/snf/slf soil tables
+        check if updating join table gives same rows in same order as full rebuild for staged slc ids
+        
+        how:
+        recorded slc ids still selected, in recorded order, must be the leading staged slc ids. remaining staged slc ids are
+        then newly selected and their rows appended after the kept rows as a full rebuild would place them
+        
+        notes:
+        -false if staged slc ids have duplicates; rows of duplicate slc ids are repeated in staged order by full rebuild
+        -false if slc ids were recorded without order
+        -slc ids must be staged first with self.loadSlcIdsIntoTempTable()
+        
+        returns:
+        boolean
+        """
+        
+        # duplicate slc ids staged
+        sql = "select count(*) - count(distinct slcid) from temp.%s" %(self.slcIdsTempTable)
+        if self.executeSql(sql)[0][0] > 0:
+            return False
+        
+        # slc ids recorded without order
+        sql = "select count(*) from %s where tableName = ? and seq is null" %(self.joinStateSlcIdsTable)
+        if self.executeSql(sql, parameters=(resultsTableName,))[0][0] > 0:
+            return False
+        
+        # compare kept slc ids with leading staged slc ids as streamed
+        sql = "select slcid from %s where tableName = ? and slcid in (select slcid from temp.%s) order by seq" %(self.joinStateSlcIdsTable, self.slcIdsTempTable)
+        keptSlcIds = self.executeSql(sql, parameters=(resultsTableName,), stream=True)
+        sql = "select slcid from temp.%s order by seq" %(self.slcIdsTempTable)
+        stagedSlcIds = self.executeSql(sql, stream=True)
+        
+        try:
+            for keptRow in keptSlcIds:
+                stagedRow = next(stagedSlcIds, None)
+                if stagedRow is None or stagedRow[0] != keptRow[0]:
+                    return False
+        finally:
+            keptSlcIds.close()
+            stagedSlcIds.close()
+        
+        return True
+    
+    
+    def tableExists(self, tableName):
+        """
+        purpose:
+        check if table present in db
+        
+        returns:
+        boolean
+        """
+        
+        # sqlite table names are case insensitive
+        return tableName.lower() in [x.lower() for x in self.getTableNames()]
+    
+    
+    def getDbUsedBytes(self):
+        """
+        purpose:
+        bytes of db file holding data. free pages not counted
+        
+        returns:
+        integer
+        """
+        
+        pageCount = self.executeSql("pragma page_count")[0][0]
+        freelistCount = self.executeSql("pragma freelist_count")[0][0]
+        pageSize = self.executeSql("pragma page_size")[0][0]
+        
+        return (pageCount - freelistCount) * pageSize
+    
+    
+    def getJoinCacheKey(self, joinSpec):
+        """
+        purpose:
+        key identifying join scenario of join signature + staged slc ids
+        
+        notes:
+        slc ids must be staged with self.loadSlcIdsIntoTempTable(). order and duplicates of slc ids are part of key;
+        both change join table rows
+        
+        returns:
+        hex string
+        """
+        
+        # hash of slc ids in staged order
+        slcIdsHash = hashlib.sha1()
+        sql = "select slcid from temp.%s order by seq" %(self.slcIdsTempTable)
+        rows = self.executeSql(sql, stream=True)
+        try:
+            for row in rows:
+                slcIdsHash.update(repr(row[0]))
+                slcIdsHash.update("\n")
+        finally:
+            rows.close()
+        
+        return hashlib.sha1(joinSpec.getSignature() + "\n" + slcIdsHash.hexdigest()).hexdigest()
+    
+    
+    def createJoinTableStateTables(self):
+        """
+        purpose:
+        create tables recording what produced each join table
+        
+        notes:
+        -one state row per physical join table; active join table or parked join cache table
+        -slc ids recorded with staged order and duplicates
+        -table token is unique per physical join table and kept when table renamed
+        
+        returns:
+        nothing
+        """
+        
+        sql = "create table if not exists %s(tableName TEXT PRIMARY KEY, tableToken TEXT, joinSignature TEXT, cacheKey TEXT, sizeBytes INTEGER, lastUsed REAL)" %(self.joinStateTable)
+        self.executeSql(sql)
+        sql = "create table if not exists %s(tableName TEXT, slcid, seq INTEGER)" %(self.joinStateSlcIdsTable)
+        self.executeSql(sql)
+        # slc ids recorded before staged order was kept have null seq
+        self.invalidateSchemaCache(self.joinStateSlcIdsTable)
+        if "seq" not in [x.lower() for x in self.getTableFieldNames(self.joinStateSlcIdsTable)]:
+            sql = "alter table %s add column seq INTEGER" %(self.joinStateSlcIdsTable)
+            self.executeSql(sql)
+        sql = "create index if not exists index_%s_tablename_slcid on %s(tableName, slcid)" %(self.joinStateSlcIdsTable, self.joinStateSlcIdsTable)
+        self.executeSql(sql)
+        self.invalidateSchemaCache(self.joinStateTable)
+        self.invalidateSchemaCache(self.joinStateSlcIdsTable)
+    
+    
+    def getJoinTableState(self, tableName):
+        """
+        purpose:
+        state recorded for join table
+        
+        returns:
+        dict of state columns or None if nothing recorded
+        """
+        
+        if not self.tableExists(self.joinStateTable):
+            return None
+        
+        sql = "select tableName, tableToken, joinSignature, cacheKey, sizeBytes, lastUsed from %s where tableName = ?" %(self.joinStateTable)
+        names, results = self.executeSql(sql, fieldNames=True, parameters=(tableName,))
+        
+        if len(results) == 0:
+            return None
+        else:
+            return dict(zip(names, results[0]))
+    
+    
+    def getJoinTableSignature(self, resultsTableName):
+        """
+        purpose:
+        join signature recorded for join table
+        
+        returns:
+        signature string or None if nothing recorded
+        """
+        
+        state = self.getJoinTableState(resultsTableName)
+        
+        if state:
+            return state["joinSignature"]
+        else:
+            return None
+    
+    
+    def getCachedJoinTableName(self, cacheKey):
+        """
+        purpose:
+        parked join cache table holding join scenario
+        
+        returns:
+        table name string or None if scenario not cached
+        """
+        
+        sql = "select tableName from %s where cacheKey = ? and tableName like ?" %(self.joinStateTable)
+        
+        for row in self.executeSql(sql, parameters=(cacheKey, self.joinCacheTablePrefix + "%")):
+            if self.tableExists(row[0]):
+                return row[0]
+        
+        return None
+    
+    
+    def saveJoinTableState(self, joinSpec, resultsTableName, tableToken, cacheKey, sizeBytes):
+        """
+        purpose:
+        record join signature and staged slc ids that produced join table
+        
+        notes:
+        slc ids must be staged with self.loadSlcIdsIntoTempTable()
+        
+        returns:
+        nothing
+        """
+        
+        sql = "insert or replace into %s(tableName, tableToken, joinSignature, cacheKey, sizeBytes, lastUsed) values(?, ?, ?, ?, ?, ?)" %(self.joinStateTable)
+        self.executeSql(sql, parameters=(resultsTableName, tableToken, joinSpec.getSignature(), cacheKey, sizeBytes, time.time()))
+        
+        sql = "delete from %s where tableName = ?" %(self.joinStateSlcIdsTable)
+        self.executeSql(sql, parameters=(resultsTableName,))
+        sql = "insert into %s(tableName, slcid, seq) select ?, slcid, seq from temp.%s" %(self.joinStateSlcIdsTable, self.slcIdsTempTable)
+        self.executeSql(sql, parameters=(resultsTableName,))
+    
+    
+    def touchJoinTableState(self, tableName):
+        """
+        purpose:
+        mark join table as most recently used
+        
+        returns:
+        nothing
+        """
+        
+        sql = "update %s set lastUsed = ? where tableName = ?" %(self.joinStateTable)
+        self.executeSql(sql, parameters=(time.time(), tableName))
+    
+    
+    def renameJoinTable(self, tableName, newTableName):
+        """
+        purpose:
+        rename join table and its recorded state
+        
+        returns:
+        nothing
+        """
+        
+        sql = "alter table %s rename to %s" %(tableName, newTableName)
+        self.executeSql(sql)
+        self.invalidateSchemaCache(tableName)
+        self.invalidateSchemaCache(newTableName)
+        
+        sql = "update %s set tableName = ? where tableName = ?" %(self.joinStateTable)
+        self.executeSql(sql, parameters=(newTableName, tableName))
+        sql = "update %s set tableName = ? where tableName = ?" %(self.joinStateSlcIdsTable)
+        self.executeSql(sql, parameters=(newTableName, tableName))
+    
+    
+    def dropJoinTable(self, tableName):
+        """
+        purpose:
+        drop join table and its recorded state
+        
+        returns:
+        nothing
+        """
+        
+        self.dropTable(tableName)
+        
+        if self.tableExists(self.joinStateTable):
+            sql = "delete from %s where tableName = ?" %(self.joinStateTable)
+            self.executeSql(sql, parameters=(tableName,))
+            sql = "delete from %s where tableName = ?" %(self.joinStateSlcIdsTable)
+            self.executeSql(sql, parameters=(tableName,))
+    
+    
+    def parkJoinTable(self, tableName):
+        """
+        purpose:
+        move join table into join cache
+        
+        notes:
+        join table without recorded state can not be reused and is dropped
+        
+        returns:
+        nothing
+        """
+        
+        if not self.tableExists(tableName):
+            return
+        
+        state = self.getJoinTableState(tableName)
+        
+        if state:
+            self.renameJoinTable(tableName, "%s_%s" %(self.joinCacheTablePrefix, state["tableToken"]))
+        else:
+            self.dropJoinTable(tableName)
+    
+    
+    def evictJoinCache(self, activeTableName):
+        """
+        purpose:
+        drop least recently used parked join tables until join cache within disk budget
+        
+        notes:
+        active join table is never dropped
+        
+        returns:
+        list of messages used for testing
+        """
+        
+        messages = []
+        
+        sql = "select tableName, sizeBytes from %s where tableName != ? and tableName like ? order by lastUsed desc" %(self.joinStateTable)
+        results = self.executeSql(sql, parameters=(activeTableName, self.joinCacheTablePrefix + "%"))
+        
+        # keep most recently used within budget
+        cachedBytes = 0
+        for tableName, sizeBytes in results:
+            cachedBytes += sizeBytes
+            if cachedBytes > self.joinCacheBudgetBytes:
+                self.dropJoinTable(tableName)
+                messages.append("join cache table %s dropped. over disk budget" %(tableName))
+        
+        return messages
+    
+    
+    def prepareJoinSpec(self, joinSpec):
+        """
+        purpose:
+        supply join spec with db details needed for compiling
+        
+        notes:
+        -derived soilkey columns are excluded from join output
+        -landuse resolution uses derived soilkey columns only when every joined table has them
+        
+        returns:
+        nothing
+        """
+        
+        normalized = True
+        for tableName in joinSpec.tableNames:
+            joinSpec.setTableFieldNames(tableName, self.getTableFieldNames(tableName))
+            if not self.hasNormalizedSoilKeyColumns(tableName):
+                normalized = False
+        
+        joinSpec.excludedFieldNames = list(self.normalizedSoilKeyColumns)
+        
+        if normalized:
+            joinSpec.setNormalizedSoilKeyColumns(self.baseSoilKeyColumn, self.landuseColumn)
+    
+    
+    def explainJoin(self, joinSpec, slcIds):
+        """
+        purpose:
+        sqlite query plan for every statement of compiled join
+        
+        notes:
+        -staging statements only touch the temp schema and are executed so later statements can be planned
+        -join table is not created
+        
+        returns:
+        list of tuples containing (sql string, list of query plan rows)
+        """
+        
+        plans = []
+        
+        self.prepareJoinSpec(joinSpec)
+        
+        # stage slc ids
+        self.loadSlcIdsIntoTempTable(slcIds)
+        
+        for sql in joinSpec.compileStagingSql(self.slcIdsTempTable):
+            if not sql.startswith("drop"):
+                plans.append((sql, self.executeSql("explain query plan %s" %(sql))))
+            self.executeSql(sql)
+        
+        sql = joinSpec.compileSelectSql()
+        plans.append((sql, self.executeSql("explain query plan %s" %(sql))))
+        
+        return plans
+    
+    
+    def writeJoinTestMessages(self, messages, writeTestCsvDirectory, fileName):
+        """
+        purpose:
+        write join diagnostic messages to text file
+        
+        returns:
+        nothing
+        """
+        
+        with open(os.path.join(writeTestCsvDirectory, fileName),"w") as file_open:
+            for msg in messages:
+                file_open.writelines(msg)
+                file_open.write("\n")
+    
+    
+    def resultsTableJoiningCmpSnfBySoilkey(self,slcIds, dbSlcKey, dbCmpKey, dbSoilKey, cmpTableName, snfTableName, landuse, writeTestCsv=False, writeTestCsvDirectory=None):
+        """
+        purpose:
+        create join between cmp and snf soil tables
+        
+        notes:
+        -join is based on slc ids supplied and soilkey
+        -strip soilkey of last character. search snf table for all matches. if landuse character present in table soilkey; return soilkey; else return avaibale soilkey
+        -convenience wrapper around self.createJoinTable()
+        
+        returns:
+        nothing
+        """
+        
+        joinSpec = join.JoinSpec([cmpTableName, snfTableName], dbSlcKey, dbSoilKey)
+        joinSpec.addLanduseRule(snfTableName, landuse)
+        
+        messages = self.createJoinTable(joinSpec, slcIds)
+        
+        # write test csv output if writeTestCsv requested
+        if writeTestCsv:
+            self.writeJoinTestMessages(messages, writeTestCsvDirectory, "test_2_tableJoin.txt")
+    
+    
+    def resultsTableJoiningCmpSnfSlfBySoilkey(self,slcIds, dbSlcKey, dbCmpKey, dbSoilKey, dbLayerNumberKey, cmpTableName, snfTableName, slfTableName, landuse, layerNumber, writeTestCsv=False, writeTestCsvDirectory=None):
+        """
+        purpose:
+        create 3 table join between cmp/snf/slf soil tables
+        
+        notes:
+        -join based on single distinct sl from cmp with common soilkey and single slf layer number
+        -if slf layer number not present for row being evaluated, that row is dropped from resultant table
+        -convenience wrapper around self.createJoinTable()
+        
+        returns:
+        nothing
+        """
+        
+        joinSpec = join.JoinSpec([cmpTableName, snfTableName, slfTableName], dbSlcKey, dbSoilKey)
+        joinSpec.addLanduseRule(snfTableName, landuse)
+        joinSpec.addLayerRule(slfTableName, dbLayerNumberKey, layerNumber)
+        
+        messages = self.createJoinTable(joinSpec, slcIds)
+        
+        # write test csv output if writeTestCsv requested
+        if writeTestCsv:
+            self.writeJoinTestMessages(messages, writeTestCsvDirectory, "test_3_tableJoin.txt")
+    
+    
+    # //////////////////// categorical and numeric column calculations
+    def iterateRankedCategories(self, rows):
+        """
+        purpose:
+        dominate and sub-dominate category per slc id from summarized categories
+        
+        notes:
+        -rows of (seq, sl, category, weight, count) sorted by seq then rank
+        -used where sqlite lacks window functions
+        
+        returns:
+        generator of (sl, dominate category, weight, count, sub-dominate category, weight, count) per slc id
+        """
+        
+        currentSeq = None
+        ranked = []
+        
+        for seq, sl, category, weight, count in rows:
+            if seq != currentSeq:
+                if ranked:
+                    yield tuple(ranked + [None] * (7 - len(ranked)))
+                currentSeq = seq
+                ranked = [sl]
+            
+            # keep first 2 categories only
+            if len(ranked) < 7:
+                ranked.extend([category, weight, count])
+        
+        if ranked:
+            yield tuple(ranked + [None] * (7 - len(ranked)))
+    
+    
+    def getFieldDataTypes(self, tableName):
+        """
+        purpose:
+        calculation data type of every column in table. this ensures that characters such as #, _, - or "" not interpretted wrongly.
+        in several cases first row that starts with them is a numeric field.
+        
+        how:
+        sqlite pragma table_info column datatype assumptions from schema cache. see self.getTableSchema()
+        
+        notes:
+        sqlite provides either VARCHAR/TEXT or INTEGER/REAL
+        
+        returns:
+        dict of lower case column name to "string", "numeric" or None if type not matched
+        """
+        
+        return self.getTableSchema(tableName)["dataTypes"]
+    
+    
+    def calculateField(self, slcIds, dbSlcKey, tableName, columnName, dbPercentKey, statistics=None):
+        """
+        purpose:
+        calculate user selected column. determines field type to dispatch either numeric or categorical calculation
+        by slc id.
+        
+        notes:
+        dbSlcKey is column for slc id's.
+        slcIds is any iterable object. 
+        statistics is optional list of statistic names ie ["weighted_average", "weighted_median"]. all calculated with
+        single read of table; see self.calculateFieldStatistics()
+        
+        how:
+        sql query via python to db
+        
+        returns:
+        sql query headers & results        
+        """
+        
+        # slc ids hashed for result cache and then staged
+        slcIds = list(slcIds)
+        
+        # requested statistics are part of result cache key
+        if statistics:
+            calculationType = "statistics %s" %(",".join(statistics))
+        else:
+            calculationType = None
+        
+        # previously calculated results. soil db not queried
+        if self.resultCache is not None:
+            cachedResults = self.getCachedCalculation(self.getCalculationCacheKey(slcIds, dbSlcKey, tableName, columnName, dbPercentKey, calculationType))
+            if cachedResults is not None:
+                return cachedResults
+        
+        # several statistics in one read of table
+        if statistics:
+            calculated = self.calculateFieldStatistics(slcIds, dbSlcKey, tableName, columnName, dbPercentKey, statistics)
+            if calculated:
+                self.cacheCalculatedColumn(slcIds, dbSlcKey, tableName, columnName, dbPercentKey, calculated[0], calculated[1], calculationType=calculationType)
+            
+            return calculated
+        
+        # numpy backend calculates single column via self.calculateFields()
+        if self.calculationBackend == "numpy" and np is not None:
+            for calculatedColumnName, headers, results in self.calculateFields(slcIds, dbSlcKey, tableName, [columnName], dbPercentKey):
+                return headers, results
+            return
+        
+        # determine column data type
+        # used to dispatch appriopate method to calculate
+        def determineFieldDataType(tableName, columnName):
+            """
+            determine sqlite column data type. see self.getFieldDataTypes()
+    
+            return single value of "string" or "numeric"
+            """
+            
+            # remove double quote within single quote if present. only passed if db column name is duplicate ie '"slope:2"'
+            columnDataType = self.getFieldDataTypes(tableName).get(columnName.strip('\"').lower())
+            
+            if not columnDataType:
+                print "could not match data type!!"
+            
+            return columnDataType
+            
+                
+        def categoricalCalculation(slcIds, dbSlcKey, tableName, columnName, dbPercentKey):
+            """
+            - dominate based on higest sum percent value for unique values. count is not
+            a factor in determining.
+            - * check if result class = ""; replace with "NULL"
+    
+            calculates dominate/sub-dominate results for single string db field
+            
+            how:
+            slc ids staged in indexed temp table. categories summarized per staged row with single joined group by, then ranked:
+            -sqlite 3.25+; row_number window function ranks and pivots dominate/sub-dominate into one row per slc id in the db
+            -older sqlite; one scan sorted by rank, first 2 categories of each slc id kept
+            
+            notes:
+            -group per staged row so order and duplicates of slc ids supplied are kept
+            -equal weights ranked by category descending; same as former per slc id query
+    
+            returns columns headers plus results.
+            """
+        
+            # summarize every sl id. determine sum percent and count of categories present. rank by high-low.
+            # dominate has highest sum percent, sub-dominate is second highest.
+            
+            ## = examples
+            ## select s.seq as seq, t.sl as sl, t.slope as category, sum(t.percent) as weight, count(t.slope) as count from temp.selectedSlcIds s cross join cmp32 t on t.sl = s.slcid group by s.seq, t.slope
+            
+            # stage slc ids. affinity of table slc id column handles numeric and alphanumeric slc ids ie ONAD405357 alike
+            self.loadSlcIdsIntoTempTable(slcIds)
+            
+            categoriesSql = "select s.seq as seq, t.%s as sl, t.%s as category, sum(t.%s) as weight, count(t.%s) as count from temp.%s s cross join %s t on t.%s = s.slcid group by s.seq, t.%s" %(dbSlcKey, columnName, dbPercentKey, columnName, self.slcIdsTempTable, tableName, dbSlcKey, columnName)
+            
+            # index slc id lookups if table would be scanned for every slc id
+            self.createIndexIfQueryPlanScans(categoriesSql, (), tableName, [dbSlcKey, dbPercentKey], tableAlias="t")
+            
+            if self.hasWindowFunctions:
+                # rank categories and pivot into single row per slc id;
+                # sl, dominate category, weight, count, sub-dominate category, weight, count
+                sql = "select sl, max(case when rank = 1 then category end), max(case when rank = 1 then weight end), max(case when rank = 1 then count end), max(case when rank = 2 then category end), max(case when rank = 2 then weight end), max(case when rank = 2 then count end) from (select seq, sl, category, weight, count, row_number() over (partition by seq order by weight desc, category desc) as rank from (%s)) where rank <= 2 group by seq order by seq" %(categoriesSql)
+                streamedRows = self.executeSql(sql, stream=True)
+                rows = streamedRows
+            else:
+                # single sorted scan. dominate then sub-dominate first for each slc id
+                sql = "%s order by s.seq, weight desc, category desc" %(categoriesSql)
+                streamedRows = self.executeSql(sql, stream=True)
+                rows = self.iterateRankedCategories(streamedRows)
+            
+            #== clean up returned data
+            #example: [(251011, u'A', 50, 2, u'B', 50, 1)]
+            
+            try:
+                # remove None values. only dominate present if single category
+                cleanedResults = [[a for a in row if a] for row in rows]
+            finally:
+                # release stream cursor if stopped early
+                streamedRows.close()
+            
+            #== return headers and results
+            # headers as per dominate/sub-dominate csv layout
+            headers = [dbSlcKey, "dominate_category", "dominate_weight", "dominate_count", "sub_dominate_category", "sub_dominate_weight"]
+            # prefix header with column name
+            headerFormat = "%s_%s"
+            # remove columnName quoting of '"name"'
+            columnName = columnName.strip('"')
+            headersPrefixed = [headerFormat%(columnName, x) for x in headers]
+
+            return headersPrefixed, cleanedResults
+
+
+        def numericCalculation(slcIds, dbSlcKey, tableName, columnName, dbPercentKey):
+            """
+            purpose:
+            calculates weighted summed average of single numeric db field by slc id
+            
+            how:
+            slc ids staged in indexed temp table. single joined group by computes every slc id
+            
+            notes:
+            -db drops rows with no data
+            -group per staged row so order and duplicates of slc ids supplied are kept
+            -cross join keeps staged slc ids as outer loop; rows of each slc id summed in same order as a per slc id query
+            
+            returns:
+            sl id and value
+            """
+            
+            ## = examples
+            ## select t.sl as sl, sum(t.awhc_v * (t.percent/100.0)) as weighted_average from temp.selectedSlcIds s cross join cmp32 t on t.sl = s.slcid group by s.seq order by s.seq
+            
+            # stage slc ids. affinity of table slc id column handles numeric and alphanumeric slc ids ie ONAD405357 alike
+            self.loadSlcIdsIntoTempTable(slcIds)
+            
+            sql = "select t.%s as %s, sum(t.%s * (t.%s/100.0)) as weighted_average from temp.%s s cross join %s t on t.%s = s.slcid group by s.seq order by s.seq" % (dbSlcKey, dbSlcKey, columnName, dbPercentKey, self.slcIdsTempTable, tableName, dbSlcKey)
+            
+            # index slc id lookups if table would be scanned for every slc id
+            self.createIndexIfQueryPlanScans(sql, (), tableName, [dbSlcKey, dbPercentKey], tableAlias="t")
+            
+            #execute sql. rows streamed from cursor
+            headers, results = self.executeSql(sql, fieldNames=True, stream=True)
+            
+            #== clean up returned data
+            #example: "['sl', 'weighted_average']","[(242022, -3.3000000000000003)]"
+            
+            try:
+                # format calculated value to 2 decimal places
+                cleanedResults = [[row[0],"{:0.2f}".format(round(row[1],2))] for row in results]
+            finally:
+                # release stream cursor if formatting fails ie slc id of only null values
+                results.close()
+                        
+            # return headers and results
+            # prefix header with column name
+            headerFormat = "%s_%s"
+            # remove columnName quoting of '"name"'
+            columnName = columnName.strip('"')
+            headersPrefixed = [headerFormat%(columnName, x) for x in headers]
+            
+            return headersPrefixed, cleanedResults
+        
+        
+        # determine column field data type
+        columnDataTypeIs = determineFieldDataType(tableName, columnName)
+        
+        # dispatch to correct calculation method based on field data type
+        if columnDataTypeIs == "string":
+            # categorical column calculation
+            headers, results = categoricalCalculation(slcIds, dbSlcKey, tableName, columnName, dbPercentKey)
+            self.cacheCalculatedColumn(slcIds, dbSlcKey, tableName, columnName, dbPercentKey, headers, results)
+            
+            return headers, results
+        
+        elif columnDataTypeIs == "numeric":
+            # numeric column calculation
+            headers, results = numericCalculation(slcIds, dbSlcKey, tableName, columnName, dbPercentKey)
+            self.cacheCalculatedColumn(slcIds, dbSlcKey, tableName, columnName, dbPercentKey, headers, results)
+            
+            return headers, results
+        
+        else:
+            # issue determining column data type
+            print "mmmm couldn't figure out column type"
+            print columnDataTypeIs
+
+
+    def calculateFieldStatistics(self, slcIds, dbSlcKey, tableName, columnName, dbPercentKey, statistics):
+        """
+        purpose:
+        calculate several statistics of user selected column by slc id with single read of table
+        
+        how:
+        -slc ids staged. table rows of all slc ids read once in staged order; rows of each slc id grouped as streamed
+        -every requested statistic calculated from the rows of slc id. see self.calculateGroupStatistics()
+        
+        notes:
+        -statistics available depend on column data type. see self.numericStatistics and self.categoricalStatistics.
+        statistics not available for column are skipped
+        -every statistic keeps fixed cells; cells without value are None
+        -percent column is the weight of every row
+        
+        returns:
+        headers & results
+        """
+        
+        # stage slc ids
+        self.loadSlcIdsIntoTempTable(slcIds)
+        
+        return self.calculateStagedFieldStatistics(dbSlcKey, tableName, columnName, dbPercentKey, statistics)
+    
+    
+    def calculateStagedFieldStatistics(self, dbSlcKey, tableName, columnName, dbPercentKey, statistics):
+        """
+        purpose:
+        self.calculateFieldStatistics() for slc ids already staged
+        
+        notes:
+        slc ids must be staged with self.loadSlcIdsIntoTempTable()
+        
+        returns:
+        headers & results
+        """
+        
+        columnDataType = self.getFieldDataTypes(tableName).get(columnName.strip('"').lower())
+        if not columnDataType:
+            # issue determining column data type
+            print "mmmm couldn't figure out column type"
+            print columnDataType
+            return
+        
+        # statistics of column data type
+        if columnDataType == "numeric":
+            availableStatistics = self.numericStatistics
+        else:
+            availableStatistics = self.categoricalStatistics
+        
+        columnStatistics = []
+        for statistic in statistics:
+            if statistic in availableStatistics:
+                columnStatistics.append(statistic)
+            else:
+                print "statistic %s not available for %s column %s. skipping" %(statistic, columnDataType, columnName)
+        
+        ## = example
+        ## select s.seq, t.sl, t.percent, t."awhc_v", t."awhc_v" * (t.percent/100.0) from temp.selectedSlcIds s cross join cmp32 t on t.sl = s.slcid order by s.seq
+        sql = 'select s.seq, t.%s, t.%s, t."%s", t."%s" * (t.%s/100.0) from temp.%s s cross join %s t on t.%s = s.slcid order by s.seq' %(dbSlcKey, dbPercentKey, columnName.strip('"'), columnName.strip('"'), dbPercentKey, self.slcIdsTempTable, tableName, dbSlcKey)
+        
+        # index slc id lookups if table would be scanned for every slc id
+        self.createIndexIfQueryPlanScans(sql, (), tableName, [dbSlcKey, dbPercentKey], tableAlias="t")
+        
+        results = []
+        
+        # rows of slc id are consecutive
+        for seq, rows in itertools.groupby(self.executeSql(sql, stream=True), key=lambda x: x[0]):
+            rows = list(rows)
+            results.append([rows[0][1]] + self.calculateGroupStatistics(columnStatistics, [x[2:] for x in rows]))
+        
+        return self.getStatisticHeaders(columnName, columnStatistics, dbSlcKey), results
+    
+    
+    def calculateGroupStatistics(self, statistics, rows):
+        """
+        purpose:
+        statistics of rows of single slc id
+        
+        notes:
+        -rows are (percent, value, value weighted by percent) in table order
+        -rows with null value or null percent are ignored
+        -numeric statistics formatted to 2 decimal places:
+          * weighted_average; sum of value weighted by percent/100. as per numeric calculation of self.calculateField().
+          not divided by total percent so differs from mean of values if percents of slc id do not sum to 100
+          * min, max; smallest and largest value of rows with percent above 0. not weighted
+          * weighted_stddev; root of percent weighted mean squared difference of values from weighted_average.
+          population standard deviation if percents sum to 100
+          * weighted_median; first value in value order whose cumulative percent reaches half of total percent
+        -categorical statistics:
+          * dominate; dominate category, weight, count and sub-dominate category, weight as per self.calculateField()
+          * category_percent; sum percent per category ie "A:60;B:40", highest first
+        
+        returns:
+        list of cells of all statistics
+        """
+        
+        # values with weight
+        weightedRows = [(value, percent) for percent, value, weightedValue in rows if value is not None and percent is not None]
+        totalWeight = sum([percent for value, percent in weightedRows])
+        
+        # weighted average. sql sum starts from 0.0
+        weightedValues = [weightedValue for percent, value, weightedValue in rows if weightedValue is not None]
+        if len(weightedValues) == 0:
+            weightedAverage = None
+        else:
+            weightedAverage = sum(weightedValues, 0.0)
+        
+        cells = []
+        for statistic in statistics:
+            if statistic == "weighted_average":
+                if weightedAverage is None:
+                    cells.append(None)
+                else:
+                    cells.append("{:0.2f}".format(round(weightedAverage,2)))
+            
+            elif statistic in ("min", "max"):
+                values = [value for value, percent in weightedRows if percent > 0]
+                if len(values) == 0:
+                    cells.append(None)
+                elif statistic == "min":
+                    cells.append("{:0.2f}".format(round(min(values),2)))
+                else:
+                    cells.append("{:0.2f}".format(round(max(values),2)))
+            
+            elif statistic == "weighted_stddev":
+                if totalWeight <= 0 or weightedAverage is None:
+                    cells.append(None)
+                else:
+                    # spread around reported weighted average
+                    variance = sum([percent * (value - weightedAverage) ** 2 for value, percent in weightedRows]) / float(totalWeight)
+                    cells.append("{:0.2f}".format(round(math.sqrt(variance),2)))
+            
+            elif statistic == "weighted_median":
+                if totalWeight <= 0:
+                    cells.append(None)
+                else:
+                    cumulativeWeight = 0
+                    for value, percent in sorted(weightedRows):
+                        cumulativeWeight += percent
+                        if cumulativeWeight * 2 >= totalWeight:
+                            break
+                    cells.append("{:0.2f}".format(round(value,2)))
+            
+            elif statistic == "dominate":
+                # sum percent and count per category as per self.calculateStagedFields()
+                categories = {}
+                for percent, value, weightedValue in rows:
+                    weight, count = categories.get(value, (None, 0))
+                    if percent is not None:
+                        if weight is None:
+                            weight = percent
+                        else:
+                            weight += percent
+                    if value is not None:
+                        count += 1
+                    categories[value] = (weight, count)
+                
+                # rank by sum percent then category, high-low. pad missing sub-dominate
+                ranked = [(category, weight, count) for category, (weight, count) in sorted(categories.items(), key=lambda x: (x[1][0], x[0]), reverse=True)[:2]]
+                ranked = ranked + [(None, None, None)] * (2 - len(ranked))
+                cells.extend([ranked[0][0], ranked[0][1], ranked[0][2], ranked[1][0], ranked[1][1]])
+            
+            elif statistic == "category_percent":
+                categories = {}
+                for value, percent in weightedRows:
+                    categories[value] = categories.get(value, 0) + percent
+                
+                ranked = sorted(categories.items(), key=lambda x: (x[1], x[0]), reverse=True)
+                cells.append(";".join(["%s:%s" %(category, weight) for category, weight in ranked]) or None)
+        
+        return cells
+    
+    
+    def getStatisticHeaders(self, columnName, statistics, dbSlcKey):
+        """
+        purpose:
+        csv headers of column statistics
+        
+        notes:
+        columnName may be quoted as '"name"'
+        
+        returns:
+        list of header strings prefixed with column name
+        """
+        
+        headers = [dbSlcKey]
+        
+        for statistic in statistics:
+            if statistic == "dominate":
+                headers.extend(["dominate_category", "dominate_weight", "dominate_count", "sub_dominate_category", "sub_dominate_weight"])
+            else:
+                headers.append(statistic)
+        
+        # prefix header with column name. remove columnName quoting of '"name"'
+        headerFormat = "%s_%s"
+        
+        return [headerFormat%(columnName.strip('"'), x) for x in headers]
+    
+    
+    def calculateFields(self, slcIds, dbSlcKey, tableName, columnNames, dbPercentKey):
+        """
+        purpose:
+        calculate many columns with single read of table. numeric weighted average or categorical dominate/sub-dominate
+        by slc id as per self.calculateField()
+        
+        how:
+        -slc ids staged in indexed temp table. table rows of all slc ids read once in staged order
+        -per slc id accumulators for every column; running weighted sum for numeric, sum percent and count per category for categorical
+        
+        notes:
+        -columnNames may be quoted as '"name"'
+        -columns whose data type can not be matched are skipped
+        -output per column is same as self.calculateField()
+        -numpy calculation backend used if selected. see self.calculationBackend
+        -columns found in result cache are not calculated. db is not queried if all columns cached
+        
+        returns:
+        list of (column name as given, headers, results) per calculated column
+        """
+        
+        slcIds = list(slcIds)
+        
+        # previously calculated columns
+        cachedColumns = self.getCachedCalculatedColumns(slcIds, dbSlcKey, tableName, columnNames, dbPercentKey)
+        columnsToCalculate = [x for x in columnNames if x not in cachedColumns]
+        
+        if len(columnsToCalculate) > 0:
+            # stage slc ids. affinity of table slc id column handles numeric and alphanumeric slc ids ie ONAD405357 alike
+            self.loadSlcIdsIntoTempTable(slcIds)
+            
+            for columnName, headers, results in self.calculateStagedFields(dbSlcKey, tableName, columnsToCalculate, dbPercentKey):
+                self.cacheCalculatedColumn(slcIds, dbSlcKey, tableName, columnName, dbPercentKey, headers, results)
+                cachedColumns[columnName] = (headers, results)
+        
+        # column order as given
+        return [(columnName,) + tuple(cachedColumns[columnName]) for columnName in columnNames if columnName in cachedColumns]
+    
+    
+    def iterateCalculatedFieldsChunks(self, slcIds, dbSlcKey, tableName, columnNames, dbPercentKey, chunkSize):
+        """
+        purpose:
+        self.calculateFields() of very large slc id selections, one chunk of slc ids at a time
+        
+        how:
+        chunk of slc ids staged with self.stageSlcIdChunks() then calculated with self.calculateStagedFields()
+        
+        notes:
+        -slcIds is any iterable object. next chunk read only when results of current chunk consumed
+        -every chunk returns every calculated column, possibly with no results
+        -result cache not used
+        
+        returns:
+        generator of list of (column name as given, headers, results) per chunk
+        """
+        
+        for chunkLength in self.stageSlcIdChunks(slcIds, chunkSize):
+            yield self.calculateStagedFields(dbSlcKey, tableName, columnNames, dbPercentKey)
+    
+    
+    def calculateFieldInChunks(self, slcIds, dbSlcKey, tableName, columnName, dbPercentKey, chunkSize, statistics=None):
+        """
+        purpose:
+        self.calculateField() of very large slc id selections with bounded memory
+        
+        how:
+        results of chunks of slc ids streamed one after the other. see self.iterateCalculatedFieldsChunks()
+        
+        notes:
+        -slcIds is any iterable object ie generator reading qgis layer
+        -same results as self.calculateField()
+        -statistics as per self.calculateField()
+        
+        returns:
+        sql query headers & results iterator
+        """
+        
+        columnDataType = self.getFieldDataTypes(tableName).get(columnName.strip('"').lower())
+        if not columnDataType:
+            # issue determining column data type
+            print "mmmm couldn't figure out column type"
+            print columnDataType
+            return
+        
+        if statistics:
+            def iterateStatisticsResults():
+                """
+                statistics results rows of every chunk
+                """
+                
+                for chunkLength in self.stageSlcIdChunks(slcIds, chunkSize):
+                    for row in self.calculateStagedFieldStatistics(dbSlcKey, tableName, columnName, dbPercentKey, statistics)[1]:
+                        yield row
+            
+            # headers of statistics available for column
+            if columnDataType == "numeric":
+                availableStatistics = self.numericStatistics
+            else:
+                availableStatistics = self.categoricalStatistics
+            headers = self.getStatisticHeaders(columnName, [x for x in statistics if x in availableStatistics], dbSlcKey)
+            
+            return headers, iterateStatisticsResults()
+        
+        def iterateResults():
+            """
+            results rows of every chunk
+            """
+            
+            for calculatedColumns in self.iterateCalculatedFieldsChunks(slcIds, dbSlcKey, tableName, [columnName], dbPercentKey, chunkSize):
+                for calculatedColumnName, headers, results in calculatedColumns:
+                    for row in results:
+                        yield row
+        
+        return self.getCalculationHeaders(columnName, columnDataType, dbSlcKey), iterateResults()
+    
+    
+    def getTableFingerprint(self, tableName):
+        """
+        purpose:
+        fingerprint of table content for result cache keys
+        
+        how:
+        -soil tables loaded from dbf; content hash of source dbf recorded in source manifest when table was loaded.
+        see self.getSourceManifest()
+        -join tables; join cache key of join signature + slc ids recorded when table was built, plus fingerprints of
+        its soil tables. see self.getJoinTableState()
+        -other tables ie wide calculation tables or db without manifest; soil db file change counter, size and modified time
+        
+        notes:
+        -writes to other tables ie creating a join table, indexes or manifest updates keep fingerprints of loaded soil tables
+        -soil tables and join tables are only expected to change through reload and join scripts. rows changed directly
+        with sql are not seen for them; purge calculation cache after such edits
+        -file change counter of sqlite header is incremented by every committed write in the journal modes used; same size
+        rewrites within modified time resolution are seen. see self.sqliteLoadingPerformanceTuning()
+        -fingerprint includes db path; results are not shared between soil dbs
+        
+        returns:
+        hex string
+        """
+        
+        tableName = tableName.strip('"')
+        dbPath = os.path.abspath(self.sqliteDbPath)
+        
+        # soil table loaded from dbf
+        for sourceTableName, sourceInfo in self.getSourceManifest().items():
+            if sourceTableName.lower() == tableName.lower():
+                return cache.makeKey(dbPath, "source table", sourceTableName.lower(), sourceInfo["contentHash"])
+        
+        # join table. content follows from scenario and soil tables joined
+        state = self.getJoinTableState(tableName)
+        if state:
+            sourceFingerprints = [self.getTableFingerprint(x) for x in join.getSignatureTableNames(state["joinSignature"])]
+            return cache.makeKey(dbPath, "join table", tableName.lower(), state["cacheKey"], *sourceFingerprints)
+        
+        # any committed write to soil db
+        dbFileStat = os.stat(self.sqliteDbPath)
+        with open(self.sqliteDbPath, "rb") as f:
+            fileChangeCounter = struct.unpack(">I", f.read(28)[24:28])[0]
+        
+        return cache.makeKey(dbPath, fileChangeCounter, dbFileStat.st_size, repr(dbFileStat.st_mtime), tableName.lower())
+    
+    
+    def getCalculationCacheKey(self, slcIds, dbSlcKey, tableName, columnName, dbPercentKey, calculationType=None):
+        """
+        purpose:
+        result cache key of column calculation
+        
+        notes:
+        -key is table fingerprint, column, slc id set hash, key columns and calculation type. see aafc_cache.makeKey()
+        -slc ids order and duplicates are part of key as output follows them
+        
+        returns:
+        hex string
+        """
+        
+        if calculationType is None:
+            calculationType = self.columnCalculationType
+        
+        return cache.makeKey(self.getTableFingerprint(tableName), columnName.strip('"').lower(), cache.hashValues(slcIds), dbSlcKey.lower(), dbPercentKey.lower(), calculationType)
+    
+    
+    def getCachedCalculation(self, key):
+        """
+        purpose:
+        column calculation of result cache key
+        
+        notes:
+        entries not holding headers and results count as not cached; recalculated result replaces them
+        
+        returns:
+        tuple of (headers, results) or None if not cached
+        """
+        
+        cachedResults = self.resultCache.get(key)
+        
+        if isinstance(cachedResults, list) and len(cachedResults) == 2 and isinstance(cachedResults[0], list) and isinstance(cachedResults[1], list):
+            return tuple(cachedResults)
+        else:
+            return None
+    
+    
+    def getCachedCalculatedColumns(self, slcIds, dbSlcKey, tableName, columnNames, dbPercentKey):
+        """
+        purpose:
+        columns found in result cache
+        
+        returns:
+        dict of column name as given to (headers, results). empty if result cache not used
+        """
+        
+        cachedColumns = {}
+        
+        if self.resultCache is not None:
+            for columnName in columnNames:
+                cachedResults = self.getCachedCalculation(self.getCalculationCacheKey(slcIds, dbSlcKey, tableName, columnName, dbPercentKey))
+                if cachedResults is not None:
+                    cachedColumns[columnName] = cachedResults
+        
+        return cachedColumns
+    
+    
+    def cacheCalculatedColumn(self, slcIds, dbSlcKey, tableName, columnName, dbPercentKey, headers, results, evict=True, calculationType=None):
+        """
+        purpose:
+        add column calculation to result cache
+        
+        notes:
+        -key uses fingerprint taken after calculation; indexes created by calculation have been written by then
+        -nothing done if result cache not used
+        
+        returns:
+        nothing
+        """
+        
+        if self.resultCache is not None:
+            self.resultCache.put(self.getCalculationCacheKey(slcIds, dbSlcKey, tableName, columnName, dbPercentKey, calculationType), (headers, results), evict=evict)
+    
+    
+    def calculateStagedFields(self, dbSlcKey, tableName, columnNames, dbPercentKey):
+        """
+        purpose:
+        self.calculateFields() for slc ids already staged
+        
+        notes:
+        -slc ids must be staged with self.loadSlcIdsIntoTempTable()
+        -only reads db. used on query only worker connections; see calculateColumnsShard()
+        
+        returns:
+        list of (column name as given, headers, results) per calculated column
+        """
+        
+        columns = self.getCalculationColumns(tableName, columnNames)
+        
+        if len(columns) == 0:
+            return []
+        
+        sql = self.getStagedFieldsSql(dbSlcKey, tableName, columns, dbPercentKey)
+        
+        # vectorized calculation of rows read
+        if self.calculationBackend == "numpy":
+            if np is None:
+                print "numpy not available. calculating with sql"
+            else:
+                return self.calculateFieldsWithNumpy(sql, columns, dbSlcKey)
+        
+        results = [[] for x in columns]
+        
+        for sl, columnValues in self.iterateStagedFieldValues(sql, columns):
+            for i, (columnName, columnDataType) in enumerate(columns):
+                if columnDataType == "numeric":
+                    # format calculated value to 2 decimal places
+                    results[i].append([sl, "{:0.2f}".format(round(columnValues[i],2))])
+                else:
+                    # dominate first, sub-dominate second
+                    tmpResults = [sl]
+                    for category, weight, count in columnValues[i]:
+                        tmpResults.extend([category, weight, count])
+                    # remove None values
+                    results[i].append([a for a in tmpResults if a])
+        
+        #== return headers and results
+        return [(columnName, self.getCalculationHeaders(columnName, columnDataType, dbSlcKey), results[i]) for i, (columnName, columnDataType) in enumerate(columns)]
+    
+    
+    def getCalculationColumns(self, tableName, columnNames):
+        """
+        purpose:
+        calculation data type of columns to calculate
+        
+        notes:
+        -columnNames may be quoted as '"name"'
+        -columns whose data type can not be matched are skipped
+        
+        returns:
+        list of (column name as given, "string" or "numeric")
+        """
+        
+        # column data types from schema cache
+        fieldDataTypes = self.getFieldDataTypes(tableName)
+        
+        columns = []
+        for columnName in columnNames:
+            columnDataType = fieldDataTypes.get(columnName.strip('"').lower())
+            if columnDataType:
+                columns.append((columnName, columnDataType))
+            else:
+                print "could not match data type!! skipping column %s" %(columnName)
+        
+        return columns
+    
+    
+    def getStagedFieldsSql(self, dbSlcKey, tableName, columns, dbPercentKey):
+        """
+        purpose:
+        single select reading table rows of staged slc ids for all columns to calculate
+        
+        notes:
+        -numeric columns weighted by db so type coercion is the same as single column calculation
+        -slc id index created if table would be scanned for every slc id
+        
+        returns:
+        sql string. rows of (seq, slc id, percent, column values) ordered by seq
+        """
+        
+        selectColumns = []
+        for columnName, columnDataType in columns:
+            if columnDataType == "numeric":
+                selectColumns.append('t."%s" * (t.%s/100.0)' %(columnName.strip('"'), dbPercentKey))
+            else:
+                selectColumns.append('t."%s"' %(columnName.strip('"')))
+        
+        ## = examples
+        ## select s.seq, t.sl, t.percent, t."awhc_v" * (t.percent/100.0), t."slope" from temp.selectedSlcIds s cross join cmp32 t on t.sl = s.slcid order by s.seq
+        sql = "select s.seq, t.%s, t.%s, %s from temp.%s s cross join %s t on t.%s = s.slcid order by s.seq" %(dbSlcKey, dbPercentKey, ", ".join(selectColumns), self.slcIdsTempTable, tableName, dbSlcKey)
+        
+        # index slc id lookups if table would be scanned for every slc id
+        self.createIndexIfQueryPlanScans(sql, (), tableName, [dbSlcKey, dbPercentKey], tableAlias="t")
+        
+        return sql
+    
+    
+    def iterateStagedFieldValues(self, sql, columns):
+        """
+        purpose:
+        calculated values of every column per staged slc id row, one slc id at a time
+        
+        how:
+        rows of sql streamed from cursor. per slc id accumulators for every column; running weighted sum for numeric,
+        sum percent and count per category for categorical
         
         notes:
-        -join based on single distinct sl from cmp with common soilkey and single slf layer number
-        -if slf layer number not present for row being evaluated, that row is dropped from resultant table
+        -sql from self.getStagedFieldsSql()
+        -only accumulators of current slc id held in memory
         
         returns:
-        nothing
+        generator of (slc id, list of value per column). numeric value is weighted sum or None if all values null.
+        categorical value is list of up to 2 (category, sum percent, count) ranked by sum percent then category, high-low
         """
-    
-        ##-- sql example -- join all three tables
-        ##-- join cmp & snf first to get soilkey to be used, join cmp row selected against slf table constrained by layer number
-        ##select cmp32.sl, cmp32.soilkey as cmp32_soilkey, snf32.drainage, slf32.* from cmp32 join snf32 on snf32.soilkey like 'ABBUFgl###N' and cmp32.sl = 242021 and cmp32.cmp = 1 join slf32 on cmp32.soilkey like slf32.soilkey and slf32.layer_no = 2
-                
-        resultsTableName = self.joinTableName
-            
-        def processSlcRows(slcIds, dbSlcKey, dbCmpKey, dbSoilKey, dbLayerNumberKey, cmpTableName, snfTableName, slfTableName, landuse, layerNumber):
+        
+        def rankAccumulators(accumulators):
             """
-            process slc ids and insert data into flat results table
-            
-            returns list of messages used for testing
+            completed accumulators of single slc id to column values.
             """
             
-            resultsTableCreated = False
+            columnValues = []
+            for i, (columnName, columnDataType) in enumerate(columns):
+                if columnDataType == "numeric":
+                    columnValues.append(accumulators[i])
+                else:
+                    # rank by sum percent then category, high-low. dominate first, sub-dominate second
+                    ranked = sorted(accumulators[i].items(), key=lambda x: (x[1][0], x[0]), reverse=True)[:2]
+                    columnValues.append([(category, weight, count) for category, (weight, count) in ranked])
             
-            # captures key results that will be added and written to csv only if writeTextCsv = True
-            messagesTestCsv = []
-            messagesTestCsv.append(("///// land use preference is %s\n\n\n"%(landuse)))
-            messagesTestCsv.append(("start time is %s" %(time.ctime(time.time()))))
+            return columnValues
+        
+        # rows of slc id are consecutive
+        currentSeq = None
+        currentSl = None
+        accumulators = None
+        for row in self.executeSql(sql, stream=True):
+            seq, sl, percent = row[0], row[1], row[2]
             
+            if seq != currentSeq:
+                if accumulators is not None:
+                    yield currentSl, rankAccumulators(accumulators)
+                currentSeq = seq
+                currentSl = sl
+                accumulators = [None if columnDataType == "numeric" else {} for columnName, columnDataType in columns]
             
-            # get all soil keys from snf table
-            sql = "select distinct(%s) from %s" %(dbSoilKey, snfTableName)
-            results = self.executeSql(sql)
-            snfSoilKeys = []
-            # clean up into simple list of strings
-            for e in results:
-                snfSoilKeys.append(e[0])
-             
-            # sql insert string. string holds all inserts per slc id & at end inserts into db
-            sqlInserts = []
+            for i, (columnName, columnDataType) in enumerate(columns):
+                value = row[i + 3]
+                if columnDataType == "numeric":
+                    # sum of weighted values. null values ignored
+                    if value is not None:
+                        if accumulators[i] is None:
+                            # sql sum starts from 0.0
+                            accumulators[i] = 0.0 + value
+                        else:
+                            accumulators[i] += value
+                else:
+                    # sum percent and count of non null category
+                    weight, count = accumulators[i].get(value, (None, 0))
+                    if percent is not None:
+                        if weight is None:
+                            weight = percent
+                        else:
+                            weight += percent
+                    if value is not None:
+                        count += 1
+                    accumulators[i][value] = (weight, count)
+        
+        if accumulators is not None:
+            yield currentSl, rankAccumulators(accumulators)
+    
+    
+    def calculateFieldsWide(self, slcIds, dbSlcKey, tableName, columnNames, dbPercentKey, chunkSize=None):
+        """
+        purpose:
+        calculate many columns into single wide table. one row per slc id holding calculations of all columns
+        
+        how:
+        slc ids staged and table rows read once as per self.calculateFields(). rows produced one slc id at a time
+        
+        notes:
+        -columnNames may be quoted as '"name"'
+        -same calculated values as self.calculateFields() but every column keeps fixed cells; cells without value are None
+        -results are streamed. numpy calculation backend and result cache are not used
+        -slc ids staged in chunks of chunkSize as rows are consumed. see self.stageSlcIdChunks()
+        
+        returns:
+        tuple of (list of headers, row iterator)
+        """
+        
+        columns = self.getCalculationColumns(tableName, columnNames)
+        headers = [x[0] for x in self.getWideCalculationHeaders(columns, dbSlcKey)]
+        
+        if len(columns) == 0:
+            return headers, iter([])
+        
+        def iterateWideRows():
+            """
+            wide row per slc id. numeric; weighted average, categorical; dominate category, weight, count and
+            sub-dominate category, weight
+            """
             
-            # process slc ids
-            for slcId in slcIds:
-                # process each row within given sl
-                
-                # create data structure from sql query once for each sl processed. list of tuples containing (sl, cmp, soilkey). access via index
-                # query db cmp table for sl, cmp, soilkey
-                sql = "select %s, %s, %s from %s where %s = %s" %(dbSlcKey, dbCmpKey, dbSoilKey, cmpTableName, dbSlcKey, slcId)
-                results = self.executeSql(sql) 
+            for chunkLength in self.stageSlcIdChunks(slcIds, chunkSize):
+                sql = self.getStagedFieldsSql(dbSlcKey, tableName, columns, dbPercentKey)
                 
-                # process
-                for item in results:
-                    slcId = item[0]
-                    cmpId = item[1]
-                    soilKeyToUse = item[2]
-                    
-                    # is user landuse preference availabe
-                    # check end character of string; if matches user then select key else use default of N
-                    snfSoilKeyToUse = ""
-                    
-                    #////// only for output diagnostic csv
-                    # get list of snf soil keys present that match cmp soil key
-                    snfDistinctKeysMsg = []
-                    if soilKeyToUse[:-1] + landuse in snfSoilKeys:
-                        # user landuse preference can be accomidated
-                        snfDistinctKeysMsg.append((soilKeyToUse[:-1] + landuse))
-                        
-                    if soilKeyToUse[:-1] + "N" in snfSoilKeys:
-                        # default landuse of N
-                        snfDistinctKeysMsg.append((soilKeyToUse[:-1] + "N"))
-                    
-                    messagesTestCsv.append("snf soil keys: %s" %(snfDistinctKeysMsg))
-                    # //////////
-                    
-                    # match cmp soil key to snf soil and respect user land use preference if possible 
-                    # strip off last character of cmp soil key. add user landuse and check if in snf soilkey list
-                    if soilKeyToUse[:-1] + landuse in snfSoilKeys:
-                        # user landuse preference can be accomidated
-                        snfSoilKeyToUse = soilKeyToUse[:-1] + landuse
-                        messagesTestCsv.append(("Can accomindate land use preference"))
-                    elif soilKeyToUse[:-1] + "N" in snfSoilKeys:
-                        # default landuse of N
-                        snfSoilKeyToUse = soilKeyToUse[:-1] + "N"
-                        messagesTestCsv.append(("* Can't accomindate land use preference"))
-                    
-                    
-                    #//////
-                    # join slf table based on soil key and layer number
-                    # check if user requested snl layer number is avaiable. if not, disgard slc id and process next one
-                    snlLayerNumberToUse = ""
-                    snlLayerNumberFound = False
-                    
-                    # get distinct layer numbers in snl table based on snf soilkey to be used
-                    sql = "select distinct(%s) from %s where %s like '%s'" %(dbLayerNumberKey, slfTableName, dbSoilKey, snfSoilKeyToUse)
-                    results = self.executeSql(sql)
-                    
-                    msg = "distinct snl layer numbers are %s\n" %(results)
-                    messagesTestCsv.append(msg)
-                    
-                    # is user requested slf layer number available
-                    for e in results:
-                        if e[0] == layerNumber:
-                            # match
-                            snlLayerNumberToUse = e[0]
-                            snlLayerNumberFound = True
-                            messagesTestCsv.append((">>> user requested soil layer in slf table found\n\n----------\n"))
-                            break
-                    
-                    # user layer number missing. drop this slc id + cmp row. process next slc id + cmp row
-                    if snlLayerNumberFound == False:    
-                        msg = "* slf layer number not found. skipping current slc id + cmp row. will try next row.\n\n----------\n"
-                        messagesTestCsv.append(msg)
-                        break    
-                    
-                    # process join
-                    if not resultsTableCreated:
-                        # table does not exist
-                        # create table
-                        sql = "create table %s as select * from %s join %s on %s.%s like '%s' and %s.%s = %s and %s.%s = %s join %s on %s.%s like %s.%s and %s.%s = %s" %(resultsTableName, cmpTableName, snfTableName, snfTableName, dbSoilKey, snfSoilKeyToUse, cmpTableName, dbSlcKey, slcId, cmpTableName, dbCmpKey, cmpId, slfTableName, cmpTableName, dbSoilKey, slfTableName, dbSoilKey, slfTableName, dbLayerNumberKey, snlLayerNumberToUse)
-                        self.executeSql(sql)
-                        
-                        # commit transaction
-                        self.conn.commit()
-                        
-                        # flaf that table has been created
-                        resultsTableCreated = True
-                    else:
-                        #== insert data into table
-                        # join cmp sl row to snf row and slf row with soilkey and layer number match. return all columns from tables
-                        # cmp cmp id constrains to create unique row id for cmp
-                        sql = "insert into %s select * from %s join %s on %s.%s like '%s' and %s.%s = %s and %s.%s = %s join %s on %s.%s like %s.%s and %s.%s = %s" %(resultsTableName, cmpTableName, snfTableName, snfTableName, dbSoilKey, snfSoilKeyToUse, cmpTableName, dbSlcKey, slcId, cmpTableName, dbCmpKey, cmpId, slfTableName, cmpTableName, dbSoilKey, slfTableName, dbSoilKey, slfTableName, dbLayerNumberKey, snlLayerNumberToUse)
-                        ##self.executeSql(sql)
-                        sqlInserts.append(sql)
-            
-            
-            messagesTestCsv.append(("start sql inserts: time is %s" %(time.ctime(time.time()))))
-            # process all sql insert statements for slc ids
-            self.executeSql(sqlInserts, multipleSqlString=True)
-            messagesTestCsv.append(("finished sql inserts: time is %s" %(time.ctime(time.time()))))
-                    
-            # commit transaction
-            self.conn.commit()
-
-            messagesTestCsv.append(("all finished -- db commit finished: time is %s" %(time.ctime(time.time()))))
-
-            return messagesTestCsv
-        #//////////                        
-#         ## example
-#         #select * from cmp, snf where cmp.sl = 242021 and cmp.cmp = 1 and snf.soilkey = 'ABBUFgl###N'
-#         sql = "create table %s as select * from %s, %s where %s.%s = %s and %s.%s = %s and %s.%s = '%s'" %(resultsTableName, cmpTableName, snfTableName, cmpTableName, dbSlcKey, slcId, cmpTableName, dbCmpKey, cmpId, snfTableName, dbSoilKey, snfSoilKeyToUse)
-# 
-#         # create sql insert strings
-#         sql = "insert into %s select * from %s, %s where %s.%s = %s and %s.%s = %s and %s.%s = '%s'" %(resultsTableName, cmpTableName, snfTableName, cmpTableName, dbSlcKey, slcId, cmpTableName, dbCmpKey, cmpId, snfTableName, dbSoilKey, snfSoilKeyToUse)
-#         sqlInserts.append(sql)
+                for sl, columnValues in self.iterateStagedFieldValues(sql, columns):
+                    row = [sl]
+                    for (columnName, columnDataType), value in zip(columns, columnValues):
+                        if columnDataType == "numeric":
+                            # format calculated value to 2 decimal places
+                            row.append(None if value is None else "{:0.2f}".format(round(value,2)))
+                        else:
+                            # pad missing sub-dominate
+                            ranked = value + [(None, None, None)] * (2 - len(value))
+                            row.extend([ranked[0][0], ranked[0][1], ranked[0][2], ranked[1][0], ranked[1][1]])
+                    yield row
+        
+        return headers, iterateWideRows()
+    
+    
+    def getWideCalculationHeaders(self, columns, dbSlcKey):
+        """
+        purpose:
+        headers of wide calculation table. slc id followed by calculation headers of every column
         
+        notes:
+        columns as per self.getCalculationColumns()
         
-        sql = "drop table if exists %s" %(resultsTableName)
-        self.executeSql(sql)
+        returns:
+        list of (header string, sqlite column type)
+        """
         
-        # create new results table with join results inserted for each slc id row
-        messages = processSlcRows(slcIds, dbSlcKey, dbCmpKey, dbSoilKey, dbLayerNumberKey, cmpTableName, snfTableName, slfTableName, landuse, layerNumber)
+        headers = [(dbSlcKey, "")]
         
-        # write test csv output if writeTestCsv requested
-        if writeTestCsv:
-            with open(os.path.join(writeTestCsvDirectory, "test_3_tableJoin.txt"),"w") as file_open:
-                for msg in messages:
-                    file_open.writelines(msg)
-                    file_open.write("\n")
+        for columnName, columnDataType in columns:
+            # slc id header of column left out
+            columnHeaders = self.getCalculationHeaders(columnName, columnDataType, dbSlcKey)[1:]
+            if columnDataType == "numeric":
+                columnTypes = ["REAL"]
+            else:
+                columnTypes = ["TEXT", "NUMERIC", "INTEGER", "TEXT", "NUMERIC"]
+            headers.extend(zip(columnHeaders, columnTypes))
+        
+        return headers
     
     
-    # //////////////////// categorical and numeric column calculations
-    def calculateField(self, slcIds, dbSlcKey, tableName, columnName, dbPercentKey):
+    def createWideCalculationTable(self, slcIds, dbSlcKey, tableName, columnNames, dbPercentKey, resultsTableName, batchSize=10000, chunkSize=None):
         """
         purpose:
-        calculate user selected column. determines field type to dispatch either numeric or categorical calculation
-        by slc id.
+        calculate many columns into wide results table in soil db. see self.calculateFieldsWide()
+        
+        how:
+        results table created from wide headers. rows inserted with executemany in batches of batchSize as they are
+        calculated; single transaction committed at end. slc id column indexed
         
         notes:
-        dbSlcKey is column for slc id's.
-        slcIds is any iterable object. 
+        -results table replaced if present
+        -python sqlite3 resets open cursors on commit. calculation rows are read from open cursor, so batches are not
+        committed on their own. staging of slc id chunks commits between chunks
+        
+        returns:
+        number of rows written
+        """
+        
+        headers, rows = self.calculateFieldsWide(slcIds, dbSlcKey, tableName, columnNames, dbPercentKey, chunkSize=chunkSize)
+        headerTypes = self.getWideCalculationHeaders(self.getCalculationColumns(tableName, columnNames), dbSlcKey)
+        
+        # results table. ddl before calculation rows are read
+        self.dropTable(resultsTableName)
+        sql = "create table %s(%s)" %(resultsTableName, ", ".join(['"%s" %s' %(header, headerType) for header, headerType in headerTypes]))
+        self.executeSql(sql)
+        self.invalidateSchemaCache(resultsTableName)
+        
+        sql = "insert into %s values (%s)" %(resultsTableName, ", ".join(["?"] * len(headers)))
+        
+        rowCount = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batchSize:
+                self.executeSql(sql, parameterRows=batch)
+                rowCount += len(batch)
+                batch = []
+        if batch:
+            self.executeSql(sql, parameterRows=batch)
+            rowCount += len(batch)
+        self.conn.commit()
+        
+        # index for joins on slc id
+        self.createIndex(resultsTableName, [dbSlcKey])
+        
+        return rowCount
+
+
+    def calculateFieldsInParallel(self, slcIds, dbSlcKey, tableName, columnNames, dbPercentKey, processes, csvOutputDirectory, csvFilePrefixName):
+        """
+        purpose:
+        calculate columns with a pool of worker processes. each worker writes csv per column
         
         how:
-        sql query via python to db
+        -columns split into subsets, one per worker
+        -each worker opens own query only db connection, stages slc ids in its temp schema and calculates its columns with
+        self.calculateStagedFields(). csv written per column with Io.writeCsvFile(). see calculateColumnsShard()
+        -main process only gathers csv paths
+        
+        notes:
+        -columnNames may be quoted as '"name"'
+        -slc id index needed by calculations created before workers start; workers can not write to db
+        -same csv output as self.calculateFields() + Io.writeCsvFile() per column
+        -columns found in result cache are written by main process. workers add their columns to result cache
         
         returns:
-        sql query headers & results        
+        list of (column name as given, csv path) per calculated column
         """
         
-        # determine column data type
-        # used to dispatch appriopate method to calculate
-        def determineFieldDataType(tableName, columnName):
-            """
-            determine sqlite column data type. this ensures that characters such as #, _, - or "" not interpretted wrongly.
-            in several cases first row that starts with them is a numeric field.
-            
-            uses sqlite pragma table_info to get sqlite column datatype assumptions. check user passed column against this table.
-    
-            return single value of "string" or "numeric"
-            """
-            
-            # data type from sqlite for user supplied column
-            columnDataType = "" 
+        slcIds = list(slcIds)
+        columnNames = list(columnNames)
+        
+        csvFilePaths = {}
+        
+        # previously calculated columns written straight to csv
+        cachedColumns = self.getCachedCalculatedColumns(slcIds, dbSlcKey, tableName, columnNames, dbPercentKey)
+        if len(cachedColumns) > 0:
+            io = inout.Io(tempSystemDirectoryPath=self.tmpDirectory)
+            for columnName, (headers, results) in cachedColumns.items():
+                csvFilePaths[columnName] = io.writeCsvFile(columnName, headers, results, csvOutputDirectory, csvFilePrefixName=csvFilePrefixName)
+        
+        columnsToCalculate = [x for x in columnNames if x not in cachedColumns]
+        if len(columnsToCalculate) == 0:
+            return [(columnName, csvFilePaths[columnName]) for columnName in columnNames]
+        
+        # index slc id lookups if table would be scanned for every slc id
+        self.loadSlcIdsIntoTempTable(slcIds)
+        sql = "select s.seq, t.%s, t.%s from temp.%s s cross join %s t on t.%s = s.slcid order by s.seq" %(dbSlcKey, dbPercentKey, self.slcIdsTempTable, tableName, dbSlcKey)
+        self.createIndexIfQueryPlanScans(sql, (), tableName, [dbSlcKey, dbPercentKey], tableAlias="t")
+        self.conn.commit()
+        
+        # workers open result cache of main process
+        if self.resultCache is not None:
+            resultCacheSettings = (self.resultCache.cacheDirectory, self.resultCache.budgetBytes)
+        else:
+            resultCacheSettings = None
+        
+        # column subsets. every nth column so wide and narrow columns are spread over workers
+        processes = max(1, min(processes, len(columnsToCalculate)))
+        tasks = []
+        for i in range(processes):
+            tasks.append((self.sqliteDbPath, self.tmpDirectory, self.calculationBackend, resultCacheSettings, slcIds, dbSlcKey, tableName, columnsToCalculate[i::processes], dbPercentKey, csvOutputDirectory, csvFilePrefixName))
+        
+        # worker processes must run python, not the qgis executable
+        inout.setWorkerPythonExecutable()
+        
+        pool = Pool(processes=len(tasks))
+        try:
+            results = pool.map(calculateColumnsShard, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        
+        # workers do not evict. cache trimmed to budget once
+        if self.resultCache is not None:
+            self.resultCache.evict()
+        
+        # csv paths in column order
+        csvFilePaths.update(dict([x for shard in results for x in shard]))
+        
+        return [(columnName, csvFilePaths[columnName]) for columnName in columnNames if columnName in csvFilePaths]
 
-            # query sqlite pragma table_info
-            sql = "pragma table_info(%s)" % (tableName)
-            data = self.executeSql(sql)
-                
-            # match user column to sqlite field data returned from pragma
-            # process tuples of this format (0, u'OGC_FID', u'INTEGER', 0, None, 1)
-            fieldDataType = ""
-            for row in data:
-                # remove double quote within single quote if present. only passed if db column name is duplicate ie '"slope:2"'
-                columnNameStripped = columnName.strip('\"')
-                if row[1].lower() == columnNameStripped.lower():
-                    # match found. get sqlite field type
-                    fieldDataType = row[2]
-                    break
-            
-            
-            # check fieldType
-            # sqlite provides either VARCHAR/TEXT or INTEGER/REAL
-            # convert fieldtype to lower to check
-            if fieldDataType.lower().startswith("var") or fieldDataType.lower().startswith("tex"):
-                # text
-                columnDataType = "string"
-                return columnDataType
-            elif fieldDataType.lower().startswith("int") or fieldDataType.lower().startswith("rea") or fieldDataType.lower().startswith("flo"):
-                columnDataType = "numeric"
-                return columnDataType
-            else:
-                print "could not match data type!!"
-            
 
-                
-        def categoricalCalculation(slcIds, dbSlcKey, tableName, columnName, dbPercentKey):
-            """
-            - dominate based on higest sum percent value for unique values. count is not
-            a factor in determining.
-            - * check if result class = ""; replace with "NULL"
-    
-            calculates dominate/sub-dominate results for single string db field
-    
-            returns columns headers plus results.
-            """
+    def calculateFieldsWithNumpy(self, sql, columns, dbSlcKey):
+        """
+        purpose:
+        numpy backend of self.calculateFields(). vectorized group by of rows read
         
-            # hold select dominate/sub-dominate data
-            results = []
-            
-            sqlStatements = []
-            
-            # default for slc id polygon data type is numeric
-            slcIdKeyNumeric = True
-            
-            # check if slc (polygon) id is alphanumeric ie ONAD405357
-            test_value = slcIds[0]
-            
-            if type(test_value) == str or type(test_value) == unicode:
-                slcIdKeyNumeric = False
-            
-            for slcId in slcIds:
-                # process each sl id separatly
+        how:
+        -rows of sql (seq, sl, percent, column values) loaded into column arrays once. group per staged slc id row ie seq
+        -numeric; weighted values summed per group with np.bincount
+        -categorical; categories factorized into codes. sorted by group + code, sum percent and count reduced per
+        group + category with np.add.reduceat. ranked by sum percent then category, high-low; first 2 per group kept
+        
+        notes:
+        -requires numpy. see self.calculationBackend
+        -rows within group summed in same order as sql so results match sql calculation
+        -null values are ignored as per sql sum() and count()
+        
+        returns:
+        list of (column name as given, headers, results) per calculated column
+        """
+        
+        rows = self.executeSql(sql)
+        
+        if len(rows) == 0:
+            return [(columnName, self.getCalculationHeaders(columnName, columnDataType, dbSlcKey), []) for columnName, columnDataType in columns]
+        
+        # column arrays
+        values = zip(*rows)
+        
+        # group per staged slc id row. rows are sorted by seq
+        seqs = np.array(values[0], dtype=np.int64)
+        groupStarts = np.flatnonzero(np.r_[True, seqs[1:] != seqs[:-1]])
+        groupIds = np.cumsum(np.r_[True, seqs[1:] != seqs[:-1]]) - 1
+        groupCount = len(groupStarts)
+        
+        # slc id of group as stored in table
+        sls = [values[1][i] for i in groupStarts]
+        
+        # percent. integer percent kept as integer so summed weights are written as sql does
+        percentNotNull = np.array([x is not None for x in values[2]])
+        if all([isinstance(x, (int, long)) for x in values[2] if x is not None]):
+            percentDtype = np.int64
+        else:
+            percentDtype = np.float64
+        percents = np.array([0 if x is None else x for x in values[2]], dtype=percentDtype)
+        percentIsReal = np.array([isinstance(x, float) for x in values[2]])
+        
+        calculatedColumns = []
+        
+        for i, (columnName, columnDataType) in enumerate(columns):
+            columnValues = values[i + 3]
             
-                # summarize single sl id. determine count of categories present. rank by high-low.
-                # dominate has highest count, sub-dominate is second highest.
+            if columnDataType == "numeric":
+                # weighted values. nulls add nothing
+                notNull = np.array([x is not None for x in columnValues])
+                weighted = np.array([0.0 if x is None else x for x in columnValues], dtype=np.float64)
                 
-                ## = examples
-                ## select sl, dominate_category, dominate_weight from (select distinct(slope) as dominate_category,sl,sum(percent) as dominate_weight from cmp32 where sl = 254001 group by slope order by count(slope) desc limit 1) as  t
-                ##sql = """select distinct(%s),count(%s) as count, sum(percent) as dominance from %s where %s = %s group by %s order by count(%s) desc""" %(dbSlcKey,column,column,tableName,dbSlcKey,slcId,column,column)
+                sums = np.bincount(groupIds, weights=weighted, minlength=groupCount).tolist()
+                notNullCounts = np.bincount(groupIds, weights=notNull, minlength=groupCount)
                 
-                if slcIdKeyNumeric:
-                    # key is numeric. no quoted slc id = value
-                    # return 2 rows, first = dominate; second if present if sub-dominate
-                    sql = "select %s, dominate_category, dominate_weight, dominate_count, sub_dominate_category, sub_dominate_weight from (select distinct(%s) as dominate_category, %s, sum(%s) as dominate_weight, count(%s) as dominate_count, NULL as sub_dominate_category, NULL as sub_dominate_weight from %s where %s = %s group by %s order by sum(%s) desc limit 2) as t " %(dbSlcKey, columnName,dbSlcKey,dbPercentKey,columnName, tableName, dbSlcKey, slcId,columnName,dbPercentKey)
-                else:
-                    # key is alphanumeric. quote sld id = 'value'
-                    sql = "select %s, dominate_category, dominate_weight, dominate_count, sub_dominate_category, sub_dominate_weight from (select distinct(%s) as dominate_category, %s, sum(%s) as dominate_weight, count(%s) as dominate_count, NULL as sub_dominate_category, NULL as sub_dominate_weight from %s where %s = '%s' group by %s order by sum(%s) desc limit 2) as t " %(dbSlcKey, columnName,dbSlcKey,dbPercentKey,columnName, tableName, dbSlcKey, slcId,columnName,dbPercentKey)
+                # sum of nulls only is null as per sql
+                results = [[sls[g], "{:0.2f}".format(round(sums[g] if notNullCounts[g] else None,2))] for g in xrange(groupCount)]
+            else:
+                # factorize categories. codes sorted in same order as sql ie null, numbers then text
+                categories, codes = np.unique(np.array(columnValues, dtype=object), return_inverse=True)
+                categoryNotNull = np.array([x is not None for x in columnValues])
                 
-                # capture sql statement
-                sqlStatements.append(sql)
+                # group + category segments. stable sort keeps row order within segment
+                order = np.lexsort((codes, groupIds))
+                segmentGroups = groupIds[order]
+                segmentCodes = codes[order]
+                segmentStarts = np.flatnonzero(np.r_[True, (segmentGroups[1:] != segmentGroups[:-1]) | (segmentCodes[1:] != segmentCodes[:-1])])
                 
-            #execute sql
-            results = self.executeSql(sqlStatements, fieldNames=True, multipleSqlString=True)
-            
-            
-            #== clean up returned data
-            #example: [['sl', 'dominate_category', 'dominate_weight', 'dominate_count', 'sub_dominate_category', 'sub_dominate_weight'], [(251011, u'A', 50, 2, None, None), (251011, u'B', 50, 1, None, None)]]
-            
-            cleanedResults = []
-            
-            for e in results:
-                # get second item containing data
-                rawResults = e[1]
-                # check if value present
-                if len(rawResults) == 0:
-                    # no data
-                    pass
-                elif len(rawResults) > 1:
-                    # have dominate and subdominate. remove sub-dominate slc id number
-                    # convert dominate/sub-dominate into sep lists
-                    tmpDominate = list(rawResults[0])
-                    tmpSubDominate = list(rawResults[1])
-                    # remove sub-dominate slc id
-                    tmpSubDominate.pop(0)
-                    # combine lists together
-                    tmpResults = tmpDominate + tmpSubDominate
-                    # remove None values
-                    # add to cleaned up data. remove None from data
-                    cleanedResults.append([a for a in tmpResults if a])
-                else:
-                    # only dominate present
-                    # extract tuple items from list
-                    # add to cleaned up data. remove None from data
-                    cleanedResults.append([a for l in rawResults for a in l if a])
-            
-            #== return headers and results
-            # prefix header with column name
-            headers = results[0][0]
-            headerFormat = "%s_%s"
-            # remove columnName quoting of '"name"'
-            columnName = columnName.strip('"')
-            headersPrefixed = [headerFormat%(columnName, x) for x in headers]
-
-            return headersPrefixed, cleanedResults
-
-
-        def numericCalculation(slcIds, dbSlcKey, tableName, columnName, dbPercentKey):
-            """
-            purpose:
-            calculates weighted summed average of single numeric db field by slc id
-            
-            how:
-            sql query
-            
-            notes:
-            db drops rows with no data
-            
-            returns:
-            sl id and value
-            """
-            
-            # hold calculated sum weighted value
-            results = []
-            
-            sqlStatements = []
-            
-            # default for slc id polygon data type is numeric
-            slcIdKeyNumeric = True
-            
-            # check if slc (polygon) id is alphanumeric ie ONAD405357
-            test_value = slcIds[0]
-            
-            if type(test_value) == str or type(test_value) == unicode:
-                slcIdKeyNumeric = False
-            
-            for slcId in slcIds:
-                # process each sl id separatly
+                segmentGroups = segmentGroups[segmentStarts]
+                segmentCodes = segmentCodes[segmentStarts]
+                weights = np.add.reduceat(percents[order], segmentStarts)
+                weightNotNull = np.add.reduceat(percentNotNull[order].astype(np.int64), segmentStarts) > 0
+                weightIsReal = np.add.reduceat(percentIsReal[order].astype(np.int64), segmentStarts) > 0
+                counts = np.add.reduceat(categoryNotNull[order].astype(np.int64), segmentStarts)
                 
-                ## = examples
-                ## select distinct(sl) as sl, sum(awhc_v * (percent/100.0)) as final from cmp32 where sl = 376002 group by sl
-                ## sql = """select distinct(sl) as sl, sum(%s * (percent/100.0)) as final from %s where sl = %s group by sl""" %(column,tableName,sl)
+                # rank within group by sum percent then category, high-low. null sum percent ranked last
+                weightKeys = np.where(weightNotNull, weights.astype(np.float64), -np.inf)
+                ranking = np.lexsort((-segmentCodes, -weightKeys, segmentGroups))
+                rankedGroups = segmentGroups[ranking]
+                rankedStarts = np.flatnonzero(np.r_[True, rankedGroups[1:] != rankedGroups[:-1]])
+                ranks = np.arange(len(ranking)) - np.repeat(rankedStarts, np.diff(np.r_[rankedStarts, len(ranking)]))
                 
-                if slcIdKeyNumeric:
-                    # key is numeric. no quoted slc id = value
-                    sql ="select distinct(%s) as %s, sum(%s * (%s/100.0)) as weighted_average from %s where %s = %s group by %s" % (dbSlcKey, dbSlcKey, columnName, dbPercentKey, tableName, dbSlcKey,  slcId, dbSlcKey)
-                else:
-                    # key is numeric. quoted slc id = 'value'
-                    sql ="select distinct(%s) as %s, sum(%s * (%s/100.0)) as weighted_average from %s where %s = '%s' group by %s" % (dbSlcKey, dbSlcKey, columnName, dbPercentKey, tableName, dbSlcKey,  slcId, dbSlcKey)
-
-                # add sql statement
-                sqlStatements.append(sql)
-            
-            
-            #execute sql
-            results = self.executeSql(sqlStatements, fieldNames=True, multipleSqlString=True)
-            
-            #== clean up returned data
-            #example: "['sl', 'weighted_average']","[(242022, -3.3000000000000003)]"
-            
-            cleanedResults = []
-            
-            for e in results:
-                # get second item containing data
-                rawResults = e[1]
-                # check if value present
-                if len(rawResults) == 0:
-                    # no data
-                    pass
-                else:
-                    # format calculated value to 2 decimal places
-                    formattedNumber = [rawResults[0][0],"{:0.2f}".format(round(rawResults[0][1],2))]
-                    # add to cleaned up data. remove None from data
-                    cleanedResults.append(formattedNumber)
-                        
-            # return headers and results. headers will be last iteration.
-            #return header, results
-            # prefix header with column name
-            headers = results[0][0]
-            headerFormat = "%s_%s"
-            # remove columnName quoting of '"name"'
-            columnName = columnName.strip('"')
-            headersPrefixed = [headerFormat%(columnName, x) for x in headers]
+                # dominate and sub-dominate per group
+                ranked = [[sls[g]] for g in xrange(groupCount)]
+                weights = weights.tolist()
+                if percentDtype is np.float64:
+                    # sql sum of integer percents only is integer
+                    weights = [weight if isReal else int(weight) for weight, isReal in zip(weights, weightIsReal.tolist())]
+                for segment, rank in zip(ranking.tolist(), ranks.tolist()):
+                    if rank < 2:
+                        ranked[segmentGroups[segment]].extend([categories[segmentCodes[segment]], weights[segment] if weightNotNull[segment] else None, int(counts[segment])])
+                
+                # remove None values
+                results = [[a for a in tmpResults if a] for tmpResults in ranked]
             
-            return headersPrefixed, cleanedResults
+            calculatedColumns.append((columnName, self.getCalculationHeaders(columnName, columnDataType, dbSlcKey), results))
         
+        return calculatedColumns
+    
+    
+    def getCalculationHeaders(self, columnName, columnDataType, dbSlcKey):
+        """
+        purpose:
+        csv headers of column calculation
         
-        # determine column field data type
-        columnDataTypeIs = determineFieldDataType(tableName, columnName)
-        
-        # dispatch to correct calculation method based on field data type
-        if columnDataTypeIs == "string":
-            # categorical column calculation
-            headers, results = categoricalCalculation(slcIds, dbSlcKey, tableName, columnName, dbPercentKey)
-            
-            return headers, results
+        notes:
+        columnName may be quoted as '"name"'
         
-        elif columnDataTypeIs == "numeric":
-            # numeric column calculation
-            headers, results = numericCalculation(slcIds, dbSlcKey, tableName, columnName, dbPercentKey)
-            
-            return headers, results
+        returns:
+        list of header strings prefixed with column name
+        """
         
+        if columnDataType == "numeric":
+            headers = [dbSlcKey, "weighted_average"]
         else:
-            # issue determining column data type
-            print "mmmm couldn't figure out column type"
-            print columnDataTypeIs
+            headers = [dbSlcKey, "dominate_category", "dominate_weight", "dominate_count", "sub_dominate_category", "sub_dominate_weight"]
+        
+        # prefix header with column name. remove columnName quoting of '"name"'
+        headerFormat = "%s_%s"
+        
+        return [headerFormat%(columnName.strip('"'), x) for x in headers]
 
+
+def buildJoinShard(task):
+    """
+    purpose:
+    worker process function building join rows for a shard of slc ids
+    
+    how:
+    own db connection to soil db. shard sqlite file attached; join spec compiled and join rows created in shard file
+    
+    notes:
+    -module level function so it can be sent to multiprocessing pool workers
+    -task is tuple of (soil db path, temp directory, join spec, list of slc ids, shard db path)
+    
+    returns:
+    tuple of (shard db path, shard table name, join row count)
+    """
+    
+    sqliteDbPath, tmpDirectory, joinSpec, slcIds, shardDbPath = task
+    
+    shardTableName = "joinShard"
+    
+    db = Db(sqliteDbPath, tmpDirectory)
+    db.prepareJoinSpec(joinSpec)
+    
+    sql = "attach database '%s' as shard" %(shardDbPath)
+    db.executeSql(sql)
+    
+    # stage shard slc ids and resolve soilkeys
+    db.loadSlcIdsIntoTempTable(slcIds)
+    for sql in joinSpec.compileStagingSql(db.slcIdsTempTable):
+        db.executeSql(sql)
+    
+    # join rows into shard file
+    db.executeSql(joinSpec.compileCreateTableSql("shard.%s" %(shardTableName)))
+    db.conn.commit()
+    
+    sql = "select count(*) from shard.%s" %(shardTableName)
+    shardRowCount = db.executeSql(sql)[0][0]
+    
+    db.conn.close()
+    
+    return (shardDbPath, shardTableName, shardRowCount)
+
+
+def calculateColumnsShard(task):
+    """
+    purpose:
+    worker process function calculating a subset of columns and writing csv per column
+    
+    how:
+    own query only db connection to soil db. slc ids staged in connection temp schema before db set to query only
+    
+    notes:
+    -module level function so it can be sent to multiprocessing pool workers
+    -task is tuple of (soil db path, temp directory, calculation backend, result cache (directory, budget bytes) or None,
+    list of slc ids, slc id column, table name, list of column names, percent column, csv output directory, csv file prefix)
+    -calculated columns added to result cache without eviction. main process evicts
+    
+    returns:
+    list of (column name, csv path) per calculated column
+    """
+    
+    sqliteDbPath, tmpDirectory, calculationBackend, resultCacheSettings, slcIds, dbSlcKey, tableName, columnNames, dbPercentKey, csvOutputDirectory, csvFilePrefixName = task
+    
+    db = Db(sqliteDbPath, tmpDirectory)
+    db.calculationBackend = calculationBackend
+    if resultCacheSettings is not None:
+        db.resultCache = cache.ResultCache(*resultCacheSettings)
+    io = inout.Io(tempSystemDirectoryPath=tmpDirectory)
+    
+    # temp schema is per connection. soil db file not written
+    db.loadSlcIdsIntoTempTable(slcIds)
+    db.setQueryOnly()
+    
+    csvFilePaths = []
+    for columnName, headers, results in db.calculateStagedFields(dbSlcKey, tableName, columnNames, dbPercentKey):
+        db.cacheCalculatedColumn(slcIds, dbSlcKey, tableName, columnName, dbPercentKey, headers, results, evict=False)
+        csvFilePaths.append((columnName, io.writeCsvFile(columnName, headers, results, csvOutputDirectory, csvFilePrefixName=csvFilePrefixName)))
+    
+    db.conn.close()
+    
+    return csvFilePaths
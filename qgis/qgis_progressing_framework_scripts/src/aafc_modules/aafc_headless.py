@@ -0,0 +1,435 @@
+"""
+purpose:
+run the create soil db, join and calculate steps without qgis. used from a plain python command line or batch pipeline
+
+how:
+python. step functions wrap aafc_io.Io and aafc_database.Db the same way the qgis processing scripts do. main() parses
+command line arguments with argparse and runs one step
+
+notes:
+-no qgis dependency. qgis api is imported only when create-db is asked for a spatialite db with --spatialite
+-slc ids are read from a text file, one id per line, instead of a qgis vector layer selection. no file means all slc ids of cmp table
+-run as: python aafc_headless.py create-db|join|calculate|purge-cache --help
+-same db, join tables and csv output as the processing scripts
+
+license:
+gpl3
+
+developer:
+richard burcher
+richardburcher@gmail.com
+2014
+"""
+
+import os
+import sys
+import tempfile
+import argparse
+
+import aafc_io as inout
+import aafc_utilities as utilities
+import aafc_database as database
+import aafc_join as join
+import aafc_cache as cache
+
+
+def createSoilDb(inSoilDbPath, tableNamesToDbfPaths, tmpDirectory, dbSoilKey="soilkey", dbSlcKey="sl", dbCmpKey="cmp", dbPercentKey="percent", dbLayerNumberKey="layer_no", processes=1, incremental=True, spatialite=False):
+    """
+    purpose:
+    create soil db from soil dbf's or bring existing soil db in line with changed dbf's
+
+    how:
+    -incremental; only tables whose source dbf changed are dropped, reloaded, indexed and analyzed. see Db.getChangedSourceTables()
+    -otherwise existing db removed and all dbf's loaded. see Io.createNewDb()
+
+    notes:
+    -tableNamesToDbfPaths is mapping of cmp/snf/slf to dbf path. cmp required
+    -spatialite True converts cmp through qgis api; qgis must be running. used by script 0_create_soil_db
+    -changed cmp dbf or db without source manifest always fully rebuilt
+    -raises Exception if dbf's can not be loaded
+
+    returns:
+    tuple of (Db instance, list of loaded table names, list of rows loaded and rows/sec per table)
+    """
+
+    io = inout.Io(inSoilDbPath=inSoilDbPath, tempSystemDirectoryPath=tmpDirectory)
+
+    # source dbf's of existing db. full rebuild if db has no manifest or cmp changed
+    changedTables = None
+    if incremental and os.path.exists(inSoilDbPath):
+        db = database.Db(inSoilDbPath, tmpDirectory)
+        changedTables, removedTables, sourceInfos = db.getChangedSourceTables(tableNamesToDbfPaths)
+        if not db.getSourceManifest() or "cmp" in changedTables:
+            changedTables = None
+        db.conn.close()
+
+    if changedTables is None:
+        # remove existing db
+        if os.path.exists(inSoilDbPath):
+            os.remove(inSoilDbPath)
+
+        #========== create db and load with passed dbf paths
+        # source dbf's recorded before load. createNewDb() consumes mapping
+        sourceInfos = dict([(name, io.getSourceFileInfo(path)) for name, path in tableNamesToDbfPaths.items()])
+
+        if not io.createNewDb(dict(tableNamesToDbfPaths), processes=processes, spatialite=spatialite):
+            raise Exception("Problem loading dbf's into db")
+
+        # db must exist before sqlite connection can exit
+        db = database.Db(inSoilDbPath, tmpDirectory)
+
+        if spatialite:
+            # change initial loaded cmp table name from db name to "cmp"
+            db.updateDbTableName("cmp")
+
+        # all tables loaded
+        changedTables = db.getSoilTablesListing()
+    else:
+        #========== incremental rebuild. reload changed tables only
+        db = database.Db(inSoilDbPath, tmpDirectory)
+
+        # changed and removed tables dropped with join tables built from them
+        db.dropSourceTables(changedTables + removedTables)
+
+        for name in changedTables:
+            if not io.addDbfToDb(tableNamesToDbfPaths[name], name):
+                raise Exception("Problem loading dbf's into db")
+
+        # tables loaded through other connection
+        db.invalidateSchemaCache()
+
+    # user options for joins. cmp, cmp-snf or cmp-snf-slf
+    db.createUserTableProcessingOptions(utilities.Utils(None).getTableProcessingOptions(db.getSoilTablesListing()))
+
+    # landuse preference resolved as indexed equality join in joins
+    db.createNormalizedSoilKeyColumns(changedTables, dbSoilKey)
+
+    # for speed up on joins and queries
+    db.createDbIndexesOnLoadedData(changedTables, dbSoilKey, dbSlcKey, dbCmpKey, dbPercentKey, dbLayerNumberKey)
+
+    # record source dbf's of loaded tables
+    for name, sourceInfo in sourceInfos.items():
+        db.saveSourceManifestEntry(name, sourceInfo)
+
+    return db, changedTables, io.loadMessages
+
+
+def iterateSlcIds(slcIdsFilePath):
+    """
+    purpose:
+    slc ids read from text file one at a time
+
+    notes:
+    -one slc id per line. blank lines skipped
+    -integer looking ids returned as integers to match shapefile values
+
+    returns:
+    generator of slc ids
+    """
+
+    with open(slcIdsFilePath) as f:
+        for line in f:
+            value = line.strip()
+            if not value:
+                continue
+            try:
+                yield int(value)
+            except ValueError:
+                yield value
+
+
+def getSlcIds(db, dbSlcKey, slcIdsFilePath=None):
+    """
+    purpose:
+    slc ids to process
+
+    notes:
+    all distinct slc ids of cmp table if no file given. equivalent to no polygon selection in qgis
+
+    returns:
+    list of slc ids
+    """
+
+    if slcIdsFilePath:
+        return list(iterateSlcIds(slcIdsFilePath))
+
+    sql = "select distinct %s from cmp order by %s" %(dbSlcKey, dbSlcKey)
+
+    return db.convertDbResults2SimpleList(db.executeSql(sql))
+
+
+def createJoin(inSoilDbPath, tmpDirectory, tableNames, slcIds, dbSlcKey="sl", dbSoilKey="soilkey", dbPercentKey="percent", dbLayerNumberKey="layer_no", landuse="A", layerNumber=4, incremental=True, useCache=True, processes=1):
+    """
+    purpose:
+    create join table of cmp + snf, cmp + snf + slf or cmp + slf
+
+    notes:
+    -same join table and indexes as script 3-0_create_multi_table_soil_join. not loaded into qgis
+    -tableNames ie ["cmp", "snf", "slf"]
+
+    returns:
+    list of messages
+    """
+
+    db = database.Db(inSoilDbPath, tmpDirectory)
+
+    # db performance tuning
+    db.sqliteLoadingPerformanceTuning(enable=True)
+
+    joinSpec = join.createSoilJoinSpec(tableNames, dbSlcKey=dbSlcKey, dbSoilKey=dbSoilKey, landuse=landuse, dbLayerNumberKey=dbLayerNumberKey, layerNumber=layerNumber)
+    messages = db.createJoinTable(joinSpec, slcIds, incremental=incremental, useCache=useCache, processes=processes)
+
+    # covering slc id + percent index; column indexes created on demand by calculations
+    db.createDbIndexesOnJoinedTable(dbSlcKey, dbPercentKey)
+    db.conn.commit()
+    db.conn.close()
+
+    return messages
+
+
+def calculateColumns(inSoilDbPath, tmpDirectory, tableName, slcIds, outputDirectory, columnNames=None, dbSlcKey="sl", dbPercentKey="percent", csvFilePrefixName="calculation", statistics=None, chunkSize=0, processes=1, wide=False, wideToDb=False, numpy=False, useCache=True):
+    """
+    purpose:
+    calculate soil table columns per slc id
+
+    how:
+    -statistics; csv per column of requested statistics as script 2_calculate_cmp_soil_table_column
+    -otherwise csv per column, single wide csv or wide soil db table as script 4_calculate_all_table_columns
+
+    notes:
+    -columnNames None calculates every column except derived soilkey columns
+    -chunkSize > 0; slc ids processed chunkSize at a time. slcIds may then be a generator
+
+    returns:
+    list of csv paths or name of wide soil db table
+    """
+
+    io = inout.Io(tempSystemDirectoryPath=tmpDirectory)
+    db = database.Db(inSoilDbPath, tmpDirectory)
+
+    # db performance tuning. no vacuum; db file left unchanged so cached results are reused
+    db.sqliteLoadingPerformanceTuning(enable=True, vacuum=False)
+
+    if numpy:
+        db.calculationBackend = "numpy"
+
+    # reuse results calculated in previous runs for unchanged soil db and slc ids
+    if useCache:
+        db.resultCache = cache.ResultCache(cache.getCacheDirectory(tmpDirectory))
+
+    if columnNames is None:
+        # derived soilkey columns are not calculated
+        columnNames = [x for x in db.getTableFieldNames(tableName) if x.lower() not in db.normalizedSoilKeyColumns]
+
+    # column field must be qouted as '"field_to_calculate"'
+    calculationColumnNames = ['"%s"' %(column) for column in columnNames]
+
+    outputs = []
+
+    if statistics:
+        if chunkSize > 0:
+            # columns calculated in turn; slc ids read again per column
+            slcIds = list(slcIds)
+        for calculationColumnName in calculationColumnNames:
+            if chunkSize > 0:
+                headers, results = db.calculateFieldInChunks(slcIds, dbSlcKey=dbSlcKey, tableName=tableName, columnName=calculationColumnName, dbPercentKey=dbPercentKey, chunkSize=chunkSize, statistics=statistics)
+            else:
+                headers, results = db.calculateField(slcIds, dbSlcKey=dbSlcKey, tableName=tableName, columnName=calculationColumnName, dbPercentKey=dbPercentKey, statistics=statistics)
+            outputs.append(io.writeCsvFile(calculationColumnName, headers, results, outputDirectory, csvFilePrefixName=csvFilePrefixName))
+    elif wide and wideToDb:
+        # all columns into single results table in soil db
+        wideTableName = "%s_%s" %(csvFilePrefixName, tableName)
+        db.createWideCalculationTable(slcIds, dbSlcKey=dbSlcKey, tableName=tableName, columnNames=calculationColumnNames, dbPercentKey=dbPercentKey, resultsTableName=wideTableName, chunkSize=chunkSize)
+        outputs.append(wideTableName)
+    elif wide:
+        # all columns into single csv. rows streamed to disk
+        headers, rows = db.calculateFieldsWide(slcIds, dbSlcKey=dbSlcKey, tableName=tableName, columnNames=calculationColumnNames, dbPercentKey=dbPercentKey, chunkSize=chunkSize)
+        outputs.append(io.writeCsvFile(tableName, headers, rows, outputDirectory, csvFilePrefixName=csvFilePrefixName))
+    elif chunkSize > 0:
+        # results of slc id chunks appended to csv per column
+        calculatedChunks = db.iterateCalculatedFieldsChunks(slcIds, dbSlcKey=dbSlcKey, tableName=tableName, columnNames=calculationColumnNames, dbPercentKey=dbPercentKey, chunkSize=chunkSize)
+        for chunkNumber, calculatedColumns in enumerate(calculatedChunks):
+            for calculationColumnName, headers, results in calculatedColumns:
+                outCsvFilePath = io.writeCsvFile(calculationColumnName, headers, results, outputDirectory, csvFilePrefixName=csvFilePrefixName, append=chunkNumber > 0)
+                if chunkNumber == 0:
+                    outputs.append(outCsvFilePath)
+    elif processes > 1:
+        # columns split over worker processes. each worker writes its csv files
+        calculatedCsvFiles = db.calculateFieldsInParallel(slcIds, dbSlcKey=dbSlcKey, tableName=tableName, columnNames=calculationColumnNames, dbPercentKey=dbPercentKey, processes=processes, csvOutputDirectory=outputDirectory, csvFilePrefixName=csvFilePrefixName)
+        outputs.extend([x[1] for x in calculatedCsvFiles])
+    else:
+        # calculate all columns with single read of table
+        calculatedColumns = db.calculateFields(slcIds, dbSlcKey=dbSlcKey, tableName=tableName, columnNames=calculationColumnNames, dbPercentKey=dbPercentKey)
+        for calculationColumnName, headers, results in calculatedColumns:
+            outputs.append(io.writeCsvFile(calculationColumnName, headers, results, outputDirectory, csvFilePrefixName=csvFilePrefixName))
+
+    db.conn.commit()
+    db.conn.close()
+
+    return outputs
+
+
+def purgeCache(tmpDirectory, cacheDirectory=None):
+    """
+    purpose:
+    remove every calculated column result from calculation cache
+
+    notes:
+    default cache directory is the one used by calculations. see aafc_cache.getCacheDirectory()
+
+    returns:
+    tuple of (cache directory, number of entries removed, bytes freed)
+    """
+
+    if not cacheDirectory:
+        cacheDirectory = cache.getCacheDirectory(tmpDirectory)
+
+    removedCount, removedBytes = cache.ResultCache(cacheDirectory).purge()
+
+    return cacheDirectory, removedCount, removedBytes
+
+
+def splitOption(value):
+    """
+    purpose:
+    comma separated command line option as list
+
+    returns:
+    list of strings or None if option not given
+    """
+
+    if not value:
+        return None
+
+    return [x.strip() for x in value.split(",") if x.strip()]
+
+
+def createArgumentParser():
+    """
+    purpose:
+    command line arguments of each step
+
+    notes:
+    option defaults match the processing scripts
+
+    returns:
+    argparse.ArgumentParser instance
+    """
+
+    parser = argparse.ArgumentParser(description="AAFC soil tools without QGIS")
+    subparsers = parser.add_subparsers(dest="step")
+
+    # options shared by steps
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--tmp-directory", default=tempfile.gettempdir(), help="temp directory. also holds calculation cache")
+    common.add_argument("--slc-id-column", default="sl", help="cmp table slc id column")
+    common.add_argument("--percent-column", default="percent", help="cmp table percent column")
+    common.add_argument("--soil-key-column", default="soilkey", help="soil tables soil key column")
+    common.add_argument("--layer-number-column", default="layer_no", help="slf table layer number column")
+
+    # 0 create soil db
+    createDbParser = subparsers.add_parser("create-db", parents=[common], help="create soil db from soil dbf's")
+    createDbParser.add_argument("--db", required=True, help="soil db path")
+    createDbParser.add_argument("--cmp", required=True, help="cmp dbf path")
+    createDbParser.add_argument("--snf", help="snf dbf path")
+    createDbParser.add_argument("--slf", help="slf dbf path")
+    createDbParser.add_argument("--cmp-column", default="cmp", help="cmp table cmp column")
+    createDbParser.add_argument("--processes", type=int, default=1, help="processes loading dbf's")
+    createDbParser.add_argument("--full-rebuild", action="store_true", help="reload every dbf even if unchanged")
+    createDbParser.add_argument("--spatialite", action="store_true", help="convert cmp through qgis api to spatialite. requires qgis")
+
+    # 3-0 create multi table soil join
+    joinParser = subparsers.add_parser("join", parents=[common], help="create join table")
+    joinParser.add_argument("--db", required=True, help="soil db path")
+    joinParser.add_argument("--tables", required=True, help="join ie cmp-snf, cmp-snf-slf or cmp-slf")
+    joinParser.add_argument("--slc-ids", help="text file of slc ids, one per line. default all slc ids")
+    joinParser.add_argument("--landuse", default="A", help="snf table landuse preference")
+    joinParser.add_argument("--layer-number", type=int, default=4, help="slf table layer number")
+    joinParser.add_argument("--processes", type=int, default=1, help="processes building join table")
+    joinParser.add_argument("--no-incremental", action="store_true", help="always rebuild join table")
+    joinParser.add_argument("--no-join-cache", action="store_true", help="do not keep previous join tables")
+
+    # 2, 3-1 and 4 calculate columns
+    calculateParser = subparsers.add_parser("calculate", parents=[common], help="calculate soil table columns")
+    calculateParser.add_argument("--db", required=True, help="soil db path")
+    calculateParser.add_argument("--table", default="cmp", help="table to calculate ie cmp or joinedSoilTables")
+    calculateParser.add_argument("--columns", help="comma separated columns. default all columns")
+    calculateParser.add_argument("--slc-ids", help="text file of slc ids, one per line. default all slc ids")
+    calculateParser.add_argument("--output-directory", default=".", help="csv output directory")
+    calculateParser.add_argument("--prefix", default="calculation", help="csv file prefix")
+    calculateParser.add_argument("--statistics", help="comma separated statistics ie weighted_average,weighted_median")
+    calculateParser.add_argument("--chunk-size", type=int, default=0, help="slc ids calculated at a time. 0 all at once")
+    calculateParser.add_argument("--processes", type=int, default=1, help="processes calculating columns")
+    calculateParser.add_argument("--wide", action="store_true", help="all columns in single csv")
+    calculateParser.add_argument("--wide-to-db", action="store_true", help="with --wide, write soil db table instead of csv")
+    calculateParser.add_argument("--numpy", action="store_true", help="calculate with numpy if installed")
+    calculateParser.add_argument("--no-cache", action="store_true", help="do not use calculation cache")
+
+    # 5 purge calculation cache
+    purgeParser = subparsers.add_parser("purge-cache", parents=[common], help="empty calculation cache")
+    purgeParser.add_argument("--cache-directory", help="cache directory. default cache directory in temp directory")
+
+    return parser
+
+
+def main(argv=None):
+    """
+    purpose:
+    run step given on command line
+
+    returns:
+    exit status integer
+    """
+
+    args = createArgumentParser().parse_args(argv)
+
+    if args.step == "create-db":
+        tableNamesToDbfPaths = dict([(name, path) for name, path in [("cmp", args.cmp), ("snf", args.snf), ("slf", args.slf)] if path])
+
+        if args.spatialite:
+            # qgis api needed for spatialite conversion
+            from qgis.core import QgsApplication
+            qgisApplication = QgsApplication([], False)
+            qgisApplication.initQgis()
+
+        db, loadedTables, loadMessages = createSoilDb(args.db, tableNamesToDbfPaths, args.tmp_directory, dbSoilKey=args.soil_key_column, dbSlcKey=args.slc_id_column, dbCmpKey=args.cmp_column, dbPercentKey=args.percent_column, dbLayerNumberKey=args.layer_number_column, processes=args.processes, incremental=not args.full_rebuild, spatialite=args.spatialite)
+        db.conn.close()
+
+        if args.spatialite:
+            qgisApplication.exitQgis()
+
+        for msg in loadMessages:
+            print msg
+        print "soil db %s. tables loaded: %s" %(args.db, ", ".join(loadedTables) or "none")
+
+    elif args.step == "join":
+        db = database.Db(args.db, args.tmp_directory)
+        slcIds = getSlcIds(db, args.slc_id_column, args.slc_ids)
+        db.conn.close()
+
+        messages = createJoin(args.db, args.tmp_directory, args.tables.split("-"), slcIds, dbSlcKey=args.slc_id_column, dbSoilKey=args.soil_key_column, dbPercentKey=args.percent_column, dbLayerNumberKey=args.layer_number_column, landuse=args.landuse, layerNumber=args.layer_number, incremental=not args.no_incremental, useCache=not args.no_join_cache, processes=args.processes)
+        for msg in messages:
+            print msg
+
+    elif args.step == "calculate":
+        if args.slc_ids and args.chunk_size > 0:
+            # slc ids read from file chunk by chunk as they are calculated
+            slcIds = iterateSlcIds(args.slc_ids)
+        else:
+            db = database.Db(args.db, args.tmp_directory)
+            slcIds = getSlcIds(db, args.slc_id_column, args.slc_ids)
+            db.conn.close()
+
+        outputs = calculateColumns(args.db, args.tmp_directory, args.table, slcIds, args.output_directory, columnNames=splitOption(args.columns), dbSlcKey=args.slc_id_column, dbPercentKey=args.percent_column, csvFilePrefixName=args.prefix, statistics=splitOption(args.statistics), chunkSize=args.chunk_size, processes=args.processes, wide=args.wide, wideToDb=args.wide_to_db, numpy=args.numpy, useCache=not args.no_cache)
+        for output in outputs:
+            print output
+
+    elif args.step == "purge-cache":
+        cacheDirectory, removedCount, removedBytes = purgeCache(args.tmp_directory, args.cache_directory)
+        print "purged calculation cache %s. removed %s cached results, freeing %0.1f MB" %(cacheDirectory, removedCount, removedBytes / (1024.0 * 1024.0))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
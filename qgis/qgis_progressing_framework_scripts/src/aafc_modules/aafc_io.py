@@ -5,6 +5,8 @@ handles all file input/output and conversions
 notes:
 -creates spatialite db (sqlite with spatial extenions). 
 -the cmp dbf is converted to the spatialite via qgis api. subsequent dbf's are converted to csv via qgis api and loaded into db via python
+-without qgis, all dbf's are read directly into a plain sqlite db. qgis api imported only by methods using it
+-snf/slf dbf's can be loaded in parallel into staging sqlite files by worker processes. see createNewDb()
 -output of soil column calculated csv's handled here
 
 license:
@@ -17,11 +19,15 @@ richardburcher@gmail.com
 """
 
 import os
+import sys
 import csv
 import sqlite3
-from qgis.core import *
-from qgis.gui import *
-from qgis.utils import *
+import struct
+import time
+import hashlib
+import uuid
+import multiprocessing
+from multiprocessing import Pool
 
 
 class Io:
@@ -36,9 +42,15 @@ class Io:
 
         # temp system directory
         self.tmpDirectory = kwargs.get("tempSystemDirectoryPath", None)
+        
+        # dbf field types read directly. character, numeric, float, logical, date
+        self.dbfFieldTypes = ["C", "N", "F", "L", "D"]
+        
+        # rows loaded and load speed per table. see self.addDbfToDb()
+        self.loadMessages = []
     
 
-    def createNewDb(self, namesToPaths):
+    def createNewDb(self, namesToPaths, processes=1, spatialite=True):
         """
         purpose:
         create spatialite soil db
@@ -46,6 +58,10 @@ class Io:
         notes:
         -create initial spatialite db using cmp db; this table is always used
         -names of tables are generic, cmp/snf/slf are used
+        -processes > 1; snf/slf loaded into own staging sqlite file by worker processes while cmp converted. staging files
+        copied into db once cmp loaded. see loadDbfIntoStagingDb(), self.copyStagingDbIntoDb()
+        -spatialite False; no qgis. plain sqlite db, cmp read directly and named cmp like the other tables. cmp staged by
+        worker process as well
         
         returns:
         boolean status of db creation and data load
@@ -69,6 +85,8 @@ class Io:
             nothing
             """
 
+            from qgis.core import QgsVectorLayer, QgsVectorFileWriter
+            
             # loads as qgis vector layer, but do not display on canvas
             # tableName will be table name in spatialite
             dbfLayer = QgsVectorLayer(path,tableName,"ogr")
@@ -86,67 +104,406 @@ class Io:
                 return True
 
 
-        def addOtherDbfsToDb(path, tableName):
-            """
-            purpose:
-            load additional soil dbf's such as snf, slf into existing spatialite db
+        # staging file per additional dbf loaded by worker processes
+        stagingTasks = []
+        if processes > 1:
+            stagingPrefix = uuid.uuid4().hex[:12]
+            for name, path in namesToPaths.items():
+                if name == "cmp" and spatialite:
+                    continue
+                stagingDbPath = os.path.join(self.tmpDirectory, "loadStaging_%s_%s.sqlite" %(stagingPrefix, name))
+                stagingTasks.append((path, stagingDbPath, name, name == "cmp"))
+        
+        stagingDbPaths = {}
+        pool = None
+        try:
+            if len(stagingTasks) > 0:
+                # worker processes must run python, not the qgis executable
+                setWorkerPythonExecutable()
+                
+                # workers load while cmp converted below
+                pool = Pool(processes=min(processes, len(stagingTasks)))
+                stagingResults = pool.map_async(loadDbfIntoStagingDb, stagingTasks)
             
-            how:
-            qgis api loads dbf's, converts to csv in tmp location. csv's loaded into existing spatialite db
+            if spatialite:
+                # process cmp dbf first
+                # create initial table
+                loadStatus = createInitialDb(namesToPaths["cmp"],"cmp")
             
-            notes:
-            table names are user controlled when loading from csv file
+            if pool is not None:
+                # wait for staging files
+                for name, stagingDbPath, recordCount, msg in stagingResults.get():
+                    if stagingDbPath is None:
+                        print "dbf %s not loaded into staging file. loading in main process: %s" %(name, msg)
+                    else:
+                        stagingDbPaths[name] = stagingDbPath
+                        self.loadMessages.append(msg)
             
-            returns:
-            nothing
-            """
-
-            # tmp path for conversion
-            tmpPathToWriteCsv = os.path.join(self.tmpDirectory, tableName)
-
-            # create qgis vector layer
-            dbfLayer = QgsVectorLayer(path, tableName,"ogr")
+            if loadStatus:
+                if spatialite:
+                    # remove cmp key from mapping
+                    namesToPaths.pop("cmp")
             
-            # check if layer valid
-            if not dbfLayer.isValid():
-                return False
-            else:
-                # convert to csv using qgis ogr provider
-                QgsVectorFileWriter.writeAsVectorFormat(dbfLayer,tmpPathToWriteCsv,"CP1250",None,"CSV",False,None)
+                # check if additional mapping keys present. cmp first if not converted through qgis
+                for name, path in sorted(namesToPaths.items(), key=lambda x: x[0] != "cmp"):
+                    # process each path
+                    if name in stagingDbPaths:
+                        # copy loaded staging table
+                        self.copyStagingDbIntoDb(stagingDbPaths[name], self.sqliteDbPath, name)
+                        continue
+                    
+                    # convert to csv & load
+                    loadStatus = self.addDbfToDb(path, name, lowerCaseFieldNames=name == "cmp")
+                    
+                    # check if issues loading additional layers
+                    if loadStatus:
+                        continue
+                    else:
+                        return loadStatus
     
-                # load csv into db.
-                self.convert(tmpPathToWriteCsv + ".csv", self.sqliteDbPath,tableName)
-                
-                return True
+            else:
+                # problem loading layer
+                # return load status of layers
+                return loadStatus
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            
+            # staging files not copied ie cmp failed to load
+            for path, stagingDbPath, name, lowerCaseFieldNames in stagingTasks:
+                if os.path.exists(stagingDbPath):
+                    os.remove(stagingDbPath)
+
+        return loadStatus
 
 
-        # process cmp dbf first
-        # create initial table
-        loadStatus = createInitialDb(namesToPaths["cmp"],"cmp")
+    def addDbfToDb(self, path, tableName, lowerCaseFieldNames=False):
+        """
+        purpose:
+        load additional soil dbf's such as snf, slf into existing spatialite db
         
-        if loadStatus:
-            # remove cmp key from mapping
-            namesToPaths.pop("cmp")
+        how:
+        dbf records read directly and loaded into existing spatialite db. see self.loadDbfIntoDb()
+        if dbf can not be read directly, qgis api loads dbf's, converts to csv in tmp location. csv's loaded into
+        existing spatialite db
         
-            # check if additional mapping keys present
-            for name, path in namesToPaths.items():
-                # process each path
-                # convert to csv & load
-                loadStatus = addOtherDbfsToDb(path, name)
-                
-                # check if issues loading additional layers
-                if loadStatus:
-                    continue
-                else:
-                    return loadStatus
+        notes:
+        -table names are user controlled when loading from csv file
+        -table must not exist in db
+        -lowerCaseFieldNames; see self.loadDbfIntoDb()
+        -rows loaded and rows/sec added to self.loadMessages
+        
+        returns:
+        boolean status of data load
+        """
+
+        # direct load. column types from dbf field descriptors
+        try:
+            startTime = time.time()
+            rowCount = self.loadDbfIntoDb(path, self.sqliteDbPath, tableName, lowerCaseFieldNames=lowerCaseFieldNames)
+            self.loadMessages.append(formatLoadMessage(tableName, "dbf", rowCount, getRowsPerSecond(rowCount, time.time() - startTime)))
+            return True
+        except (ValueError, struct.error, UnicodeDecodeError), e:
+            print "dbf %s not loaded directly. converting through csv: %s" %(path, e)
+            
+            # remove partly loaded table
+            conn = sqlite3.connect(self.sqliteDbPath)
+            conn.execute("drop table if exists %s" %(tableName))
+            conn.commit()
+            conn.close()
 
+        from qgis.core import QgsVectorLayer, QgsVectorFileWriter
+        
+        # tmp path for conversion
+        tmpPathToWriteCsv = os.path.join(self.tmpDirectory, tableName)
+
+        # create qgis vector layer
+        dbfLayer = QgsVectorLayer(path, tableName,"ogr")
+        
+        # check if layer valid
+        if not dbfLayer.isValid():
+            return False
         else:
-            # problem loading layer
-            # return load status of layers
-            return loadStatus
+            # convert to csv using qgis ogr provider
+            QgsVectorFileWriter.writeAsVectorFormat(dbfLayer,tmpPathToWriteCsv,"CP1250",None,"CSV",False,None)
+
+            # load csv into db.
+            rowCount, rowsPerSecond = self.convert(tmpPathToWriteCsv + ".csv", self.sqliteDbPath,tableName)
+            self.loadMessages.append(formatLoadMessage(tableName, "csv", rowCount, rowsPerSecond))
+            
+            return True
 
-        return loadStatus
 
+    def getSourceFileInfo(self, path, readBytes=1024 * 1024):
+        """
+        purpose:
+        identity of source dbf file for the soil db source manifest
+        
+        how:
+        file size and modified time from os.stat. content hash is sha1 of file read in blocks of readBytes
+        
+        notes:
+        see Db.getChangedSourceTables()
+        
+        returns:
+        dict with keys sourcePath, sizeBytes, mtime, contentHash
+        """
+        
+        fileStat = os.stat(path)
+        
+        contentHash = hashlib.sha1()
+        with open(path, "rb") as fileObj:
+            while True:
+                data = fileObj.read(readBytes)
+                if not data:
+                    break
+                contentHash.update(data)
+        
+        return {"sourcePath": path, "sizeBytes": fileStat.st_size, "mtime": fileStat.st_mtime, "contentHash": contentHash.hexdigest()}
+    
+    
+    # ========== read dbf file directly into existing sqlite db
+    def readDbfHeader(self, fileObj):
+        """
+        purpose:
+        read dbase table file header and field descriptors
+        
+        how:
+        python struct. dbase III/IV layout; 32 byte header followed by 32 byte field descriptor per field,
+        terminated by 0x0D
+        
+        notes:
+        -fileObj must be positioned at start of file
+        -only field types C (character), N/F (numeric), L (logical) and D (date) supported. others raise ValueError
+        
+        returns:
+        tuple of (number of records, header length, record length, list of (field name, field type, length, decimals))
+        """
+        
+        header = fileObj.read(32)
+        if len(header) < 32:
+            raise ValueError("dbf header too short")
+        
+        numberOfRecords, headerLength, recordLength = struct.unpack("<xxxxIHH20x", header)
+        
+        fields = []
+        while True:
+            descriptor = fileObj.read(32)
+            if len(descriptor) == 0 or descriptor[0] == "\x0d":
+                break
+            if len(descriptor) < 32:
+                raise ValueError("dbf field descriptor too short")
+            
+            fieldName, fieldType, fieldLength, fieldDecimals = struct.unpack("<11sc4xBB14x", descriptor)
+            # field name is null padded
+            fieldName = fieldName.split("\x00")[0].strip()
+            
+            if fieldType not in self.dbfFieldTypes:
+                raise ValueError("dbf field type %s of field %s not supported" %(fieldType, fieldName))
+            
+            fields.append((fieldName, fieldType, fieldLength, fieldDecimals))
+        
+        # deletion flag + fields
+        if recordLength != 1 + sum([x[2] for x in fields]):
+            raise ValueError("dbf record length does not match field descriptors")
+        
+        return numberOfRecords, headerLength, recordLength, fields
+    
+    
+    def getDbfFieldSqliteType(self, fieldType, fieldDecimals):
+        """
+        purpose:
+        sqlite column type from dbf field descriptor
+        
+        notes:
+        numeric without decimals is INTEGER, numeric with decimals REAL. everything else TEXT
+        
+        returns:
+        sqlite type string
+        """
+        
+        if fieldType in ("N", "F"):
+            if fieldDecimals == 0 and fieldType == "N":
+                return "INTEGER"
+            else:
+                return "REAL"
+        else:
+            return "TEXT"
+    
+    
+    def iterateDbfRecords(self, fileObj, numberOfRecords, headerLength, recordLength, fields, encoding, readRecords=10000):
+        """
+        purpose:
+        records of dbase table file ready for insert into sqlite, one record at a time
+        
+        how:
+        -readRecords records read from file at once. each record split into fields with single struct unpack
+        -fields converted column by column for all records read
+        
+        notes:
+        -deleted records are skipped
+        -character values have trailing blanks removed. decoded with encoding unless all text of records read is ascii
+        -numeric values are returned as text; sqlite INTEGER/REAL column affinity converts them on insert as it did for
+        csv loading. blank or overflowed (*) numeric values are None
+        -dates written as YYYY/MM/DD; same as qgis csv conversion
+        
+        returns:
+        generator of tuples of values in field order
+        """
+        
+        # deletion flag followed by fixed width fields
+        recordStruct = struct.Struct("1s" + "".join(["%ss" %(x[2]) for x in fields]))
+        
+        fileObj.seek(headerLength)
+        
+        remainingRecords = numberOfRecords
+        while remainingRecords > 0:
+            recordCount = min(readRecords, remainingRecords)
+            data = fileObj.read(recordLength * recordCount)
+            # truncated file or end of file marker
+            recordCount = len(data) // recordLength
+            if recordCount == 0:
+                break
+            remainingRecords -= recordCount
+            
+            # ascii text is stored by sqlite as is. decoding per value only needed for other characters
+            try:
+                data.decode("ascii")
+                decodeText = False
+            except UnicodeDecodeError:
+                decodeText = True
+            
+            # records not deleted
+            records = [recordStruct.unpack_from(data, offset) for offset in xrange(0, recordCount * recordLength, recordLength)]
+            records = [x for x in records if x[0] != "*"]
+            if len(records) == 0:
+                continue
+            
+            columns = []
+            for (fieldName, fieldType, fieldLength, fieldDecimals), values in zip(fields, zip(*records)[1:]):
+                if fieldType == "C":
+                    values = [x.rstrip(" \x00") for x in values]
+                    if decodeText:
+                        values = [x.decode(encoding) for x in values]
+                    columns.append(values)
+                else:
+                    values = [x.strip(" \x00") for x in values]
+                    if fieldType == "D":
+                        columns.append([x[:4] + "/" + x[4:6] + "/" + x[6:] if len(x) == 8 else None for x in values])
+                    elif fieldType == "L":
+                        # T/F/Y/N kept as character. ? is not set
+                        columns.append([x if x and x != "?" else None for x in values])
+                    else:
+                        columns.append([x if x and x[0] != "*" else None for x in values])
+            
+            for values in zip(*columns):
+                yield values
+    
+    
+    def loadDbfIntoDb(self, dbfPath, dbPath, tableName, batchSize=10000, encoding="cp1250", lowerCaseFieldNames=False):
+        """
+        purpose:
+        load dbase table file straight into new table of existing sqlite db
+        
+        how:
+        -dbf field descriptors define table columns and types. see self.getDbfFieldSqliteType()
+        -records read in batches of batchSize and written with executemany. single transaction for whole table
+        
+        notes:
+        -no intermediate csv; records are not held in memory beyond single batch
+        -raises ValueError for dbf files that can not be read directly ie unsupported field types
+        -lowerCaseFieldNames; column names lower cased as ogr does when converting cmp to spatialite
+        
+        returns:
+        number of records loaded
+        """
+        
+        with open(dbfPath, "rb") as fileObj:
+            numberOfRecords, headerLength, recordLength, fields = self.readDbfHeader(fileObj)
+            
+            conn = sqlite3.connect(dbPath)
+            c = conn.cursor()
+            
+            try:
+                # no journal while bulk loading
+                c.execute("pragma journal_mode=OFF")
+                c.execute("pragma synchronous=OFF")
+                
+                if lowerCaseFieldNames:
+                    fields = [(fieldName.lower(), fieldType, fieldLength, fieldDecimals) for fieldName, fieldType, fieldLength, fieldDecimals in fields]
+                
+                _columns = ",".join(['"%s" %s' %(fieldName, self.getDbfFieldSqliteType(fieldType, fieldDecimals)) for fieldName, fieldType, fieldLength, fieldDecimals in fields])
+                c.execute("create table %s (%s)" %(tableName, _columns))
+                
+                _insert_tmpl = "insert into %s values (%s)" %(tableName, ",".join(["?"] * len(fields)))
+                
+                recordCount = 0
+                batch = []
+                for values in self.iterateDbfRecords(fileObj, numberOfRecords, headerLength, recordLength, fields, encoding):
+                    batch.append(values)
+                    if len(batch) == batchSize:
+                        c.executemany(_insert_tmpl, batch)
+                        recordCount += len(batch)
+                        batch = []
+                if batch:
+                    c.executemany(_insert_tmpl, batch)
+                    recordCount += len(batch)
+                
+                conn.commit()
+            finally:
+                # uncommitted records of failed load rolled back
+                c.close()
+                conn.close()
+        
+        return recordCount
+    
+    
+    def copyStagingDbIntoDb(self, stagingDbPath, dbPath, tableName):
+        """
+        purpose:
+        copy table loaded into staging sqlite file into db
+        
+        how:
+        staging file attached. table created in db with staging table create sql, so column types are kept. rows copied
+        with single insert select
+        
+        notes:
+        -staging file removed once copied
+        -staging tables have no indexes; soil table indexes are built afterwards. see Db.createDbIndexesOnLoadedData()
+        
+        returns:
+        number of rows copied
+        """
+        
+        conn = sqlite3.connect(dbPath)
+        c = conn.cursor()
+        
+        try:
+            # no journal while bulk loading
+            c.execute("pragma journal_mode=OFF")
+            c.execute("pragma synchronous=OFF")
+            
+            c.execute("attach database ? as staging", (stagingDbPath,))
+            
+            sql = "select sql from staging.sqlite_master where type = 'table' and name = ?"
+            c.execute(sql, (tableName,))
+            c.execute(c.fetchone()[0])
+            
+            c.execute("insert into main.%s select * from staging.%s" %(tableName, tableName))
+            rowCount = c.rowcount
+            conn.commit()
+            
+            c.execute("detach database staging")
+        finally:
+            c.close()
+            conn.close()
+        
+        os.remove(stagingDbPath)
+        
+        return rowCount
+    
+    
     # ========== read csv file into existing sqlite db
     """
     # A simple Python script to convert csv files to sqlite (with type guessing)
@@ -155,7 +512,10 @@ class Io:
     # Placed in the Public Domain\
     """
 
-    def convert(self, filepath_or_fileobj, dbpath, table='data'):
+    def convert(self, filepath_or_fileobj, dbpath, table='data', batchSize=10000, transactionSize=None):
+        #===== modification to orginial code
+        # bulk import. rows inserted with executemany in batches of batchSize, committed every transactionSize rows.
+        # transactionSize None commits once after all rows. returns tuple of (number of rows loaded, rows loaded per second)
         if isinstance(filepath_or_fileobj, basestring):
             fo = open(filepath_or_fileobj)
         else:
@@ -178,25 +538,57 @@ class Io:
         c.execute("pragma journal_mode=OFF")
         # set synchronous to normal mode
         c.execute("pragma synchronous=NORMAL")
-        # increase page size. default is 1024
-        c.execute("pragma page_size=8192")
-        # must vacuum for page_size to be used
-        c.execute("VACUUM")
+        # no page_size change; it requires a vacuum of the whole db, which already holds the cmp table
         
         
         c.execute('CREATE table %s (%s)' % (table, _columns))
 
         _insert_tmpl = 'insert into %s values (%s)' % (table,
             ','.join(['?']*len(headers)))
+        
+        #===== modification to orginial code
+        # we need to take out commas from int and floats for sqlite to
+        # recognize them properly. numeric columns determined once, not per cell
+        numericColumns = [idx for idx, _type in enumerate(types) if _type in ['real', 'integer']]
+        columnCount = len(types)
+        
+        if transactionSize is None:
+            transactionSize = 0
+        
+        startTime = time.time()
+        rowCount = 0
+        uncommittedCount = 0
+        batch = []
         for row in reader:
-            # we need to take out commas from int and floats for sqlite to
-            # recognize them properly ...
-            row = [ x.replace(',', '') if y in ['real', 'integer'] else x
-                    for (x,y) in zip(row, types) ]
-            c.execute(_insert_tmpl, row)
+            if len(row) != columnCount:
+                # values past the guessed columns dropped as original code did. short rows can't be inserted
+                if len(row) < columnCount:
+                    raise ValueError("csv line %s has %s values, expected %s" %(reader.line_num, len(row), columnCount))
+                row = row[:columnCount]
+            for idx in numericColumns:
+                if ',' in row[idx]:
+                    row[idx] = row[idx].replace(',', '')
+            batch.append(row)
+            if len(batch) == batchSize:
+                c.executemany(_insert_tmpl, batch)
+                rowCount += len(batch)
+                uncommittedCount += len(batch)
+                batch = []
+                if transactionSize and uncommittedCount >= transactionSize:
+                    conn.commit()
+                    uncommittedCount = 0
+        if batch:
+            c.executemany(_insert_tmpl, batch)
+            rowCount += len(batch)
 
         conn.commit()
         c.close()
+        conn.close()
+        
+        if isinstance(filepath_or_fileobj, basestring):
+            fo.close()
+        
+        return rowCount, getRowsPerSecond(rowCount, time.time() - startTime)
 
     def _guess_types(self, fileobj, max_sample_size=100):
         '''Guess column types (as for SQLite) of CSV.
@@ -224,7 +616,9 @@ class Io:
             }
         results = [ dict(perresult) for x in range(len(_headers)) ]
         for count,row in enumerate(reader):
-            for idx,cell in enumerate(row):
+            #===== modification to orginial code
+            # values past header columns ignored as convert drops them
+            for idx,cell in enumerate(row[:len(_headers)]):
                 cell = cell.strip()
                 # replace ',' with '' to improve cast accuracy for ints and floats
                 cell = cell.replace(',', '')
@@ -247,7 +641,7 @@ class Io:
 
     #////////////////////// csv writer
 
-    def writeCsvFile(self, column, headers, data, path, csvFilePrefixName):
+    def writeCsvFile(self, column, headers, data, path, csvFilePrefixName, append=False):
         """
         purpose:
         write csv file containing either numeric/categorical calculation results
@@ -258,6 +652,8 @@ class Io:
         notes:
         prefix filename with user defined word
         base name of csv is column derived
+        data is any iterable; rows written as they are read
+        append adds data to existing csv without headers. used to write results chunk by chunk
         
         returns:
         full path to output csv
@@ -273,14 +669,103 @@ class Io:
         # full csv path
         writeCsvFilePath = os.path.join(path, outNameCleaned)
         
-        with open(writeCsvFilePath,"wb") as csvfile:
+        if append:
+            fileMode = "ab"
+        else:
+            fileMode = "wb"
+        
+        with open(writeCsvFilePath,fileMode) as csvfile:
             f_writer = csv.writer(csvfile,delimiter=",")
             # write headers
-            f_writer.writerow(headers)
+            if not append:
+                f_writer.writerow(headers)
             # write data
             for e in data:
                 # data contains 1:n list/tuples
                 f_writer.writerow(e)
         
         return writeCsvFilePath
-    
\ No newline at end of file
+    
+
+
+def setWorkerPythonExecutable():
+    """
+    purpose:
+    start multiprocessing pool workers with python instead of the executable running the scripts
+    
+    notes:
+    -windows only. sys.executable is qgis.exe within qgis; workers would start qgis. pythonw.exe of qgis python used if present
+    -call before creating pool. used by parallel dbf staging, join and column calculations
+    
+    returns:
+    nothing
+    """
+    
+    if os.name == "nt":
+        pythonExecutable = os.path.join(sys.exec_prefix, "pythonw.exe")
+        if os.path.exists(pythonExecutable):
+            multiprocessing.set_executable(pythonExecutable)
+
+
+def loadDbfIntoStagingDb(task):
+    """
+    purpose:
+    worker process function loading dbf into its own staging sqlite file
+    
+    how:
+    dbf read directly into new sqlite file. see Io.loadDbfIntoDb()
+    
+    notes:
+    -module level function so it can be sent to multiprocessing pool workers
+    -task is tuple of (dbf path, staging db path, table name, lower case field names)
+    -dbf's that can not be read directly are not staged; main process loads them
+    
+    returns:
+    tuple of (table name, staging db path or None if not loaded, number of records loaded, message). message is
+    rows/sec of load or reason for not loading
+    """
+    
+    dbfPath, stagingDbPath, tableName, lowerCaseFieldNames = task
+    
+    if os.path.exists(stagingDbPath):
+        os.remove(stagingDbPath)
+    
+    try:
+        startTime = time.time()
+        recordCount = Io().loadDbfIntoDb(dbfPath, stagingDbPath, tableName, lowerCaseFieldNames=lowerCaseFieldNames)
+    except (ValueError, struct.error, UnicodeDecodeError), e:
+        if os.path.exists(stagingDbPath):
+            os.remove(stagingDbPath)
+        return (tableName, None, 0, str(e))
+    
+    return (tableName, stagingDbPath, recordCount, formatLoadMessage(tableName, "dbf staging file", recordCount, getRowsPerSecond(recordCount, time.time() - startTime)))
+
+
+def getRowsPerSecond(rowCount, elapsedTime):
+    """
+    purpose:
+    load speed of table
+    
+    notes:
+    loads too quick to time count as taking 1 second
+    
+    returns:
+    float
+    """
+    
+    if elapsedTime > 0:
+        return rowCount / elapsedTime
+    else:
+        return float(rowCount)
+
+
+def formatLoadMessage(tableName, source, rowCount, rowsPerSecond):
+    """
+    purpose:
+    message of rows loaded into soil db table and load speed
+    
+    returns:
+    string
+    """
+    
+    return "table %s loaded from %s: %s rows (%0.0f rows/sec)" %(tableName, source, rowCount, rowsPerSecond)
@@ -0,0 +1,411 @@
+"""
+purpose:
+declarative description of soil table joins and compilation into sql
+
+how:
+python. join spec holds tables, key columns and join rules. compiled to a sequence of sql statements that are run by aafc_database.Db
+
+notes:
+-base table is first table in join. it is always cmp; its slc id column drives which rows are joined
+-every other table joins on the common soilkey column. rules control how:
+  * landuse rule (snf): strip landuse character off base soilkey; join user landuse preference if present else default landuse N.
+    uses derived base soilkey/landuse columns when every table has them
+  * layer rule (slf): join single layer number. if layer number not available for soilkey the base row is dropped. availability is
+    checked against the landuse resolved soilkey when a landuse table is in the join, else against base soilkey
+  * no rule: plain soilkey equality join
+-join shapes such as cmp-snf, cmp-snf-slf or cmp-slf are all described the same way
+-no qgis dependency
+
+license:
+gpl3
+
+developer:
+richard burcher
+richardburcher@gmail.com
+2014
+"""
+
+
+class JoinSpec:
+    """
+    purpose:
+    describes a soil table join and compiles it into sql
+
+    notes:
+    -slc ids must be staged in temp table before compiled sql is executed. see aafc_database.Db.loadSlcIdsIntoTempTable()
+    """
+
+    def __init__(self, tableNames, dbSlcKey, dbSoilKey):
+        # ordered table names. first is base table
+        self.tableNames = list(tableNames)
+
+        # key columns
+        self.dbSlcKey = dbSlcKey
+        self.dbSoilKey = dbSoilKey
+
+        # join rules. table name to rule mapping
+        self.landuseRules = {}
+        self.layerRules = {}
+
+        # temp table holding resolved soilkeys per base row
+        self.joinKeysTableName = "joinKeys"
+
+        # optional table field names. when present, columns are listed explicitly in select
+        self.tableFieldNames = {}
+
+        # field names left out of join output ie derived columns
+        self.excludedFieldNames = []
+
+        # optional derived (base soilkey, landuse) columns present on every table
+        self.normalizedSoilKeyColumns = None
+
+
+    def addLanduseRule(self, tableName, landuse, defaultLanduse="N"):
+        """
+        purpose:
+        join table on soilkey respecting user landuse preference
+
+        returns:
+        nothing
+        """
+
+        self.landuseRules[tableName] = (landuse, defaultLanduse)
+
+
+    def addLayerRule(self, tableName, dbLayerNumberKey, layerNumber):
+        """
+        purpose:
+        join table on soilkey constrained to single layer number
+
+        returns:
+        nothing
+        """
+
+        self.layerRules[tableName] = (dbLayerNumberKey, layerNumber)
+
+
+    def setTableFieldNames(self, tableName, fieldNames):
+        """
+        purpose:
+        field names of table. used to list output columns explicitly
+
+        returns:
+        nothing
+        """
+
+        self.tableFieldNames[tableName] = list(fieldNames)
+
+
+    def setNormalizedSoilKeyColumns(self, baseSoilKeyColumn, landuseColumn):
+        """
+        purpose:
+        use derived base soilkey and landuse columns for landuse resolution
+
+        notes:
+        columns created at db creation. see aafc_database.Db.createNormalizedSoilKeyColumns()
+
+        returns:
+        nothing
+        """
+
+        self.normalizedSoilKeyColumns = (baseSoilKeyColumn, landuseColumn)
+
+
+    def getBaseTableName(self):
+        """
+        purpose:
+        base table of join
+
+        returns:
+        table name string
+        """
+
+        return self.tableNames[0]
+
+
+    def getJoinedTableNames(self):
+        """
+        purpose:
+        tables joined onto base table
+
+        returns:
+        list of table name strings
+        """
+
+        return self.tableNames[1:]
+
+
+    def getSoilKeyColumn(self, tableName):
+        """
+        purpose:
+        name of column in join keys temp table holding resolved soilkey for a landuse rule table
+
+        returns:
+        column name string
+        """
+
+        return "%sSoilKey" %(tableName)
+
+
+    def compileStagingSql(self, slcIdsTempTable):
+        """
+        purpose:
+        sql that resolves soilkeys for all base rows of the staged slc ids
+
+        how:
+        -single create temp table statement resolving landuse soilkey per landuse rule table
+        -single delete per layer rule dropping base rows where layer number not available
+
+        returns:
+        list of sql strings. executed in order
+        """
+
+        baseTableName = self.getBaseTableName()
+        dbSoilKey = self.dbSoilKey
+
+        # resolved key columns
+        keyColumns = ["s.seq as seq", "%s.rowid as baseRowId" %(baseTableName), "%s.%s as baseSoilKey" %(baseTableName, dbSoilKey)]
+        for tableName in self.getJoinedTableNames():
+            if tableName in self.landuseRules:
+                landuse, defaultLanduse = self.landuseRules[tableName]
+                # user landuse preference if present in table; else default landuse; else empty string matching no row
+                keyColumns.append("case when %s then %s when %s then %s else '' end as %s" %(self.compileLanduseExistsSql(tableName, landuse), self.compileLanduseSoilKeySql(landuse), self.compileLanduseExistsSql(tableName, defaultLanduse), self.compileLanduseSoilKeySql(defaultLanduse), self.getSoilKeyColumn(tableName)))
+
+        sqlStatements = []
+
+        sql = "drop table if exists temp.%s" %(self.joinKeysTableName)
+        sqlStatements.append(sql)
+        sql = "create temp table %s as select %s from temp.%s s join %s on %s.%s = s.slcid" %(self.joinKeysTableName, ", ".join(keyColumns), slcIdsTempTable, baseTableName, baseTableName, self.dbSlcKey)
+        sqlStatements.append(sql)
+
+        # drop base rows where layer number not available
+        for tableName in self.getJoinedTableNames():
+            if tableName in self.layerRules:
+                dbLayerNumberKey, layerNumber = self.layerRules[tableName]
+                sql = "delete from temp.%s where not exists (select 1 from %s where %s.%s = %s.%s and %s.%s = %s)" %(self.joinKeysTableName, tableName, tableName, dbSoilKey, self.joinKeysTableName, self.getLayerAvailabilityKeyColumn(), tableName, dbLayerNumberKey, layerNumber)
+                sqlStatements.append(sql)
+
+        return sqlStatements
+
+
+    def compileBaseSoilKeySql(self):
+        """
+        purpose:
+        sql expression for base table soilkey with landuse character stripped
+
+        notes:
+        derived base soilkey column used if present
+
+        returns:
+        sql string
+        """
+
+        baseTableName = self.getBaseTableName()
+
+        if self.normalizedSoilKeyColumns:
+            return "%s.%s" %(baseTableName, self.normalizedSoilKeyColumns[0])
+        else:
+            return "substr(%s.%s, 1, length(%s.%s) - 1)" %(baseTableName, self.dbSoilKey, baseTableName, self.dbSoilKey)
+
+
+    def compileLanduseSoilKeySql(self, landuse):
+        """
+        purpose:
+        sql expression for base soilkey with user landuse appended
+
+        returns:
+        sql string
+        """
+
+        return "%s || '%s'" %(self.compileBaseSoilKeySql(), landuse)
+
+
+    def compileLanduseExistsSql(self, tableName, landuse):
+        """
+        purpose:
+        sql expression testing if table holds base soilkey with given landuse
+
+        notes:
+        with derived columns this is an equality match on the (base soilkey, landuse) composite index, else on the soilkey index
+
+        returns:
+        sql string
+        """
+
+        if self.normalizedSoilKeyColumns:
+            baseSoilKeyColumn, landuseColumn = self.normalizedSoilKeyColumns
+            return "exists (select 1 from %s where %s.%s = %s and %s.%s = '%s')" %(tableName, tableName, baseSoilKeyColumn, self.compileBaseSoilKeySql(), tableName, landuseColumn, landuse)
+        else:
+            return "exists (select 1 from %s where %s.%s = %s)" %(tableName, tableName, self.dbSoilKey, self.compileLanduseSoilKeySql(landuse))
+
+
+    def compileSelectColumnsSql(self, tableName):
+        """
+        purpose:
+        output columns of table
+
+        notes:
+        explicit column listing without excluded field names if table field names known, else all columns
+
+        returns:
+        sql string
+        """
+
+        if tableName in self.tableFieldNames:
+            excluded = [x.lower() for x in self.excludedFieldNames]
+            return ", ".join(['%s."%s"' %(tableName, x) for x in self.tableFieldNames[tableName] if x.lower() not in excluded])
+        else:
+            return "%s.*" %(tableName)
+
+
+    def getLayerAvailabilityKeyColumn(self):
+        """
+        purpose:
+        join keys column used to check layer number availability
+
+        notes:
+        first landuse rule table soilkey if present, else base soilkey
+
+        returns:
+        column name string
+        """
+
+        for tableName in self.getJoinedTableNames():
+            if tableName in self.landuseRules:
+                return self.getSoilKeyColumn(tableName)
+
+        return "baseSoilKey"
+
+
+    def compileSelectSql(self):
+        """
+        purpose:
+        single select producing flat join rows from staged join keys
+
+        notes:
+        -all columns of every table returned in table order. excluded field names are left out
+        -rows ordered as per slc ids supplied, then base row, then joined table rows
+
+        returns:
+        sql string
+        """
+
+        baseTableName = self.getBaseTableName()
+        dbSoilKey = self.dbSoilKey
+
+        selectColumns = [self.compileSelectColumnsSql(tableName) for tableName in self.tableNames]
+
+        joins = ["join %s on %s.rowid = k.baseRowId" %(baseTableName, baseTableName)]
+        orderBy = ["k.seq", "k.baseRowId"]
+
+        for tableName in self.getJoinedTableNames():
+            if tableName in self.landuseRules:
+                # resolved landuse soilkey
+                joins.append("join %s on %s.%s = k.%s" %(tableName, tableName, dbSoilKey, self.getSoilKeyColumn(tableName)))
+            elif tableName in self.layerRules:
+                # base soilkey constrained to layer number
+                dbLayerNumberKey, layerNumber = self.layerRules[tableName]
+                joins.append("join %s on %s.%s = %s.%s and %s.%s = %s" %(tableName, tableName, dbSoilKey, baseTableName, dbSoilKey, tableName, dbLayerNumberKey, layerNumber))
+            else:
+                # plain soilkey join
+                joins.append("join %s on %s.%s = %s.%s" %(tableName, tableName, dbSoilKey, baseTableName, dbSoilKey))
+
+            orderBy.append("%s.rowid" %(tableName))
+
+        sql = "select %s from temp.%s k %s order by %s" %(", ".join(selectColumns), self.joinKeysTableName, " ".join(joins), ", ".join(orderBy))
+
+        return sql
+
+
+    def compileCreateTableSql(self, resultsTableName):
+        """
+        purpose:
+        single statement creating flat join table from staged join keys
+
+        returns:
+        sql string
+        """
+
+        return "create table %s as %s" %(resultsTableName, self.compileSelectSql())
+
+
+    def compileInsertSql(self, resultsTableName):
+        """
+        purpose:
+        single statement appending join rows from staged join keys to existing join table
+
+        returns:
+        sql string
+        """
+
+        return "insert into %s %s" %(resultsTableName, self.compileSelectSql())
+
+
+    def getSignature(self):
+        """
+        purpose:
+        identifies join shape, keys and rules. join tables built from equal signatures hold comparable rows
+
+        returns:
+        string
+        """
+
+        return "%s by %s" %(self.describe(), self.dbSlcKey)
+
+
+    def describe(self):
+        """
+        purpose:
+        human readable description of join. used for diagnostic messages
+
+        returns:
+        string
+        """
+
+        rules = []
+        for tableName in self.getJoinedTableNames():
+            if tableName in self.landuseRules:
+                rules.append("%s landuse %s default %s" %((tableName,) + self.landuseRules[tableName]))
+            elif tableName in self.layerRules:
+                rules.append("%s %s = %s" %((tableName,) + self.layerRules[tableName]))
+
+        return "%s joined on %s; %s" %("-".join(self.tableNames), self.dbSoilKey, ", ".join(rules))
+
+
+def createSoilJoinSpec(tableNames, dbSlcKey, dbSoilKey, landuse="N", dbLayerNumberKey=None, layerNumber=None):
+    """
+    purpose:
+    create join spec for the generic soil table names
+
+    notes:
+    -snf gets landuse rule, slf gets layer rule
+    -tableNames ie ["cmp", "snf", "slf"] or ["cmp", "slf"]
+
+    returns:
+    JoinSpec instance
+    """
+
+    joinSpec = JoinSpec(tableNames, dbSlcKey, dbSoilKey)
+
+    for tableName in joinSpec.getJoinedTableNames():
+        if tableName == "snf":
+            joinSpec.addLanduseRule(tableName, landuse)
+        elif tableName == "slf":
+            joinSpec.addLayerRule(tableName, dbLayerNumberKey, layerNumber)
+
+    return joinSpec
+
+
+def getSignatureTableNames(signature):
+    """
+    purpose:
+    tables of join from join signature recorded for a join table
+
+    notes:
+    signature starts with table names joined by "-". see JoinSpec.getSignature()
+
+    returns:
+    list of table name strings
+    """
+
+    return signature.split(" ", 1)[0].split("-")
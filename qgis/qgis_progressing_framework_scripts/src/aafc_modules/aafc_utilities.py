@@ -4,6 +4,7 @@ utility class for repetitive tasks
 
 notes:
 -handles many repetitive tasks such as loading/removing qgis layers/user data validation/getting paths etc
+-qgis api and processing framework imported only by methods using them. module imports without qgis
 
 how:
 mix of python and qgis python api
@@ -17,12 +18,6 @@ richardburcher@gmail.com
 2014
 """
 
-from qgis.core import *
-from qgis.gui import *
-from qgis.utils import *
-# qgis processing framework
-import processing
-
 import os
 import tempfile
 
@@ -50,6 +45,8 @@ class Utils:
         tuple containing (msg, boolean status)
         """
 
+        from qgis.core import QgsVectorLayer, QgsMapLayerRegistry
+        
         # parameterize connection string
         connectionUrl = 'dbname=%s table=%s' %(filePath, tableName)
 
@@ -79,6 +76,8 @@ class Utils:
         nothing
         """
         
+        from qgis.core import QgsMapLayerRegistry
+        
         # get listing of layers in qgis
         mapLayerRegistry = QgsMapLayerRegistry.instance()
         layersPresent = mapLayerRegistry.mapLayers()
@@ -106,6 +105,8 @@ class Utils:
         tuple containing (msg, boolean status)
         """
         
+        from qgis.core import QgsVectorLayer, QgsMapLayerRegistry
+        
         # name provider for loaded vector in qgis toc. just filename minus extension
         layerName = os.path.splitext(os.path.basename(filePath))[0]
         
@@ -137,6 +138,8 @@ class Utils:
         nothing
         """
 
+        from qgis.utils import iface
+        
         # get reference to qgis message bar
         messageBar = iface.messageBar()
         
@@ -351,6 +354,9 @@ class Utils:
         string
         """
         
+        # qgis processing framework
+        import processing
+        
         # convert attribute name to qgis object using processing convience method
         inputLayer = processing.getObject(tableName)
 
@@ -377,23 +383,24 @@ class Utils:
             return dbFilePath
     
     
-    def getVectorLayerFieldValues(self,vectorLayer, fieldName):
+    def iterateVectorLayerFieldValues(self, vectorLayer, fieldName):
         """
         purpose:
-        return all field values for vector layer using qgis processing conveince function
+        field values for vector layer read one feature at a time
         
         notes:
-        takes into account feature selection
+        -takes into account feature selection
+        -values are not held in memory. used for chunked calculation of very large selections; see aafc_database.Db.stageSlcIdChunks()
         
         returns:
-        tuple of (message, list of values, boolean status)
+        generator of values
         """
         
-        # convert attribute name to qgis object using processing convience method
-        inputLayer = processing.getObject(vectorLayer)
+        # qgis processing framework
+        import processing
         
         # convert attribute name to qgis object using processing convience method
-        values = []
+        inputLayer = processing.getObject(vectorLayer)
         
         # get index of polygon id
         idx = inputLayer.fieldNameIndex(fieldName)
@@ -403,7 +410,23 @@ class Utils:
         
         # iterate over each feature and get attribute value wanted
         for feature in iter:
-            values.append(feature.attributes()[idx])
+            yield feature.attributes()[idx]
+    
+    
+    def getVectorLayerFieldValues(self,vectorLayer, fieldName):
+        """
+        purpose:
+        return all field values for vector layer using qgis processing conveince function
+        
+        notes:
+        takes into account feature selection
+        
+        returns:
+        tuple of (message, list of values, boolean status)
+        """
+        
+        # all values of features
+        values = list(self.iterateVectorLayerFieldValues(vectorLayer, fieldName))
         
         # check values present
         if len(values) == 0:
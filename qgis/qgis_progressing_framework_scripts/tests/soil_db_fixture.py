@@ -0,0 +1,148 @@
+"""
+purpose:
+small deterministic soil db and soil dbf's for tests
+
+how:
+cmp, snf and slf tables laid out as loaded by 0_create_soil_db. values drawn from seeded random
+
+license:
+gpl3
+
+developer:
+richard burcher
+richardburcher@gmail.com
+2014
+"""
+
+import os
+import sys
+import random
+import struct
+import sqlite3
+
+# soil modules importable without qgis
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "aafc_modules"))
+
+
+def createSoilDb(dbPath, seed=1, slcIdCount=60):
+    """
+    purpose:
+    create soil db of slcIdCount slc ids starting at 1000
+
+    notes:
+    -1 to 5 cmp rows per slc id. percent of slc id need not sum to 100
+
+    returns:
+    list of slc ids
+    """
+
+    rand = random.Random(seed)
+
+    if os.path.exists(dbPath):
+        os.remove(dbPath)
+
+    conn = sqlite3.connect(dbPath)
+    conn.execute("create table cmp (ogc_fid integer primary key, sl integer, cmp integer, percent integer, soilkey varchar(20), slope varchar(5), awhc_v real)")
+    conn.execute("create table snf (soilkey text, drainage text, ph real)")
+    conn.execute("create table slf (soilkey text, layer_no integer, sand real)")
+
+    soilKeyBases = ["AB%03dgl###" % i for i in range(40)]
+    for base in soilKeyBases:
+        for landuse in "NA":
+            conn.execute("insert into snf values (?,?,?)", (base + landuse, rand.choice(["W", "MW", "P"]), round(rand.uniform(4, 8), 2)))
+            for layerNumber in range(1, rand.randint(2, 4)):
+                conn.execute("insert into slf values (?,?,?)", (base + landuse, layerNumber, round(rand.uniform(0, 90), 1)))
+
+    slcIds = range(1000, 1000 + slcIdCount)
+    for slcId in slcIds:
+        for cmpNumber in range(1, rand.randint(2, 6)):
+            conn.execute("insert into cmp (sl, cmp, percent, soilkey, slope, awhc_v) values (?,?,?,?,?,?)", (slcId, cmpNumber, rand.choice([10, 20, 30, 40, 50]), rand.choice(soilKeyBases) + rand.choice("NA"), rand.choice(["A", "B", "C"]), round(rand.uniform(-5, 20), 3)))
+
+    conn.commit()
+    conn.close()
+
+    return list(slcIds)
+
+
+def createDbf(dbfPath, fields, records, deleted=(), recordLength=None):
+    """
+    purpose:
+    write dbase III table file
+
+    notes:
+    -fields is list of (name, type, length, decimal count)
+    -records is list of tuples of byte strings, padded to field length as dbase does
+    -deleted is record numbers flagged deleted
+    -recordLength overrides record length of header ie to write header not matching fields
+
+    returns:
+    nothing
+    """
+
+    if recordLength is None:
+        recordLength = 1 + sum([x[2] for x in fields])
+    headerLength = 32 + 32 * len(fields) + 1
+
+    data = [struct.pack("<B3BIHH20x", 3, 114, 1, 1, len(records), headerLength, recordLength)]
+    for name, fieldType, length, decimalCount in fields:
+        data.append(struct.pack("<11sc4xBB14x", name, fieldType, length, decimalCount))
+    data.append("\x0d")
+
+    for recordNumber, record in enumerate(records):
+        data.append("*" if recordNumber in deleted else " ")
+        for (name, fieldType, length, decimalCount), value in zip(fields, record):
+            if fieldType == "C":
+                data.append(value.ljust(length)[:length])
+            else:
+                data.append(value.rjust(length)[:length])
+    data.append("\x1a")
+
+    with open(dbfPath, "wb") as f:
+        f.write("".join(data))
+
+
+def createSoilDbfs(directory, seed=1, slcIdCount=30):
+    """
+    purpose:
+    write cmp, snf and slf soil dbf's
+
+    notes:
+    seed of each table may differ ie {"snf": 2} to write changed snf with same cmp
+
+    returns:
+    dict of table name to dbf path
+    """
+
+    if not isinstance(seed, dict):
+        seed = {}
+    seeds = dict([(x, seed.get(x, 1)) for x in ["cmp", "snf", "slf"]])
+
+    soilKeys = ["AB%03dgl###%s" % (i, landuse) for i in range(20) for landuse in "NA"]
+    records = {"cmp": [], "snf": [], "slf": []}
+
+    rand = random.Random(seeds["cmp"])
+    for slcId in range(1000, 1000 + slcIdCount):
+        for cmpNumber in range(1, rand.randint(2, 5)):
+            records["cmp"].append((str(slcId), str(cmpNumber), str(rand.choice([10, 20, 30, 40])), rand.choice(soilKeys), rand.choice(["A", "B", "C"])))
+
+    rand = random.Random(seeds["snf"])
+    for soilKey in soilKeys:
+        records["snf"].append((soilKey, rand.choice(["W", "MW", "P"]), "%0.2f" % rand.uniform(4, 8)))
+
+    rand = random.Random(seeds["slf"])
+    for soilKey in soilKeys:
+        for layerNumber in range(1, rand.randint(2, 4)):
+            records["slf"].append((soilKey, str(layerNumber), "%0.1f" % rand.uniform(0, 90)))
+
+    fields = {
+        "cmp": [("SL", "N", 10, 0), ("CMP", "N", 3, 0), ("PERCENT", "N", 3, 0), ("SOILKEY", "C", 12, 0), ("SLOPE", "C", 2, 0)],
+        "snf": [("SOILKEY", "C", 12, 0), ("DRAINAGE", "C", 3, 0), ("PH", "N", 6, 2)],
+        "slf": [("SOILKEY", "C", 12, 0), ("LAYER_NO", "N", 2, 0), ("SAND", "N", 5, 1)],
+        }
+
+    tableNamesToDbfPaths = {}
+    for tableName in ["cmp", "snf", "slf"]:
+        tableNamesToDbfPaths[tableName] = os.path.join(directory, "soil_%s.dbf" % tableName)
+        createDbf(tableNamesToDbfPaths[tableName], fields[tableName], records[tableName])
+
+    return tableNamesToDbfPaths
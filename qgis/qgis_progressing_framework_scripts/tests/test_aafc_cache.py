@@ -0,0 +1,101 @@
+"""
+purpose:
+tests of aafc_cache.ResultCache
+
+how:
+unittest. run from this directory; python -m unittest discover
+
+license:
+gpl3
+
+developer:
+richard burcher
+richardburcher@gmail.com
+2014
+"""
+
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+# adds soil modules to path
+import soil_db_fixture
+
+import aafc_cache as cache
+import aafc_database as database
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDirectory = tempfile.mkdtemp()
+        self.cacheDirectory = cache.getCacheDirectory(self.tmpDirectory)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDirectory)
+
+    def testValueRoundTrip(self):
+        resultCache = cache.ResultCache(self.cacheDirectory)
+        resultCache.put("key", (["sl", "awhc_v_weighted_average"], [[1000, "1.50"], [u"ONAD405357", None]]))
+
+        self.assertEqual(resultCache.get("key"), [["sl", "awhc_v_weighted_average"], [[1000, "1.50"], [u"ONAD405357", None]]])
+        self.assertEqual(resultCache.get("missing"), None)
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "ownership checked on posix only")
+    def testDirectoryPrivateToUser(self):
+        cache.ResultCache(self.cacheDirectory)
+        self.assertEqual(stat.S_IMODE(os.stat(self.cacheDirectory).st_mode), 0700)
+
+        # own directory with loose permissions tightened
+        os.chmod(self.cacheDirectory, 0777)
+        cache.ResultCache(self.cacheDirectory)
+        self.assertEqual(stat.S_IMODE(os.stat(self.cacheDirectory).st_mode), 0700)
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "ownership checked on posix only")
+    def testForeignDirectoryRefused(self):
+        os.makedirs(self.cacheDirectory)
+
+        getuid = os.getuid
+        os.getuid = lambda: getuid() + 1
+        try:
+            self.assertRaises(OSError, cache.ResultCache, self.cacheDirectory)
+        finally:
+            os.getuid = getuid
+
+    @unittest.skipUnless(hasattr(os, "symlink"), "symlinks not available")
+    def testSymlinkRefused(self):
+        targetDirectory = os.path.join(self.tmpDirectory, "target")
+        os.makedirs(targetDirectory)
+        os.symlink(targetDirectory, self.cacheDirectory)
+
+        self.assertRaises(OSError, cache.ResultCache, self.cacheDirectory)
+
+    def testCorruptEntriesAreMisses(self):
+        resultCache = cache.ResultCache(self.cacheDirectory)
+
+        for data in ["", "{not json", "\x80\x02}q\x00.", "[1, 2"]:
+            with open(resultCache.getEntryFilePath("key"), "wb") as f:
+                f.write(data)
+            self.assertEqual(resultCache.get("key"), None)
+            self.assertFalse(os.path.exists(resultCache.getEntryFilePath("key")))
+
+    def testMalformedCalculationIsMiss(self):
+        dbPath = os.path.join(self.tmpDirectory, "soil.sqlite")
+        slcIds = soil_db_fixture.createSoilDb(dbPath)
+        db = database.Db(dbPath, self.tmpDirectory)
+        db.resultCache = cache.ResultCache(self.cacheDirectory)
+
+        expected = db.calculateField(slcIds, "sl", "cmp", '"awhc_v"', "percent")
+        key = db.getCalculationCacheKey(slcIds, "sl", "cmp", '"awhc_v"', "percent")
+
+        for value in [{"headers": 1}, [1, 2, 3], ["sl", "awhc_v"]]:
+            db.resultCache.put(key, value)
+            self.assertEqual(tuple(db.calculateField(slcIds, "sl", "cmp", '"awhc_v"', "percent")), tuple(expected))
+
+        db.conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
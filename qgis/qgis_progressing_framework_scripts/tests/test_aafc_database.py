@@ -0,0 +1,323 @@
+"""
+purpose:
+tests of aafc_database.Db calculations, join tables and result cache
+
+how:
+unittest. run from this directory; python -m unittest discover
+
+license:
+gpl3
+
+developer:
+richard burcher
+richardburcher@gmail.com
+2014
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import soil_db_fixture
+
+import aafc_database as database
+import aafc_cache as cache
+import aafc_join as join
+import aafc_io as inout
+
+
+class DbTestCase(unittest.TestCase):
+    """
+    purpose:
+    fresh soil db in temp directory per test
+    """
+
+    def setUp(self):
+        self.tmpDirectory = tempfile.mkdtemp()
+        self.dbPath = os.path.join(self.tmpDirectory, "soil.sqlite")
+        self.slcIds = soil_db_fixture.createSoilDb(self.dbPath)
+        self.dbs = []
+
+    def tearDown(self):
+        for db in self.dbs:
+            db.conn.close()
+        shutil.rmtree(self.tmpDirectory)
+
+    def openDb(self):
+        db = database.Db(self.dbPath, self.tmpDirectory)
+        self.dbs.append(db)
+        return db
+
+
+class StreamTest(DbTestCase):
+
+    def testClosedStreamReleasesTable(self):
+        db = self.openDb()
+        names, rows = db.executeSql("select sl, percent from cmp", fieldNames=True, stream=True)
+        self.assertEqual(names, ["sl", "percent"])
+        next(rows)
+        rows.close()
+
+        # write fails with table locked while stream cursor is open
+        db.executeSql("drop table cmp")
+        self.assertFalse(db.tableExists("cmp"))
+
+    def testExhaustedStream(self):
+        db = self.openDb()
+        rows = list(db.executeSql("select sl from cmp where sl = 1000", stream=True))
+        self.assertTrue(rows)
+        self.assertEqual(set(rows), set([(1000,)]))
+
+        db.executeSql("drop table cmp")
+        self.assertFalse(db.tableExists("cmp"))
+
+
+class CalculateFieldTest(DbTestCase):
+
+    def testNullNumericGroupReleasesTable(self):
+        db = self.openDb()
+        db.executeSql("update cmp set awhc_v = null where sl = 1003")
+        db.conn.commit()
+
+        try:
+            db.calculateField(self.slcIds, "sl", "cmp", '"awhc_v"', "percent")
+        except TypeError:
+            pass
+        else:
+            self.fail("null weighted average not formatted")
+
+        db.executeSql("delete from cmp where sl = 1003")
+        db.conn.commit()
+        headers, results = db.calculateField(self.slcIds, "sl", "cmp", '"awhc_v"', "percent")
+        self.assertEqual(len(results), len(self.slcIds) - 1)
+
+
+class NumpyBackendTest(DbTestCase):
+    """
+    purpose:
+    numpy calculation backend gives same results and csv output as sql
+    """
+
+    # (case, sql changing fixture, slc ids of fixture slc ids)
+    cases = [
+        ("fixture", [], lambda slcIds: slcIds),
+        ("ties", ["update cmp set percent = 20"], lambda slcIds: slcIds),
+        ("null and empty categories", ["update cmp set slope = null where ogc_fid % 5 = 0", "update cmp set slope = '' where ogc_fid % 7 = 0", "update cmp set awhc_v = null where cmp > 1 and ogc_fid % 3 = 0"], lambda slcIds: slcIds),
+        ("zero percent", ["update cmp set percent = 0 where ogc_fid % 3 = 0"], lambda slcIds: slcIds),
+        ("duplicate and missing slc ids", [], lambda slcIds: slcIds[10:30] + slcIds[12:16] + [99999] + list(reversed(slcIds[:10])) + [slcIds[0]]),
+        ("text slc ids", ["update cmp set sl = 'ONAD' || sl"], lambda slcIds: ["ONAD%s" %(x) for x in slcIds]),
+        ("real percents", ["update cmp set percent = percent + 0.25 where ogc_fid % 2 = 0"], lambda slcIds: slcIds),
+        ]
+
+    columnNames = ['"slope"', '"awhc_v"']
+
+    def writeCsvFiles(self, calculatedColumns, backend):
+        outputDirectory = os.path.join(self.tmpDirectory, backend)
+        os.makedirs(outputDirectory)
+
+        csvFiles = {}
+        for columnName, headers, results in calculatedColumns:
+            csvPath = inout.Io().writeCsvFile(columnName, headers, results, outputDirectory, "calculation")
+            with open(csvPath, "rb") as f:
+                csvFiles[columnName] = f.read()
+
+        return csvFiles
+
+    @unittest.skipIf(database.np is None, "numpy not installed")
+    def testNumpyMatchesSql(self):
+        for case, sqlStrings, selectSlcIds in self.cases:
+            self.tearDown()
+            self.setUp()
+
+            db = self.openDb()
+            for sql in sqlStrings:
+                db.executeSql(sql)
+            db.conn.commit()
+            slcIds = selectSlcIds(self.slcIds)
+
+            calculated = {}
+            for backend in ["sql", "numpy"]:
+                db.calculationBackend = backend
+                singleColumns = [(x,) + tuple(db.calculateField(slcIds, "sl", "cmp", x, "percent")) for x in self.columnNames]
+                calculated[backend] = (singleColumns, db.calculateFields(slcIds, "sl", "cmp", self.columnNames, "percent"))
+
+            self.assertEqual(calculated["numpy"], calculated["sql"], case)
+            self.assertEqual(calculated["sql"][0], calculated["sql"][1], case)
+            self.assertEqual(self.writeCsvFiles(calculated["numpy"][1], "numpy"), self.writeCsvFiles(calculated["sql"][1], "sql"), case)
+
+
+class StatisticsTest(DbTestCase):
+
+    def testPercentsNotSummingTo100(self):
+        db = self.openDb()
+        # rows of (percent, value, value weighted by percent)
+        rows = [(30, 10.0, 3.0), (30, 20.0, 6.0), (None, 50.0, None)]
+        cells = db.calculateGroupStatistics(db.numericStatistics, rows)
+
+        # weighted average 3 + 6 = 9; spread of 10 and 20 around 9 weighted by percent
+        self.assertEqual(cells, ["9.00", "10.00", "20.00", "7.81", "10.00"])
+
+    def testStddevAroundWeightedAverage(self):
+        db = self.openDb()
+        db.executeSql("update cmp set percent = 20")
+        db.conn.commit()
+
+        headers, results = db.calculateField(self.slcIds, "sl", "cmp", '"awhc_v"', "percent", statistics=["weighted_average", "weighted_stddev"])
+        percentValues = db.executeSql("select sl, percent, awhc_v from cmp")
+
+        for slcId, weightedAverage, weightedStddev in results:
+            values = [value for sl, percent, value in percentValues if sl == slcId]
+            mean = float(weightedAverage)
+            stddev = (sum([(value - mean) ** 2 for value in values]) / len(values)) ** 0.5
+            self.assertAlmostEqual(float(weightedStddev), stddev, delta=0.011)
+
+
+class JoinTableTest(DbTestCase):
+
+    def setUp(self):
+        DbTestCase.setUp(self)
+        db = self.openDb()
+        db.createNormalizedSoilKeyColumns(["cmp", "snf", "slf"], "soilkey")
+        db.createDbIndexesOnLoadedData(["cmp", "snf", "slf"], "soilkey", "sl", "cmp", "percent", "layer_no")
+        db.conn.commit()
+
+    def createJoinSpec(self):
+        return join.createSoilJoinSpec(["cmp", "snf"], "sl", "soilkey", "A", "layer_no", 2)
+
+    def getJoinRows(self, db):
+        return db.executeSql("select * from %s order by rowid" %(db.joinTableName))
+
+    def assertIncrementalMatchesFullRebuild(self, previousSlcIds, slcIds):
+        db = self.openDb()
+        db.createJoinTable(self.createJoinSpec(), slcIds)
+        fullRows = self.getJoinRows(db)
+
+        db.createJoinTable(self.createJoinSpec(), previousSlcIds)
+        messages = db.createJoinTable(self.createJoinSpec(), slcIds, incremental=True)
+        self.assertEqual(self.getJoinRows(db), fullRows)
+
+        return messages
+
+    def testIncrementalChangedSelection(self):
+        messages = self.assertIncrementalMatchesFullRebuild(self.slcIds[:30], self.slcIds[10:40])
+        self.assertTrue([x for x in messages if x.startswith("join rows removed for deselected slc ids")])
+
+    def testIncrementalDuplicateSlcIds(self):
+        self.assertIncrementalMatchesFullRebuild(self.slcIds[:30], self.slcIds[10:40] + self.slcIds[12:15])
+        self.assertIncrementalMatchesFullRebuild(self.slcIds[:30] + self.slcIds[:5], self.slcIds[:30])
+
+    def testIncrementalReorderedSlcIds(self):
+        self.assertIncrementalMatchesFullRebuild(self.slcIds[:30], list(reversed(self.slcIds[:30])))
+        self.assertIncrementalMatchesFullRebuild(self.slcIds[:30], self.slcIds[40:45] + self.slcIds[:30])
+
+    def testJoinCacheKeepsSlcIdOrderAndDuplicates(self):
+        db = self.openDb()
+        db.createJoinTable(self.createJoinSpec(), self.slcIds[:30], useCache=True)
+        orderedRows = self.getJoinRows(db)
+
+        for slcIds in (list(reversed(self.slcIds[:30])), self.slcIds[:30] + self.slcIds[:3]):
+            db.createJoinTable(self.createJoinSpec(), slcIds)
+            fullRows = self.getJoinRows(db)
+
+            db.createJoinTable(self.createJoinSpec(), self.slcIds[:30], useCache=True)
+            self.assertEqual(self.getJoinRows(db), orderedRows)
+            db.createJoinTable(self.createJoinSpec(), slcIds, useCache=True)
+            self.assertEqual(self.getJoinRows(db), fullRows)
+
+
+class ResultCacheTest(DbTestCase):
+
+    def openCountingDb(self, sqlCalls):
+        """
+        db as opened by calculation scripts. every sql statement counted
+        """
+
+        db = self.openDb()
+        db.sqliteLoadingPerformanceTuning(enable=True, vacuum=False)
+        db.resultCache = cache.ResultCache(cache.getCacheDirectory(self.tmpDirectory))
+
+        executeSql = db.executeSql
+        def countingExecuteSql(*args, **kwargs):
+            sqlCalls.append(args[0])
+            return executeSql(*args, **kwargs)
+        db.executeSql = countingExecuteSql
+
+        return db
+
+    def getCalculationSql(self, sqlCalls):
+        """
+        sql other than fingerprint lookups of source manifest and join table state
+        """
+
+        return [x for x in sqlCalls if "sourceManifest" not in x and "joinTableState" not in x and "sqlite_master" not in x]
+
+    def testTunedSecondRunIsCacheHit(self):
+        sqlCalls = []
+        first = self.openCountingDb(sqlCalls).calculateField(self.slcIds, "sl", "cmp", '"slope"', "percent")
+        self.assertTrue(sqlCalls)
+
+        del sqlCalls[:]
+        second = self.openCountingDb(sqlCalls).calculateField(self.slcIds, "sl", "cmp", '"slope"', "percent")
+        self.assertEqual(self.getCalculationSql(sqlCalls), [])
+        self.assertEqual(tuple(second), tuple(first))
+
+    def testWriteIsCacheMiss(self):
+        sqlCalls = []
+        self.openCountingDb(sqlCalls).calculateField(self.slcIds, "sl", "cmp", '"awhc_v"', "percent")
+
+        writer = self.openDb()
+        writer.executeSql("insert into cmp (sl, cmp, percent, soilkey, slope, awhc_v) values (1000, 9, 10, 'AB000gl###N', 'A', 1.0)")
+        writer.conn.commit()
+
+        del sqlCalls[:]
+        self.openCountingDb(sqlCalls).calculateField(self.slcIds, "sl", "cmp", '"awhc_v"', "percent")
+        self.assertTrue(sqlCalls)
+
+    def testSourceTableKeptAcrossUnrelatedWrites(self):
+        db = self.openDb()
+        db.createNormalizedSoilKeyColumns(["cmp", "snf", "slf"], "soilkey")
+        for tableName in ["cmp", "snf", "slf"]:
+            db.saveSourceManifestEntry(tableName, {"sourcePath": tableName + ".dbf", "sizeBytes": 1, "mtime": 1.0, "contentHash": tableName})
+        db.conn.commit()
+
+        sqlCalls = []
+        first = self.openCountingDb(sqlCalls).calculateField(self.slcIds, "sl", "cmp", '"slope"', "percent")
+
+        # join table written to same db
+        writer = self.openDb()
+        writer.createJoinTable(join.createSoilJoinSpec(["cmp", "snf"], "sl", "soilkey", "A", "layer_no", 2), self.slcIds[:10])
+
+        del sqlCalls[:]
+        second = self.openCountingDb(sqlCalls).calculateField(self.slcIds, "sl", "cmp", '"slope"', "percent")
+        self.assertEqual(self.getCalculationSql(sqlCalls), [])
+        self.assertEqual(tuple(second), tuple(first))
+
+        # join table results follow its slc ids and soil tables
+        self.openCountingDb(sqlCalls).calculateField(self.slcIds, "sl", writer.joinTableName, '"ph"', "percent")
+        del sqlCalls[:]
+        self.openCountingDb(sqlCalls).calculateField(self.slcIds, "sl", writer.joinTableName, '"ph"', "percent")
+        self.assertEqual(self.getCalculationSql(sqlCalls), [])
+
+        writer.createJoinTable(join.createSoilJoinSpec(["cmp", "snf"], "sl", "soilkey", "A", "layer_no", 2), self.slcIds[:20])
+        del sqlCalls[:]
+        self.openCountingDb(sqlCalls).calculateField(self.slcIds, "sl", writer.joinTableName, '"ph"', "percent")
+        self.assertTrue(self.getCalculationSql(sqlCalls))
+
+        # snf reloaded from changed dbf
+        writer.saveSourceManifestEntry("snf", {"sourcePath": "snf.dbf", "sizeBytes": 1, "mtime": 2.0, "contentHash": "changed"})
+        writer.conn.commit()
+        del sqlCalls[:]
+        self.openCountingDb(sqlCalls).calculateField(self.slcIds, "sl", writer.joinTableName, '"ph"', "percent")
+        self.assertTrue(self.getCalculationSql(sqlCalls))
+
+        # cmp reloaded from changed dbf
+        writer.saveSourceManifestEntry("cmp", {"sourcePath": "cmp.dbf", "sizeBytes": 1, "mtime": 2.0, "contentHash": "changed"})
+        writer.conn.commit()
+        del sqlCalls[:]
+        self.openCountingDb(sqlCalls).calculateField(self.slcIds, "sl", "cmp", '"slope"', "percent")
+        self.assertTrue(self.getCalculationSql(sqlCalls))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+"""
+purpose:
+tests of aafc_headless soil db creation and incremental rebuild
+
+how:
+unittest on soil dbf's written by soil_db_fixture. run from this directory; python -m unittest discover
+
+license:
+gpl3
+
+developer:
+richard burcher
+richardburcher@gmail.com
+2014
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+# adds soil modules to path
+import soil_db_fixture
+
+import aafc_headless as headless
+import aafc_join as join
+import aafc_io as inout
+
+
+class CreateSoilDbTest(unittest.TestCase):
+    """
+    purpose:
+    soil db built from generated dbf's then rebuilt after dbf changes
+
+    notes:
+    built db has join tables of cmp-snf, parked in join cache, and cmp-slf. userNotes table is only kept if db not recreated
+    """
+
+    def setUp(self):
+        self.tmpDirectory = tempfile.mkdtemp()
+        self.dbPath = os.path.join(self.tmpDirectory, "soil.sqlite")
+        self.dbfPaths = soil_db_fixture.createSoilDbfs(self.tmpDirectory)
+
+        db, loadedTables = self.createSoilDb()
+        self.assertEqual(loadedTables, ["cmp", "slf", "snf"])
+
+        for tableNames in (["cmp", "snf"], ["cmp", "slf"]):
+            joinSpec = join.createSoilJoinSpec(tableNames, "sl", "soilkey", "A", "layer_no", 1)
+            db.createJoinTable(joinSpec, range(1000, 1030), useCache=True)
+
+        db.executeSql("create table userNotes(note TEXT)")
+        db.conn.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDirectory)
+
+    def createSoilDb(self):
+        db, loadedTables, loadMessages = headless.createSoilDb(self.dbPath, self.dbfPaths, self.tmpDirectory)
+        self.addCleanup(db.conn.close)
+
+        return db, sorted(loadedTables)
+
+    def rewriteDbf(self, tableName, seed):
+        changedDirectory = tempfile.mkdtemp(dir=self.tmpDirectory)
+        changedDbfPaths = soil_db_fixture.createSoilDbfs(changedDirectory, seed={tableName: seed})
+        shutil.copy(changedDbfPaths[tableName], self.dbfPaths[tableName])
+
+        # modified time may be equal within file system time resolution
+        os.utime(self.dbfPaths[tableName], (1, 1))
+
+    def getJoinSignatures(self, db):
+        sql = "select joinSignature from %s" %(db.joinStateTable)
+
+        return sorted([x[0] for x in db.executeSql(sql)])
+
+    def getJoinCacheTableNames(self, db):
+        return [x for x in db.getTableNames() if x.startswith(db.joinCacheTablePrefix)]
+
+    def testUnchangedReloadsNothing(self):
+        # content unchanged under new modified time
+        os.utime(self.dbfPaths["snf"], (1, 1))
+
+        db, loadedTables = self.createSoilDb()
+
+        self.assertEqual(loadedTables, [])
+        self.assertTrue(db.tableExists("userNotes"))
+        self.assertEqual(len(self.getJoinSignatures(db)), 2)
+        self.assertEqual(len(self.getJoinCacheTableNames(db)), 1)
+
+    def testChangedSnfReloadsOnlySnf(self):
+        self.rewriteDbf("snf", 2)
+
+        db, loadedTables = self.createSoilDb()
+
+        self.assertEqual(loadedTables, ["snf"])
+        self.assertTrue(db.tableExists("userNotes"))
+        self.assertEqual(db.getChangedSourceTables(self.dbfPaths)[:2], ([], []))
+
+        # reloaded snf has rows of changed dbf, derived columns and indexes
+        io = inout.Io(tempSystemDirectoryPath=self.tmpDirectory)
+        with open(self.dbfPaths["snf"], "rb") as fileObj:
+            numberOfRecords, headerLength, recordLength, fields = io.readDbfHeader(fileObj)
+            expected = [(soilKey, drainage, float(ph)) for soilKey, drainage, ph in io.iterateDbfRecords(fileObj, numberOfRecords, headerLength, recordLength, fields, "cp1250")]
+        self.assertEqual(db.executeSql("select soilkey, drainage, ph from snf order by rowid"), expected)
+        self.assertTrue(db.hasNormalizedSoilKeyColumns("snf"))
+        sql = "select count(*) from sqlite_master where type = 'index' and tbl_name = 'snf'"
+        self.assertTrue(db.executeSql(sql)[0][0] > 0)
+
+        # active and parked joins of snf dropped. cmp-slf join kept
+        signatures = self.getJoinSignatures(db)
+        self.assertEqual(len(signatures), 1)
+        self.assertEqual(join.getSignatureTableNames(signatures[0]), ["cmp", "slf"])
+        self.assertEqual(self.getJoinCacheTableNames(db), [])
+        self.assertTrue(db.tableExists(db.joinTableName))
+
+    def testChangedCmpRebuildsAll(self):
+        self.rewriteDbf("cmp", 2)
+
+        db, loadedTables = self.createSoilDb()
+
+        self.assertEqual(loadedTables, ["cmp", "slf", "snf"])
+        self.assertFalse(db.tableExists("userNotes"))
+        self.assertFalse(db.tableExists(db.joinTableName))
+
+    def testMissingManifestRebuildsAll(self):
+        db, loadedTables = self.createSoilDb()
+        db.executeSql("drop table %s" %(db.sourceManifestTable))
+        db.conn.commit()
+
+        db, loadedTables = self.createSoilDb()
+
+        self.assertEqual(loadedTables, ["cmp", "slf", "snf"])
+        self.assertFalse(db.tableExists("userNotes"))
+        self.assertEqual(db.getChangedSourceTables(self.dbfPaths)[:2], ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
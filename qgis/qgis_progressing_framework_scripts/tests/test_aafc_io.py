@@ -0,0 +1,203 @@
+"""
+purpose:
+tests of aafc_io.Io csv and dbf loading
+
+how:
+unittest. run from this directory; python -m unittest discover
+
+license:
+gpl3
+
+developer:
+richard burcher
+richardburcher@gmail.com
+2014
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import types
+import unittest
+
+# adds soil modules to path
+import soil_db_fixture
+
+import aafc_io as inout
+
+
+class ConvertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDirectory = tempfile.mkdtemp()
+        self.csvPath = os.path.join(self.tmpDirectory, "snf.csv")
+        self.dbPath = os.path.join(self.tmpDirectory, "soil.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDirectory)
+
+    def writeCsv(self, lines):
+        csvFile = open(self.csvPath, "w")
+        csvFile.write("\n".join(lines) + "\n")
+        csvFile.close()
+
+    def testLongRowsTruncated(self):
+        self.writeCsv(["soilkey,ph", "A1,\"1,234.5\"", "A2,6.5,extra"])
+
+        rowCount, rowsPerSecond = inout.Io().convert(self.csvPath, self.dbPath, "snf")
+        self.assertEqual(rowCount, 2)
+        self.assertTrue(rowsPerSecond > 0)
+        conn = sqlite3.connect(self.dbPath)
+        self.assertEqual(conn.execute("select soilkey, ph from snf order by rowid").fetchall(), [(u"A1", 1234.5), (u"A2", 6.5)])
+        conn.close()
+
+    def testShortRowReportsLine(self):
+        self.writeCsv(["soilkey,ph", "A1,5.5", "A2"])
+
+        with self.assertRaises(ValueError) as context:
+            inout.Io().convert(self.csvPath, self.dbPath, "snf")
+        self.assertIn("line 3", str(context.exception))
+
+
+class DbfTest(unittest.TestCase):
+    """
+    purpose:
+    direct dbf load of generated dbase III files
+
+    notes:
+    qgis csv fallback replaced by stand in qgis.core writing csv of expected rows
+    """
+
+    fields = [("SOILKEY", "C", 12, 0), ("CMP", "N", 3, 0), ("PH", "N", 6, 2), ("SURVEYED", "D", 8, 0), ("WET", "L", 1, 0)]
+
+    def setUp(self):
+        self.tmpDirectory = tempfile.mkdtemp()
+        self.dbfPath = os.path.join(self.tmpDirectory, "snf.dbf")
+        self.dbPath = os.path.join(self.tmpDirectory, "soil.sqlite")
+        self.io = inout.Io(tempSystemDirectoryPath=self.tmpDirectory)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDirectory)
+
+    def readRows(self, sql):
+        conn = sqlite3.connect(self.dbPath)
+        rows = conn.execute(sql).fetchall()
+        conn.close()
+
+        return rows
+
+    def iterateRecords(self, readRecords):
+        with open(self.dbfPath, "rb") as fileObj:
+            numberOfRecords, headerLength, recordLength, fields = self.io.readDbfHeader(fileObj)
+            return list(self.io.iterateDbfRecords(fileObj, numberOfRecords, headerLength, recordLength, fields, "cp1250", readRecords))
+
+    def testHeader(self):
+        soil_db_fixture.createDbf(self.dbfPath, self.fields, [("AB001", "1", "5.50", "20140315", "T")] * 3)
+
+        with open(self.dbfPath, "rb") as fileObj:
+            self.assertEqual(self.io.readDbfHeader(fileObj), (3, 32 + 32 * 5 + 1, 1 + 30, self.fields))
+
+    def testValues(self):
+        records = [
+            ("AB001", "1", "5.50", "20140315", "T"),
+            # blank numeric, date and logical
+            ("AB002", "", "", "", ""),
+            # overflowed numerics, logical not set
+            ("AB003", "***", "******", "20140316", "?"),
+            ("AB004", "12", "-0.25", "19991231", "N"),
+            ]
+        soil_db_fixture.createDbf(self.dbfPath, self.fields, records)
+
+        self.assertEqual(self.io.loadDbfIntoDb(self.dbfPath, self.dbPath, "snf"), 4)
+        self.assertEqual(self.readRows("select soilkey, cmp, ph, surveyed, wet from snf order by rowid"), [
+            (u"AB001", 1, 5.5, u"2014/03/15", u"T"),
+            (u"AB002", None, None, None, None),
+            (u"AB003", None, None, u"2014/03/16", None),
+            (u"AB004", 12, -0.25, u"1999/12/31", u"N"),
+            ])
+        self.assertEqual([(x[1], x[2]) for x in self.readRows("pragma table_info(snf)")],
+            [(u"SOILKEY", u"TEXT"), (u"CMP", u"INTEGER"), (u"PH", u"REAL"), (u"SURVEYED", u"TEXT"), (u"WET", u"TEXT")])
+
+    def testDeletedRecordsSkipped(self):
+        records = [("AB%03d" % i, str(i), "", "", "") for i in range(5)]
+        soil_db_fixture.createDbf(self.dbfPath, self.fields, records, deleted=(0, 3))
+
+        self.assertEqual(self.io.loadDbfIntoDb(self.dbfPath, self.dbPath, "snf"), 3)
+        self.assertEqual(self.readRows("select soilkey from snf order by rowid"), [(u"AB001",), (u"AB002",), (u"AB004",)])
+        # batch of deleted records only
+        self.assertEqual([x[0] for x in self.iterateRecords(1)], ["AB001", "AB002", "AB004"])
+
+    def testCp1250TextInAsciiBatch(self):
+        # capital z with caron and e with ogonek in cp1250
+        records = [("AB%03d" % i, "1", "", "", "") for i in range(4)]
+        records[2] = ("\x8eele\xea", "1", "", "", "")
+        soil_db_fixture.createDbf(self.dbfPath, self.fields, records)
+
+        expected = [u"AB000", u"AB001", u"\u017dele\u0119", u"AB003"]
+        self.io.loadDbfIntoDb(self.dbfPath, self.dbPath, "snf")
+        self.assertEqual([x[0] for x in self.readRows("select soilkey from snf order by rowid")], expected)
+
+        # only batches holding non ascii text are decoded
+        for readRecords, valueTypes in ((1, [str, str, unicode, str]), (2, [str, str, unicode, unicode]), (10, [unicode] * 4)):
+            values = [x[0] for x in self.iterateRecords(readRecords)]
+            self.assertEqual(values, expected)
+            self.assertEqual([type(x) for x in values], valueTypes)
+
+    def testRecordLengthMismatchRaises(self):
+        soil_db_fixture.createDbf(self.dbfPath, self.fields, [("AB001", "1", "5.50", "20140315", "T")], recordLength=32)
+
+        with self.assertRaises(ValueError):
+            self.io.loadDbfIntoDb(self.dbfPath, self.dbPath, "snf")
+
+    def testRecordLengthMismatchLoadedThroughCsv(self):
+        soil_db_fixture.createDbf(self.dbfPath, self.fields, [("AB001", "1", "5.50", "20140315", "T")], recordLength=32)
+        self.installQgisCore(["SOILKEY,CMP", "AB001,1"])
+
+        io = inout.Io(inSoilDbPath=self.dbPath, tempSystemDirectoryPath=self.tmpDirectory)
+        self.assertTrue(io.addDbfToDb(self.dbfPath, "snf"))
+
+        self.assertEqual(self.layerPaths, [self.dbfPath])
+        self.assertEqual(self.readRows("select soilkey, cmp from snf"), [(u"AB001", 1)])
+        self.assertIn("from csv", io.loadMessages[-1])
+
+    def installQgisCore(self, csvLines):
+        """
+        purpose:
+        stand in qgis.core module; vector layer of dbf path written as csv lines
+        """
+
+        self.layerPaths = []
+        test = self
+
+        class QgsVectorLayer:
+            def __init__(self, path, name, provider):
+                test.layerPaths.append(path)
+            def isValid(self):
+                return True
+
+        class QgsVectorFileWriter:
+            @staticmethod
+            def writeAsVectorFormat(layer, path, *args):
+                with open(path + ".csv", "w") as csvFile:
+                    csvFile.write("\n".join(csvLines) + "\n")
+
+        qgis = types.ModuleType("qgis")
+        qgis.core = types.ModuleType("qgis.core")
+        qgis.core.QgsVectorLayer = QgsVectorLayer
+        qgis.core.QgsVectorFileWriter = QgsVectorFileWriter
+
+        for name, module in (("qgis", qgis), ("qgis.core", qgis.core)):
+            self.addCleanup(self.restoreModule, name, sys.modules.get(name))
+            sys.modules[name] = module
+
+    def restoreModule(self, name, module):
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
+
+
+if __name__ == "__main__":
+    unittest.main()